@@ -14,11 +14,11 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Provides the AbstractRecipe class"""
 
-import multiprocessing
+import hashlib
 import os
 
 import abkhazia.utils as utils
-from abkhazia.kaldi import kaldi_path, Abkhazia2Kaldi
+from abkhazia.kaldi import kaldi_path, Abkhazia2Kaldi, ScpReader
 
 
 class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
@@ -41,14 +41,39 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
     meta (abkhazia.utils.Meta): meta information on recipe creation
       and execution
 
+    profiler (abkhazia.utils.profiler.Profiler): wall time, CPU time
+      and peak memory of the recipe stages, saved in
+      `output_dir`/profile.json
+
     njobs (int): number of CPU cores to use when doing parallel
       computation
 
     recipe_dir (path): the directory where to write the Kaldi recipe
-      (`output_dir`/recipe by default)
-
-    delete_recipe (bool): delete the recipe directory after execution
-      (default is True)
+      (`output_dir`/recipe by default). When the 'scratch-directory'
+      entry of the abkhazia configuration is set, the recipe is
+      staged in that directory (usually on a local disk or tmpfs),
+      only the exported files being copied to `output_dir`.
+
+    delete_recipe (bool): delete the recipe directory after a
+      successful execution (default is True). On failure the recipe
+      directory is kept so that the execution can be resumed. When
+      True, the intermediate files of the recipe are deleted as soon
+      as the stages reading them are completed, see
+      _intermediate_files(). When False (as with the --recipe
+      option), they are kept for inspection unless a disk budget is
+      defined.
+
+    disk_budget (abkhazia.utils.disk_budget.DiskBudget): peak size of
+      the recipe directory, measured at the end of each stage and
+      appended to the comment of meta.txt. When the
+      'recipe-disk-budget' entry of the abkhazia configuration is
+      set, the intermediate files are always deleted once no longer
+      needed, and the recipe fails if the directory still exceeds
+      that size at the end of a stage.
+
+    resume (bool): when True, compute() skips the stages completed
+      by a previous execution in the same recipe directory, with the
+      same inputs and parameters (default is False)
 
 
     Methods:
@@ -57,9 +82,28 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
     Each concrete recipe must implmements/specializes the following
     methods: check_parameters, create, run and export.
 
+    The run method is made of stages wrapped in _run_stage(). When
+    compute() is called with `resume` set to True, each stage
+    completed by a previous execution is skipped, until a stage is
+    executed: all the following ones are then executed as well.
+
     """
     name = NotImplemented
 
+    intermediate_ratio = 2.0
+    """Estimated size of the recipe directory relative to the wavs size
+
+    Used to check the free space of the scratch directory
+    """
+
+    memory_stages = {}
+    """The stages running the JOB-parallel programs sized by njobs
+
+    A dict stage name -> prior coefficient of the memory model (see
+    abkhazia.utils.jobs.sizing). Each stage is calibrated apart, for
+    each recipe class.
+    """
+
     def __init__(self, corpus, output_dir, log=utils.logger.null_logger()):
         super(AbstractRecipe, self).__init__(log=log)
         self.njobs = utils.default_njobs()
@@ -71,68 +115,426 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
             os.makedirs(output_dir)
         self.output_dir = os.path.abspath(output_dir)
 
-        # init the recipe dir as a subdirectory of output_dir
-        self.recipe_dir = os.path.join(self.output_dir, 'recipe')
+        # init the recipe dir as a subdirectory of output_dir, or on
+        # the scratch directory
+        self.recipe_dir = self._init_recipe_dir()
         if not os.path.isdir(self.recipe_dir):
             os.makedirs(self.recipe_dir)
 
         # if True, delete the recipe_dir on instance destruction
         self.delete_recipe = True
 
+        # stages checkpointing, see _run_stage()
+        self.resume = False
+        self._markers = utils.checkpoint.StageMarkers(
+            os.path.join(self.recipe_dir, 'stages'))
+        self._fingerprint = None
+        self._dirty = False
+        self._partial = False
+        self._completed = False
+
+        # when True, njobs is not checked again (see compute)
+        self._njobs_fixed = False
+
+        # resources used by each stage
+        self.profiler = utils.profiler.Profiler()
+
+        # disk usage of the recipe directory
+        self.disk_budget = utils.disk_budget.DiskBudget.from_config(
+            self.recipe_dir, log=self.log)
+        self._stages = {}
+
         # init the abkhazia2kaldi converter
         self.a2k = Abkhazia2Kaldi(
             self.corpus, self.recipe_dir, name=self.name, log=self.log)
 
     def __del__(self):
         try:
-            if self.delete_recipe:
+            if self.delete_recipe and self._completed:
                 utils.remove(self.recipe_dir, safe=True)
         except AttributeError:  # if raised from __init__
             pass
 
+    def _init_recipe_dir(self):
+        """Return the recipe directory, staged on scratch if possible
+
+        The recipe is staged in the 'scratch-directory' from the
+        abkhazia configuration, if defined and if it has enough free
+        space for the estimated size of the recipe. Its name is
+        derived from `output_dir`, so that an interrupted recipe can
+        be resumed from the scratch directory.
+
+        The recipe is never staged when the jobs are run on a cluster:
+        the scratch is usually local to the submission host and not
+        visible from the compute nodes.
+
+        """
+        default = os.path.join(self.output_dir, 'recipe')
+
+        config = utils.config
+        scratch = (config.get('abkhazia', 'scratch-directory').strip()
+                   if config.has_option('abkhazia', 'scratch-directory')
+                   else '')
+        if not scratch:
+            return default
+
+        if isinstance(utils.jobs.get_backend(),
+                      utils.jobs.backends.AbstractClusterBackend):
+            self.log.debug(
+                'jobs run on a cluster, not staging recipe in %s', scratch)
+            return default
+
+        if not os.path.isdir(scratch):
+            os.makedirs(scratch)
+
+        needed = self._intermediate_size()
+        free = utils.free_space(scratch)
+        if free < needed:
+            self.log.warning(
+                'not enough space on scratch %s (%.1f GB free, %.1f GB '
+                'needed), using %s', scratch, free / float(2**30),
+                needed / float(2**30), default)
+            return default
+
+        recipe_dir = os.path.join(scratch, 'abkhazia-{}-{}'.format(
+            self.name, hashlib.sha1(self.output_dir).hexdigest()[:12]))
+        self.log.info('staging recipe in %s', recipe_dir)
+        return recipe_dir
+
+    def _intermediate_size(self):
+        """Return the estimated size in bytes of the recipe directory
+
+        Estimated as `intermediate_ratio` times the size of the corpus
+        wavs.
+
+        """
+        size = 0
+        for wav in self.corpus.wavs:
+            try:
+                size += os.path.getsize(
+                    os.path.join(self.corpus.wav_folder or '', wav))
+            except OSError:
+                pass
+        return int(self.intermediate_ratio * size)
+
     def _run_command(self, command, verbose=True):
-        """Run the command as a subprocess in a Kaldi environment"""
+        """Run the command as a subprocess in a Kaldi environment
+
+        While the command is running, the progress of its Kaldi jobs
+        is periodically reported to the log.
+
+        """
         if verbose is True:
             self.log.info('running %s', command)
 
-        utils.jobs.run(
+        stats = utils.jobs.run(
             command,
             stdout=self.log.debug,
             env=kaldi_path(),
-            cwd=self.recipe_dir)
+            cwd=self.recipe_dir,
+            monitor=self._progress_monitor(command))
+        self.profiler.add_command(command, stats)
+
+    def _progress_monitor(self, command=''):
+        """Return a ProgressMonitor on the jobs run in the recipe"""
+        return utils.progress.ProgressMonitor(
+            self.recipe_dir, command=command,
+            total_utterances=len(self.corpus.utt2spk), log=self.log)
+
+    def _run_commands(self, commands, verbose=True):
+        """Run the commands in parallel in a Kaldi environment
+
+        The commands run as local subprocesses: at most self.njobs
+        commands, and no more than the local cores, are running at
+        once. The first failed command cancels the others.
+
+        """
+        if verbose is True:
+            for command in commands:
+                self.log.info('running %s', command)
+
+        stats = utils.jobs.run_many(
+            commands,
+            stdout=self.log.debug,
+            env=kaldi_path(),
+            cwd=self.recipe_dir,
+            max_jobs=min(self.njobs, utils.default_njobs(local=True)),
+            monitor=self._progress_monitor('\n'.join(commands)))
+        for command, stat in zip(commands, stats):
+            self.profiler.add_command(command, stat)
+
+    def _run_stage(self, name, function, params=(), paths=(),
+                   on_skip=None):
+        """Run a stage of the recipe, skip it if already completed
+
+        The stage is skipped if `self.resume` is True, no previous
+        stage has been executed and the stage has already been
+        completed with the same fingerprint. The fingerprint of a
+        stage is computed from the input `paths`, the `params` and the
+        fingerprint of the previous stage.
+
+        Parameters:
+        -----------
+
+        name (str): the name of the stage
+
+        function (callable): executes the stage, without arguments
+
+        params (sequence): parameters of the stage
+
+        paths (sequence): input files or directories of the stage
+
+        on_skip (callable): called without arguments if the stage is
+          skipped
+
+        Return the value returned by `function` or None if skipped
+
+        """
+        self._fingerprint = utils.checkpoint.fingerprint(
+            paths=paths, params=[self._fingerprint, name] + list(params))
+        self._stages[name] = (function, self._fingerprint)
+
+        state = self._markers.state(name, self._fingerprint)
+        if self.resume and not self._dirty and state == 'done':
+            self.log.info('skipping stage %s, already completed', name)
+            self.profiler.skip(name)
+            if on_skip is not None:
+                on_skip()
+            self._clean_intermediates()
+            return None
+
+        # the intermediate files read by that stage may have been
+        # deleted by a previous execution
+        self._regenerate_intermediates(name)
+
+        # a stage started with the same fingerprint can be resumed
+        # from where it stopped (see NeuralNetwork for an exemple)
+        self._partial = self.resume and not self._dirty and state == 'started'
+        self._dirty = True
+
+        self._markers.start(name, self._fingerprint)
+        with self.profiler.stage(name, log_dir=self.recipe_dir):
+            result = function()
+        self._markers.done(name, self._fingerprint)
+        self._partial = False
+
+        self._clean_intermediates()
+        self.disk_budget.check()
+        return result
+
+    def _intermediate_files(self):
+        """Return the intermediate files written by the recipe stages
+
+        Return a dict stage -> (consumers, patterns) where `patterns`
+        are glob patterns (relative to recipe_dir) of the files
+        written by the stage and `consumers` are the stages reading
+        them. The files are not exported and are deleted once all
+        their consumers are completed, if self.delete_recipe is
+        True. This method should be specialized in child classes.
+
+        """
+        return {}
+
+    def _clean_intermediates(self):
+        """Delete the intermediate files no longer needed
+
+        The disk usage is measured before the deletion. The files are
+        kept if the recipe directory is kept and no disk budget is
+        defined.
+
+        """
+        self.disk_budget.measure()
+        if not self.delete_recipe and self.disk_budget.max_size is None:
+            return
+
+        done = [n for n in self._stages
+                if self._markers.state(n, self._stages[n][1]) == 'done']
+        for stage, (consumers, patterns) in sorted(
+                self._intermediate_files().iteritems()):
+            if (stage in done and all(c in done for c in consumers)
+                    and not self._markers.cleaned(stage)):
+                freed = self.disk_budget.clean(patterns)
+                self._markers.clean(stage)
+                if freed:
+                    self.log.debug(
+                        'deleted intermediate files of stage %s (%.1f MB)',
+                        stage, freed / float(2**20))
+
+    def _regenerate_intermediates(self, name):
+        """Run again the stages whose files are read by the stage `name`
+
+        When resuming a recipe, the stages writing the intermediate
+        files read by `name` may be skipped, their files having been
+        deleted by a previous execution. Those stages are executed
+        again to regenerate them, recursively.
+
+        """
+        for stage, (consumers, _) in sorted(
+                self._intermediate_files().iteritems()):
+            if (stage != name and name in consumers
+                    and stage in self._stages
+                    and self._markers.cleaned(stage)):
+                self.log.info(
+                    'running stage %s again to regenerate its '
+                    'intermediate files', stage)
+                self._regenerate_intermediates(stage)
+                function, fingerprint = self._stages[stage]
+                self._markers.start(stage, fingerprint)
+                with self.profiler.stage(stage, log_dir=self.recipe_dir):
+                    function()
+                self._markers.done(stage, fingerprint)
+
+    def _input_paths(self):
+        """Return the input directories of the recipe
+
+        Their fingerprint is used to validate the 'prepare data'
+        stage. This method should be specialized in child classes.
+
+        """
+        return []
+
+    def _input_params(self):
+        """Return the parameters used to create the recipe
+
+        They are used to validate the 'prepare data' stage. This
+        method should be specialized in child classes.
+
+        """
+        return []
 
     def _check_njobs(self, local=False):
         """Garanties a valid njobs parameter
 
-        If we run jobs locally, make sure we have enough cores. In all
-        case setup njobs = min(njobs, number of speakers in the
-        corpus), because Kaldi does not support to have more jobs than
-        speakers.
+        Make sure the job backend can run njobs at once (the number
+        of cores if `local` is True, the backend capacity
+        otherwise). In all case setup njobs = min(njobs, number of
+        speakers in the corpus), because Kaldi does not support to
+        have more jobs than speakers.
 
-        In case njobs is corrected, log a warning and reduce to number
-        of cores available.
+        Finally reduce njobs so that the jobs fit in memory (see
+        _check_memory). In case njobs is corrected, log a warning.
 
-        """
-        old_njobs = self.njobs
+        Nothing is done once njobs is fixed by compute().
 
-        # number of CPUs on the system
-        ncores = multiprocessing.cpu_count()
+        """
+        if self._njobs_fixed:
+            return
 
-        # True if we run through qsub
-        queued = not local or 'queue' in utils.config.get('kaldi', 'train-cmd')
+        old_njobs = self.njobs
 
-        # number of speakers in the corpus
-        nspks = len(self.corpus.spks())
+        # number of jobs the backend can run at once
+        capacity = utils.default_njobs(local=local)
 
-        if not queued and ncores < self.njobs:
-            self.njobs = ncores
+        # number of speakers in the corpus (once filtered from too
+        # short utterances)
+        nspks = len(self.a2k.corpus.spks())
 
-        self.njobs = min(nspks, self.njobs)
+        self.njobs = min(capacity, nspks, self.njobs)
 
         if old_njobs != self.njobs:
             self.log.warning(
                 'asking %s cores but reduced to %s', old_njobs, self.njobs)
 
+        self._check_memory(local=local)
+
+    def _memory_predictors(self):
+        """Return the parameters of the memory model of the recipe jobs
+
+        Return a dict with the entries 'dim' (the features
+        dimension), 'model_size' (the size in bytes of the models
+        loaded by a job) and 'beam' (the decoding beam or None), see
+        abkhazia.utils.jobs.sizing. This method should be specialized
+        in child classes.
+
+        """
+        return {'dim': 39, 'model_size': 0, 'beam': None}
+
+    @staticmethod
+    def _features_dim(feat_dir, default=39):
+        """Return the dimension of the features in `feat_dir`
+
+        Read from the first utterance of `feat_dir`/feats.scp, return
+        `default` if the features cannot be read.
+
+        """
+        try:
+            with ScpReader(os.path.join(feat_dir, 'feats.scp')) as feats:
+                return feats[feats.keys()[0]].shape[1]
+        except (IOError, OSError, IndexError):
+            return default
+
+    @staticmethod
+    def _files_size(*paths):
+        """Return the total size in bytes of the existing `paths`"""
+        return sum(os.path.getsize(p) for p in paths if os.path.isfile(p))
+
+    def _spk2duration(self):
+        """Return a dict speaker -> speech duration in the recipe"""
+        corpus = self.a2k.corpus
+        spk2dur = {}
+        for utt, dur in corpus.utt2duration().iteritems():
+            spk = corpus.utt2spk[utt]
+            spk2dur[spk] = spk2dur.get(spk, 0.0) + dur
+        return spk2dur
+
+    def _check_memory(self, local=False):
+        """Reduce njobs so that the jobs running at once fit in memory
+
+        The peak memory of a job is estimated by a MemoryModel
+        calibrated on the previous runs of the recipe, for each stage
+        in `memory_stages`. This applies only when the jobs are run on
+        the local machine.
+
+        """
+        if not self.memory_stages or not local and isinstance(
+                utils.jobs.get_backend(),
+                utils.jobs.backends.AbstractClusterBackend):
+            return
+
+        model = utils.jobs.MemoryModel()
+        durations = self._spk2duration()
+        predictors = self._memory_predictors()
+        njobs = min(
+            model.njobs(self._memory_key(stage), durations,
+                        max_jobs=self.njobs, prior=prior, **predictors)
+            for stage, prior in sorted(self.memory_stages.items()))
+
+        if njobs < self.njobs:
+            self.log.warning(
+                'reducing from %s to %s jobs to fit in memory',
+                self.njobs, njobs)
+            self.njobs = njobs
+
+    def _memory_key(self, stage):
+        """Return the key of the `stage` in the memory model"""
+        return '{}.{}'.format(type(self).__name__, stage)
+
+    def _calibrate_memory(self):
+        """Calibrate the memory model on the peak memory of the stages
+
+        Only the stages in `memory_stages` executed by this run are
+        considered, each one with its own peak memory.
+
+        """
+        frames = None
+        for stage in sorted(self.memory_stages):
+            maxrss = max([s['maxrss'] for s in self.profiler.stages
+                          if s['name'] == stage and not s['skipped']]
+                         or [0])
+            if maxrss <= 0:
+                continue
+
+            if frames is None:
+                frames = utils.jobs.sizing.job_frames(
+                    self._spk2duration(), self.njobs)
+            try:
+                utils.jobs.MemoryModel().calibrate(
+                    self._memory_key(stage), frames, maxrss=maxrss,
+                    **self._memory_predictors())
+            except (IOError, OSError) as err:
+                self.log.debug(
+                    'cannot calibrate the memory model: %s', err)
+
     def check_parameters(self):
         """Perform sanity checks on recipe parameters, raise on error
 
@@ -177,10 +579,86 @@ class AbstractRecipe(utils.abkhazia_base.AbkhaziaBase):
         This method must be specialized in child classes.
 
         """
+        # the last stages are measured as well
+        self.disk_budget.measure()
+        self.meta.comment = '. '.join(c for c in (
+            self.meta.comment,
+            'peak disk usage of the recipe: {:.2f} GB'.format(
+                self.disk_budget.peak / float(2**30))) if c)
         self.meta.save(os.path.join(self.output_dir, 'meta.txt'))
 
+    def _njobs_file(self):
+        return os.path.join(self.recipe_dir, 'stages', 'njobs')
+
+    def _read_njobs(self):
+        """Return the (requested, effective) njobs of a previous execution
+
+        Return None if the data has not been prepared yet.
+
+        """
+        try:
+            with open(self._njobs_file(), 'r') as njobs:
+                requested, effective = njobs.read().split()
+            return int(requested), int(effective)
+        except (IOError, ValueError):
+            return None
+
+    def _write_njobs(self, requested):
+        """Save the `requested` and effective njobs once data is prepared"""
+        with open(self._njobs_file(), 'w') as out:
+            out.write('{} {}\n'.format(requested, self.njobs))
+
     def compute(self):
-        """Create, run and export the recipe"""
-        self.create()
-        self.run()
-        self.export()
+        """Create, run and export the recipe
+
+        If `self.resume` is True, skip the stages completed during a
+        previous execution with the same inputs.
+
+        """
+        self._fingerprint = None
+        self._dirty = False
+        self._stages = {}
+
+        try:
+            # the data is split for the effective njobs of a previous
+            # execution with the same requested njobs, it is reused as
+            # is when resuming. Else the effective njobs is computed
+            # from the backend capacity and the available memory.
+            requested, saved = self.njobs, self._read_njobs()
+            self._njobs_fixed = False
+            if self.resume and saved is not None and saved[0] == requested:
+                self.njobs = saved[1]
+            else:
+                self._check_njobs()
+            self._njobs_fixed = True
+
+            corpus = utils.checkpoint.corpus_fingerprint(self.corpus)
+            self._run_stage(
+                'prepare data', self.create,
+                params=[self.njobs, corpus] + self._input_params(),
+                paths=self._input_paths(),
+                on_skip=self.check_parameters)
+            self._write_njobs(requested)
+
+            self.run()
+
+            self._run_stage('export', self.export)
+        except:
+            self.log.info(
+                'the recipe is kept in %s, use --resume to resume it',
+                self.recipe_dir)
+            raise
+        finally:
+            self._njobs_fixed = False
+
+            # the profile is saved even on failure, next to meta.txt
+            self.profiler.save(
+                os.path.join(self.output_dir, 'profile.json'))
+
+        self.log.info(
+            'resources used by %s:\n%s', self.name, self.profiler.summary())
+        self._calibrate_memory()
+        self._completed = True
+
+        if not self.delete_recipe:
+            self.log.info('the recipe is kept in %s', self.recipe_dir)
@@ -85,6 +85,8 @@ class AbstractAcousticModel(AbstractRecipe):
     # Linked to 'abkhazia acoustic' from command line
     name = 'acoustic'
 
+    memory_stages = {'train': 3.0}
+
     model_type = NotImplemented
 
     options = NotImplemented
@@ -128,8 +130,10 @@ class AbstractAcousticModel(AbstractRecipe):
     def create(self):
         super(AbstractAcousticModel, self).create()
 
-        # copy features scp files in the recipe_dir
+        # copy features scp files in the recipe_dir and split them in
+        # duration balanced jobs
         Features.export_features(self.input_dir, self.data_dir)
+        self.a2k.setup_split_data(self.njobs)
 
         # create lang directory with L.fst
         lang = self.lang_args
@@ -164,6 +168,18 @@ class AbstractAcousticModel(AbstractRecipe):
     def run(self):
         raise NotImplementedError
 
+    def _input_paths(self):
+        return [self.input_dir]
+
+    def _intermediate_files(self):
+        # the models of the training iterations are not exported, the
+        # final model being linked to (or copied from) the last one
+        return {'train': (
+            ['train'], [os.path.join('exp', self.model_type, '[0-9]*')])}
+
+    def _input_params(self):
+        return [self.lang_args]
+
     def _run_am_command(self, command, target, message):
         self.log.info(message)
         if not os.path.isdir(target):
@@ -83,7 +83,8 @@ class Monophone(AbstractAcousticModel):
         features.Features.check_features(self.input_dir, cmvn=True)
 
     def run(self):
-        self._train_mono()
+        self._run_stage(
+            'train', self._train_mono, params=[self.options])
 
     def _train_mono(self):
         # Flat start and monophone training, with delta-delta features.
@@ -99,7 +100,7 @@ class Monophone(AbstractAcousticModel):
             '--realign-iters {realign} {data} {lang} {target}'
             .format(
                 njobs=self.njobs,
-                cmd=utils.config.get('kaldi', 'train-cmd'),
+                cmd=utils.kaldi_cmd('train'),
                 transition=self._opt('transition-scale'),
                 acoustic=self._opt('acoustic-scale'),
                 selfloop=self._opt('self-loop-scale'),
@@ -129,6 +130,9 @@ class MonophoneFromAlignment(Monophone):
         self.alignment_file = alignment_file
         self.options['realign-iterations'] = 0
 
+    def _input_paths(self):
+        return [self.input_dir, self.alignment_file]
+
     def create(self):
         super(MonophoneFromAlignment, self).create()
 
@@ -146,12 +150,6 @@ class MonophoneFromAlignment(Monophone):
             self.lang_args['position_dependent_phones'],
             log=self.log)
 
-        # split the data for njobs processing, this normally done in
-        # the run() step but we need here to split the alignment
-        # before calling the train_mono.sh script
-        self._run_command(
-            './utils/split_data.sh data/acoustic {}'.format(self.njobs))
-
         # build a dict utt -> split to split the alignement following
         # the data split distribution
         split_utt = {}
@@ -163,8 +163,35 @@ class NeuralNetwork(AbstractAcousticModel):
             'Must be pnorm-input-dim % pnorm-output-dim == 0, but it is '
             'pnorm-input-dim={} and pnorm-output-dim={}'.format(idim, odim))
 
+    def create(self):
+        super(NeuralNetwork, self).create()
+
+        # the egs are extracted from the input model alignments, so
+        # the data must be split as they were when aligned
+        am_njobs = int(open(os.path.join(self.am_dir, 'num_jobs')).read())
+        if am_njobs != self.njobs:
+            self.a2k.setup_split_data(am_njobs)
+
+    def _input_paths(self):
+        return [self.input_dir, self.am_dir]
+
     def run(self):
-        self._train_pnorm_fast()
+        self._run_stage(
+            'train', self._train_pnorm_fast, params=[self.options])
+
+    def _resume_iteration(self, target):
+        """Return the training iteration where to resume, or None
+
+        When resuming an interrupted training, train_pnorm_fast.sh
+        restarts from the last model <n>.mdl found in `target`.
+
+        """
+        if not self._partial or not os.path.isdir(target):
+            return None
+
+        iterations = [int(f.split('.')[0]) for f in os.listdir(target)
+                      if f.endswith('.mdl') and f.split('.')[0].isdigit()]
+        return max(iterations) if iterations else None
 
     def _train_pnorm_fast(self):
         message = 'training neural network'
@@ -196,8 +223,15 @@ class NeuralNetwork(AbstractAcousticModel):
                      for k, v in self.options.iteritems()
                      if k in self._egs_options))
 
+        # resume an interrupted training from its last iteration
+        stage_opt = ''
+        iteration = self._resume_iteration(target)
+        if iteration is not None:
+            self.log.info('resuming training at iteration %s', iteration)
+            stage_opt = '--stage {}'.format(iteration)
+
         # feeding the --cmd option
-        job_cmd = utils.config.get('kaldi', 'train-cmd')
+        job_cmd = utils.kaldi_cmd('train')
         if 'queue' in job_cmd:
             job_cmd += ' --config {}'.format(
                 pkg_resources.resource_filename(
@@ -208,6 +242,7 @@ class NeuralNetwork(AbstractAcousticModel):
             ' '.join((
                 'steps/nnet2/train_pnorm_fast.sh --cmd "{}"'.format(job_cmd),
                 nnet_opts, io_opt, egs_opts, num_threads_opt, combine_opt,
+                stage_opt,
                 '{data} {lang} {origin} {target}'.format(
                     data=self.data_dir,
                     lang=self.lang_dir,
@@ -43,6 +43,8 @@ class Triphone(AbstractAcousticModel):
     """
     model_type = 'tri'
 
+    memory_stages = {'align': 3.0, 'train': 3.0}
+
     options = {k: v for k, v in (
         kaldi.options.make_option(
             'transition-scale', default=1.0, type=float,
@@ -95,10 +97,20 @@ class Triphone(AbstractAcousticModel):
         utils.check_directory(
             self.mono_dir, ['tree', 'final.mdl', 'final.occs'])
 
+    def _input_paths(self):
+        return [self.input_dir, self.mono_dir]
+
+    def _intermediate_files(self):
+        files = super(Triphone, self)._intermediate_files()
+        files['align'] = (['train'], [os.path.join('exp', 'mono_ali')])
+        return files
+
     def run(self):
         align_dir = os.path.join(self.recipe_dir, 'exp', 'mono_ali')
-        self._align_si(align_dir)
-        self._train_deltas(align_dir)
+        self._run_stage(
+            'align', lambda: self._align_si(align_dir),
+            params=[self.options])
+        self._run_stage('train', lambda: self._train_deltas(align_dir))
 
     def _align_si(self, output_dir):
         """Wrapper on steps/align_si.sh
@@ -124,7 +136,7 @@ class Triphone(AbstractAcousticModel):
             '{data} {lang} {origin} {target}'
             .format(
                 njobs=self.njobs,
-                cmd=utils.config.get('kaldi', 'train-cmd'),
+                cmd=utils.kaldi_cmd('train'),
                 transition=self._opt('transition-scale'),
                 acoustic=self._opt('acoustic-scale'),
                 selfloop=self._opt('self-loop-scale'),
@@ -156,7 +168,7 @@ class Triphone(AbstractAcousticModel):
             '--careful {careful} --boost-silence {boost} '
             '{numleaves} {totgauss} {data} {lang} {origin} {target} '
             .format(
-                cmd=utils.config.get('kaldi', 'train-cmd'),
+                cmd=utils.kaldi_cmd('train'),
                 transition=self._opt('transition-scale'),
                 acoustic=self._opt('acoustic-scale'),
                 selfloop=self._opt('self-loop-scale'),
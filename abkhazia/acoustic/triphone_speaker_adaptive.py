@@ -44,6 +44,8 @@ class TriphoneSpeakerAdaptive(AbstractAcousticModel):
     """
     model_type = 'tri-sa'
 
+    memory_stages = {'align': 3.0, 'train': 3.0}
+
     options = {k: v for k, v in (
         kaldi.options.make_option(
             'transition-scale', default=1.0, type=float,
@@ -105,10 +107,21 @@ class TriphoneSpeakerAdaptive(AbstractAcousticModel):
         utils.check_directory(
             self.tri_dir, ['final.mdl', 'ali.1.gz'])
 
+    def _input_paths(self):
+        return [self.input_dir, self.tri_dir]
+
+    def _intermediate_files(self):
+        files = super(TriphoneSpeakerAdaptive, self)._intermediate_files()
+        files['align'] = (
+            ['train'], [os.path.join('exp', 'tri_ali_fmllr')])
+        return files
+
     def run(self):
         align_dir = os.path.join(self.recipe_dir, 'exp', 'tri_ali_fmllr')
-        self._align_fmllr(align_dir)
-        self._train_sat(align_dir)
+        self._run_stage(
+            'align', lambda: self._align_fmllr(align_dir),
+            params=[self.options])
+        self._run_stage('train', lambda: self._train_sat(align_dir))
 
     def _align_fmllr(self, align_dir):
         """Wrapper on steps/align_fmllr.sh
@@ -132,7 +145,7 @@ class TriphoneSpeakerAdaptive(AbstractAcousticModel):
             '{data} {lang} {origin} {target}'
             .format(
                 njobs=self.njobs,
-                cmd=utils.config.get('kaldi', 'train-cmd'),
+                cmd=utils.kaldi_cmd('train'),
                 transition=self._opt('transition-scale'),
                 acoustic=self._opt('acoustic-scale'),
                 selfloop=self._opt('self-loop-scale'),
@@ -178,7 +191,7 @@ class TriphoneSpeakerAdaptive(AbstractAcousticModel):
             '--max-iter-inc {maxiter} --beam {beam} --retry-beam {retrybeam} '
             '{numleaves} {totgauss} {data} {lang} {origin} {target}'
             .format(
-                cmd=utils.config.get('kaldi', 'train-cmd'),
+                cmd=utils.kaldi_cmd('train'),
                 transition=self._opt('transition-scale'),
                 acoustic=self._opt('acoustic-scale'),
                 selfloop=self._opt('self-loop-scale'),
@@ -55,6 +55,8 @@ class Align(abstract_recipe.AbstractRecipe):
     """Estimate forced alignment of an abkahzia corpus"""
     name = 'align'
 
+    memory_stages = {'align': 8.0}
+
     _align_script = 'steps/align_fmllr_lats.sh'
     """The alignment recipe in Kaldi"""
 
@@ -90,22 +92,56 @@ class Align(abstract_recipe.AbstractRecipe):
     def create(self):
         super(Align, self).create()
 
-        # copy features scp files in the recipe_dir
+        # copy features scp files in the recipe_dir and split them in
+        # duration balanced jobs
         Features.export_features(
             self.feat_dir,
             os.path.join(self.recipe_dir, 'data', self.name))
+        self.a2k.setup_split_data(self.njobs)
 
     def run(self):
         # build alignment lattice
-        self._align_fmllr()
+        self._run_stage('align', self._align_fmllr)
 
         # extract phone level best path
-        self._best_path()
-        self._ali_to_phones()
+        self._run_stage(
+            'best path', self._best_path, params=[self.acoustic_scale])
+        self._run_stage('ali-to-phones', self._ali_to_phones)
 
         # extract posteriors if asked
         if self.with_posteriors:
-            self._post_to_phones()
+            self._run_stage(
+                'posteriors', self._post_to_phones,
+                params=[self.acoustic_scale])
+
+    def _input_paths(self):
+        return [self.feat_dir, self.lm_dir, self.am_dir]
+
+    def _memory_predictors(self):
+        return {'dim': self._features_dim(self.feat_dir),
+                'model_size': self._files_size(
+                    os.path.join(self.am_dir, 'final.mdl'),
+                    os.path.join(self.lm_dir, 'L.fst')),
+                'beam': None}
+
+    def _intermediate_files(self):
+        # only the ali.*.gz and post.*.gz files are exported
+        target = os.path.join('exp', 'align_fmllr')
+        posteriors = ['posteriors'] if self.with_posteriors else []
+        return {
+            'align': (
+                ['best path'] + posteriors,
+                [os.path.join(target, 'lat.*.gz')]),
+            'best path': (
+                ['ali-to-phones'] + posteriors,
+                [os.path.join(target, 'best.*.gz'),
+                 os.path.join(target, 'tra.*.gz')]),
+            'posteriors': (
+                ['posteriors'],
+                [os.path.join(target, 'frame_ali.*.gz')])}
+
+    def _input_params(self):
+        return [self.level, self.with_posteriors]
 
     def export(self):
         int2phone = read_int2phone(self.lm_dir)
@@ -167,7 +203,7 @@ class Align(abstract_recipe.AbstractRecipe):
             self._align_script + ' --nj {0} --cmd "{1}" {2} {3} {4} {5}'
             .format(
                 self.njobs,
-                utils.config.get('kaldi', 'train-cmd'),
+                utils.kaldi_cmd('train'),
                 os.path.join(self.recipe_dir, 'data', 'align'),
                 self.lm_dir,
                 self.am_dir,
@@ -186,8 +222,7 @@ class Align(abstract_recipe.AbstractRecipe):
             '"ark:gunzip -c {dir}/lat.JOB.gz|" '
             '"ark:|gzip -c >{dir}/tra.JOB.gz" '
             '"ark:|gzip -c >{dir}/best.JOB.gz"'.format(
-                cmd=os.path.join(
-                    'utils', utils.config.get('kaldi', 'train-cmd')),
+                cmd=utils.kaldi_cmd('train', direct=True),
                 njobs=self.njobs,
                 dir=self._target_dir(),
                 scale=self.acoustic_scale))
@@ -204,7 +239,7 @@ class Align(abstract_recipe.AbstractRecipe):
             'ali-to-phones --write_lengths=true {3} '
             '"ark:gunzip -c {2}/best.JOB.gz|" '
             '"ark,t:|gzip -c >{2}/ali.JOB.gz"'.format(
-                os.path.join('utils', utils.config.get('kaldi', 'train-cmd')),
+                utils.kaldi_cmd('train', direct=True),
                 self.njobs,
                 self._target_dir(),
                 os.path.join(self._target_dir(), 'final.mdl')))
@@ -226,7 +261,7 @@ class Align(abstract_recipe.AbstractRecipe):
             'ali-to-phones --per-frame=true {3} '
             '"ark:gunzip -c {2}/best.JOB.gz|" '
             '"ark:|gzip -c >{2}/frame_ali.JOB.gz"'.format(
-                os.path.join('utils', utils.config.get('kaldi', 'train-cmd')),
+                utils.kaldi_cmd('train', direct=True),
                 self.njobs,
                 self._target_dir(),
                 os.path.join(self._target_dir(), 'final.mdl')))
@@ -238,7 +273,7 @@ class Align(abstract_recipe.AbstractRecipe):
             'post-to-phone-post {4} ark:- ark:- | '
             'get-post-on-ali ark:- "ark:gunzip -c {2}/frame_ali.JOB.gz|" '
             '"ark,t:|gzip -c >{2}/post.JOB.gz"'.format(
-                os.path.join('utils', utils.config.get('kaldi', 'train-cmd')),
+                utils.kaldi_cmd('train', direct=True),
                 self.njobs,
                 self._target_dir(),
                 self.acoustic_scale,
@@ -511,6 +546,15 @@ class AlignNoLattice(Align):
             self.with_posteriors = False
 
     def run(self):
+        self._run_stage('align', self._align_no_lattice)
+        self._run_stage('ali-to-phones', self._ali_to_phones)
+
+    def _intermediate_files(self):
+        return {'align': (
+            ['ali-to-phones'],
+            [os.path.join('exp', 'align_fmllr', 'best.*.gz')])}
+
+    def _align_no_lattice(self):
         self._align_fmllr()
 
         # the previous script output ali.*.gz instead of lats.*.gz, rename
@@ -521,8 +565,6 @@ class AlignNoLattice(Align):
                 os.path.join(path, ali_file),
                 os.path.join(path, ali_file.replace('ali', 'best')))
 
-        self._ali_to_phones()
-
 
 def utterances_posterior_scoring(alignment_file, score_fun=np.prod):
     """Estimate a score for each utterance based on posteriograms
@@ -134,9 +134,11 @@ class _AmBase(AbstractKaldiCommand):
                 recipe = cls.am_class(
                     corpus, feats, output_dir, lang_args, log=log)
 
-        recipe.njobs = args.njobs
+        if args.njobs is not None:
+            recipe.njobs = args.njobs
         if args.recipe:
             recipe.delete_recipe = False
+        recipe.resume = args.resume
 
         # setup the model options parsed from command line
         for k, v in vars(args).iteritems():
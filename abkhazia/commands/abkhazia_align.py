@@ -124,7 +124,8 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         # instanciate the kaldi recipe creator
         recipe = (align.AlignNoLattice if args.no_lattice
                   else align.Align)(corpus, output_dir, log=log)
-        recipe.njobs = args.njobs
+        if args.njobs is not None:
+            recipe.njobs = args.njobs
         recipe.level = level
         recipe.with_posteriors = args.post
         recipe.acoustic_scale = args.acoustic_scale
@@ -132,8 +133,7 @@ class AbkhaziaAlign(AbstractKaldiCommand):
         recipe.feat_dir = feat
         recipe.am_dir = acoustic
         recipe.delete_recipe = False if args.recipe else True
+        recipe.resume = args.resume
 
         # finally compute the alignments
-        recipe.create()
-        recipe.run()
-        recipe.export()
+        recipe.compute()
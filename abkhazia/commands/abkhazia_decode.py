@@ -99,8 +99,10 @@ class _DecodeBase(AbstractKaldiCommand):
         recipe = decode.Decode(
             corpus, lang, feat, acou, output_dir, fmllr_dir=fmllr,
             decode_type=cls.name, log=log)
-        recipe.njobs = args.njobs
+        if args.njobs is not None:
+            recipe.njobs = args.njobs
         recipe.delete_recipe = False if args.recipe else True
+        recipe.resume = args.resume
 
         # setup the model options parsed from command line
         for k, v in vars(args).iteritems():
@@ -50,6 +50,26 @@ class _FeatBase(AbstractKaldiCommand):
             help="""if set write features in a h5features file
             named '<output_dir>/feats.h5f'""")
 
+        dir_parser.add_argument(
+            '--h5f-wav-times', action='store_true',
+            help="""with --h5f, the timestamps of the features are
+            relative to the wav files, starting at the utterances
+            offsets given in segments. By default they are relative
+            to the utterances, as the alignments""")
+
+        dir_parser.add_argument(
+            '--h5f-dtype', choices=['float16', 'float32', 'float64'],
+            default=None,
+            help="""with --h5f, the type of the features in the
+            h5features file, float16 halves the size of float32
+            features. By default the type of the arks is kept""")
+
+        dir_parser.add_argument(
+            '--h5f-compression', choices=['gzip', 'lzf'], default=None,
+            help="""with --h5f, compress the features in the h5features
+            file, lzf is fast, gzip is smaller. Not compressed by
+            default""")
+
         # from http://kaldi-asr.org/doc/structkaldi_1_1ProcessPitchOptions.html
         parser.add_argument(
             '--pitch', action='store_true',
@@ -59,6 +79,42 @@ class _FeatBase(AbstractKaldiCommand):
             log-pitch with POV-weighted mean subtraction over 1.5
             second window, and the time derivative of log-pitch.""")
 
+        parser.add_argument(
+            '--compress', metavar='<true|false>', default='true',
+            choices=['true', 'false'],
+            help="""store the features as Kaldi compressed matrices,
+            lossy but about 4 times smaller than float matrices,
+            default is %(default)s""")
+
+        parser.add_argument(
+            '--pitch-chunk-size', metavar='<seconds>', type=float,
+            default=0,
+            help="""with --pitch, split the utterances in chunks of that
+            duration to compute the pitch of long utterances in
+            parallel, the chunks being stitched back with a
+            cross-fade. Default is %(default)s (no split)""")
+
+        parser.add_argument(
+            '--pitch-chunk-overlap', metavar='<seconds>', type=float,
+            default=1.0,
+            help="""with --pitch-chunk-size, the overlap between two
+            successive chunks, default is %(default)s""")
+
+        parser.add_argument(
+            '--extractor', choices=['kaldi', 'numpy'], default='kaldi',
+            help="""compute the features with the Kaldi programs or
+            in-process with numpy (mfcc and fbank only, without
+            pitch). With numpy, deltas and CMVN statistics are
+            computed in a single pass over the raw features. Default
+            is %(default)s""")
+
+        parser.add_argument(
+            '--extra-type', metavar='<type>', action='append',
+            choices=['mfcc', 'fbank'], default=[],
+            help="""with --extractor numpy, compute also features of
+            that type in the same pass over the audio, written to
+            '<output_dir>/feats_<type>.scp'. Can be repeated.""")
+
         parser.add_argument(
             '--cmvn', action='store_true',
             help="""if specified, compute CMVN statistics,
@@ -70,6 +126,44 @@ class _FeatBase(AbstractKaldiCommand):
             delta-order is set to 0, deltas are not computed. Default
             is %(default)s.""")
 
+        parser.add_argument(
+            '--vad', action='store_true',
+            help="""if specified, compute an energy based voice
+            activity detection on the raw features, as the Kaldi
+            program compute-vad, written to '<output-dir>/vad.scp'""")
+
+        parser.add_argument(
+            '--vad-energy-threshold', metavar='<float>', type=float,
+            default=5.0,
+            help="""with --vad, constant term in the energy threshold
+            for voiced frames, default is %(default)s""")
+
+        parser.add_argument(
+            '--vad-energy-mean-scale', metavar='<float>', type=float,
+            default=0.5,
+            help="""with --vad, the mean log energy of the utterance
+            times this scale is added to the energy threshold, default
+            is %(default)s""")
+
+        parser.add_argument(
+            '--drop-unvoiced', action='store_true',
+            help="""with --vad, keep only the voiced frames in the
+            exported features (and in the h5features file with --h5f,
+            the timestamps being the ones of the original frames)""")
+
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help="""if the features have already been computed in
+            <output-dir> with the same parameters, compute only the
+            features of the new or modified utterances and update the
+            exported scp files. Must be used without --force.""")
+
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help="""do not restore the features from the features
+            cache, neither store them in it. The cache directory and
+            size are defined in the abkhazia configuration file""")
+
         cls.add_kaldi_options(
             parser.add_argument_group(
                 '{} features options'.format(cls.feat_name)))
@@ -112,16 +206,45 @@ class _FeatBase(AbstractKaldiCommand):
         recipe.use_cmvn = utils.str2bool(args.cmvn)
         recipe.delta_order = args.delta_order
         recipe.features_options = cls.parsed_options
-        recipe.njobs = args.njobs
+        recipe.extractor = args.extractor
+        recipe.compress = utils.str2bool(args.compress)
+        recipe.pitch_chunk_size = args.pitch_chunk_size
+        recipe.pitch_chunk_overlap = args.pitch_chunk_overlap
+        recipe.extra_types = args.extra_type
+        if args.njobs is not None:
+            recipe.njobs = args.njobs
         recipe.delete_recipe = False if args.recipe else True
+        recipe.resume = args.resume
+        recipe.use_vad = args.vad
+        recipe.vad_options = {
+            'energy_threshold': args.vad_energy_threshold,
+            'energy_mean_scale': args.vad_energy_mean_scale}
+        recipe.drop_unvoiced = args.drop_unvoiced
+        recipe.incremental = args.incremental
+        if not args.no_cache:
+            recipe.cache = features.FeaturesCache.from_config(log=log)
         recipe.compute()
 
         # export to h5features if asked for
         if args.h5f:
             recipe.log.info('exporting Kaldi ark features to h5features...')
-            kaldi.scp_to_h5f(
-                os.path.join(recipe.output_dir, 'feats.scp'),
-                os.path.join(recipe.output_dir, 'feats.h5f'))
+
+            # the timestamps of the voiced frames are read from VAD
+            vad = (kaldi.ScpReader(os.path.join(recipe.output_dir, 'vad.scp'))
+                   if args.drop_unvoiced else None)
+            try:
+                kaldi.scp_to_h5f(
+                    os.path.join(recipe.output_dir, 'feats.scp'),
+                    os.path.join(recipe.output_dir, 'feats.h5f'),
+                    segments=corpus.segments if args.h5f_wav_times else None,
+                    njobs=recipe.njobs,
+                    vad=vad,
+                    dtype=args.h5f_dtype,
+                    compression=args.h5f_compression,
+                    log=recipe.log)
+            finally:
+                if vad is not None:
+                    vad.close()
 
 
 class _FeatMfcc(_FeatBase):
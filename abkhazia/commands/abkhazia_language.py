@@ -74,4 +74,5 @@ class AbkhaziaLanguage(AbstractKaldiCommand):
             position_dependent_phones=args.word_position_dependent,
             silence_probability=args.silence_probability)
         recipe.delete_recipe = False if args.recipe else True
+        recipe.resume = args.resume
         recipe.compute()
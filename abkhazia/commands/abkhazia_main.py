@@ -40,7 +40,8 @@ from abkhazia.commands import (
     AbkhaziaLanguage,
     AbkhaziaAcoustic,
     AbkhaziaDecode,
-    AbkhaziaAlign)
+    AbkhaziaAlign,
+    AbkhaziaPipeline)
 
 
 class Abkhazia(object):
@@ -57,7 +58,8 @@ class Abkhazia(object):
         AbkhaziaLanguage,
         AbkhaziaAcoustic,
         AbkhaziaAlign,
-        AbkhaziaDecode
+        AbkhaziaDecode,
+        AbkhaziaPipeline
     ]
 
     # a string describing abkhazia and its subcommands
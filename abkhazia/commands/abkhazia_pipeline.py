@@ -0,0 +1,86 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Implementation of the 'abkazia pipeline' command"""
+
+import os
+
+from abkhazia.commands.abstract_command import AbstractCommand
+import abkhazia.utils as utils
+
+
+class AbkhaziaPipeline(AbstractCommand):
+    '''This class implements the 'abkhazia pipeline' command'''
+    name = 'pipeline'
+    description = 'run a pipeline of abkhazia commands concurrently'
+
+    @classmethod
+    def add_parser(cls, subparsers):
+        # get basic parser init from AbstractCommand
+        parser = super(AbkhaziaPipeline, cls).add_parser(subparsers)
+        parser.description = utils.jobs.pipeline.__doc__
+
+        parser.add_argument(
+            'spec', metavar='<spec-file>',
+            help='the pipeline specification, a section per step')
+
+        parser.add_argument(
+            '-o', '--output-dir', default=None, metavar='<output-dir>',
+            help='where to write the logs of the steps and their '
+            'fingerprints, default is <spec-file-directory>/pipeline')
+
+        parser.add_argument(
+            '--force', action='store_true',
+            help='run all the steps, by default the steps already '
+            'completed with the same fingerprint are skipped')
+
+        parser.add_argument(
+            '-j', '--njobs', type=int, metavar='<njobs>',
+            default=utils.default_njobs(local=True),
+            help='maximum number of CPU cores used at once by the steps, '
+            'default is %(default)s')
+
+        parser.add_argument(
+            '--max-memory', default=None, metavar='<memory>',
+            help='maximum memory required by the steps running at once '
+            '(e.g. 16G), default is the available memory')
+
+        return parser
+
+    @classmethod
+    def run(cls, args):
+        # imported here to avoid a cyclic import
+        from abkhazia.commands.abkhazia_main import Abkhazia
+
+        spec = os.path.abspath(args.spec)
+        output_dir = os.path.abspath(
+            args.output_dir or os.path.join(
+                os.path.dirname(spec), 'pipeline'))
+        log = utils.logger.get_log(
+            args.log or os.path.join(output_dir, 'pipeline.log'),
+            verbose=args.verbose)
+
+        steps = utils.jobs.read_spec(spec)
+        commands = [c.name for c in Abkhazia._command_classes]
+        for step in steps:
+            if step.command.split()[0] not in commands:
+                raise IOError('step {}: unknown abkhazia command {}'.format(
+                    step.name, step.command.split()[0]))
+
+        utils.jobs.Pipeline(
+            steps, output_dir, cwd=os.path.dirname(spec),
+            max_jobs=args.njobs,
+            max_memory=(utils.jobs.parse_memory(args.max_memory)
+                        if args.max_memory else None),
+            log=log).run(force=args.force)
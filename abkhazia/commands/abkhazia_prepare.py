@@ -124,7 +124,8 @@ class AbstractFactory(object):
             'do not convert them again.')
 
         parser.add_argument(
-            '-j', '--njobs', type=int, default=utils.default_njobs(),
+            '-j', '--njobs', type=int,
+            default=utils.default_njobs(local=True),
             metavar='<njobs>',
             help='number of jobs to launch when doing parallel '
             'computations (mainly for wav conversion). '
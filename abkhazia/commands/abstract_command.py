@@ -196,7 +196,8 @@ class AbstractKaldiCommand(AbstractCoreCommand):
     """Base class for commands relying on Kaldi recipes
 
     Adds a --recipe option that do not remove the Kaldi recipe
-    directory and a --njobs option for parallel processing
+    directory, a --resume option to resume an interrupted recipe and
+    a --njobs option for parallel processing
 
     """
     @classmethod
@@ -211,17 +212,27 @@ class AbstractKaldiCommand(AbstractCoreCommand):
         # add a --recipe option
         parser.add_argument(
             '--recipe', action='store_true', help="""
-            put the Kaldi recipe in <output_dir>/recipe, by default the recipe
-            is deleted""")
+            keep the Kaldi recipe, by default the recipe is deleted. It
+            is in <output_dir>/recipe, or in the scratch-directory of
+            the abkhazia configuration when defined (its location is
+            logged)""")
+
+        # add a --resume option
+        parser.add_argument(
+            '--resume', action='store_true', help="""
+            resume the Kaldi recipe from a previous execution, skip the
+            stages already completed with the same inputs. The recipe
+            is kept when an execution fails (in <output_dir>/recipe or
+            in the scratch-directory), so it can be resumed""")
 
         # add a --njobs option
         parser.add_argument(
-            '-j', '--njobs', type=int, metavar='<njobs>',
-            default=utils.default_njobs(),
+            '-j', '--njobs', type=int, metavar='<njobs>', default=None,
             help="""
             number of jobs for parallel computation, because Kaldi
             used to run jobs per speakers, the number of jobs is
-            min(<njobs>, corpus.nspeakers). Default is to launch
-            %(default)s jobs.""")
+            min(<njobs>, corpus.nspeakers). Default is the capacity of
+            the job backend (the number of cores when running
+            locally).""")
 
         return parser, dir_group
@@ -151,16 +151,17 @@ class Corpus(utils.abkhazia_base.AbkhaziaBase):
 
         CorpusSaver.save(self, path, no_wavs=no_wavs, copy_wavs=copy_wavs)
 
-    def validate(self, njobs=utils.default_njobs()):
+    def validate(self, njobs=None):
         """Validate speech corpus data
 
         Raise IOError on the first encoutered error, relies on the
-        CorpusValidation class.
+        CorpusValidation class. `njobs` is the number of jobs scanning
+        the wavs, default to the number of cores on the machine.
 
         """
         CorpusValidation(self, njobs=njobs, log=self.log).validate()
 
-    def is_valid(self, njobs=utils.default_njobs()):
+    def is_valid(self, njobs=None):
         """Return True if the corpus is in a valid state"""
         try:
             self.validate(njobs=njobs)
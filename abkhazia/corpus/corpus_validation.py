@@ -59,10 +59,9 @@ class CorpusValidation(object):
 
     """
 
-    def __init__(self, corpus, njobs=default_njobs(),
-                 log=logger.null_logger()):
+    def __init__(self, corpus, njobs=None, log=logger.null_logger()):
         self.corpus = corpus
-        self.njobs = njobs
+        self.njobs = njobs or default_njobs(local=True)
         self.log = log
 
     def validate(self, meta=None):
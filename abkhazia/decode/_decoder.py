@@ -14,15 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Wrapper on egs/wsj/s5/steps/decode.sh
 
-Following decode options are ignored: num_thread, skip_scoring, iter,
-transform_dir
+Following decode options are ignored: num_thread, iter,
+transform_dir. Scoring is done apart (see _score.py).
 
 """
 
 import os
 import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
-import _score
 
 
 def options():
@@ -42,7 +41,7 @@ def options():
 
 
 def decode(decoder, graph_dir):
-        decoder.log.info('decoding and computing WER')
+        decoder.log.info('decoding')
 
         # generate option string for decoding
         decode_opts = ' '.join('--{} {}'.format(n, str(o))
@@ -58,34 +57,25 @@ def decode(decoder, graph_dir):
             fmllr_dir = ""
         print fmllr_dir 
         print ('steps/decode.sh --nj {njobs} --cmd "{cmd}" '
-            '--model {model} {decode_opts} {skip_scoring} '
-            '--scoring-opts "{score_opts}" {graph} {data} '
-            ' {decode} {fmllr_dir}'.format(
+            '--model {model} {decode_opts} --skip-scoring true '
+            '{graph} {data} {decode} {fmllr_dir}'.format(
                 njobs=decoder.njobs,
-                cmd=utils.config.get('kaldi', 'decode-cmd'),
+                cmd=utils.kaldi_cmd('decode'),
                 # TODO .mdl or .alimdl ?
                 model=os.path.join(decoder.am_dir, 'final.mdl'),
                 decode_opts=decode_opts,
-                skip_scoring=_score.skip_scoring(decoder.score_opts),
-                score_opts=_score.format(
-                    decoder.score_opts, decoder.mkgraph_opts),
                 graph=graph_dir,
                 data=os.path.join(decoder.recipe_dir, 'data', decoder.name),
                 decode=target, fmllr_dir=fmllr_dir))
         decoder._run_command((
             'steps/decode.sh --nj {njobs} --cmd "{cmd}" '
-            '--model {model} {decode_opts} {skip_scoring} '
-            '{fmllr_dir} '
-            '--scoring-opts "{score_opts}" {graph} {data} '
-            ' {decode}'.format(
+            '--model {model} {decode_opts} --skip-scoring true '
+            '{fmllr_dir} {graph} {data} {decode}'.format(
                 njobs=decoder.njobs,
-                cmd=utils.config.get('kaldi', 'decode-cmd'),
+                cmd=utils.kaldi_cmd('decode'),
                 # TODO .mdl or .alimdl ?
                 model=os.path.join(decoder.am_dir, 'final.mdl'),
                 decode_opts=decode_opts,
-                skip_scoring=_score.skip_scoring(decoder.score_opts),
-                score_opts=_score.format(
-                    decoder.score_opts, decoder.mkgraph_opts),
                 graph=graph_dir,
                 data=os.path.join(decoder.recipe_dir, 'data', decoder.name),
                 decode=target, fmllr_dir=fmllr_dir)))
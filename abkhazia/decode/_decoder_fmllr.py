@@ -15,14 +15,13 @@
 """Wrapper on egs/wsj/s5/steps/decode_fmllr.sh
 
 Ignored options are: alignment_model, adapt_model, final_model, stage,
-num-threads, skip_scoring, max_fmllr_jobs
+num-threads, max_fmllr_jobs. Scoring is done apart (see _score.py).
 
 """
 
 import os
 import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
-import _score
 
 
 def options():
@@ -50,22 +49,13 @@ def options():
 
 
 def decode(decoder, graph_dir):
-    decoder.log.info('fmllr decoding and computing WER')
+    decoder.log.info('fmllr decoding')
 
     # generate option string for decoding
     decode_opts = ' '.join(
         '--{} {}'.format(n, str(o))
         for n, o in decoder.decode_opts.iteritems())
 
-    # generate option string for scoring
-    score_opts = ' '.join(
-        '--{} {}'.format(n, str(o))
-        for n, o in decoder.score_opts.iteritems())
-
-    # add the reverse flag if enabled in the mkgraph options
-    if decoder.mkgraph_opts['reverse'].value:
-        score_opts += ' --reverse true'
-
     # decode_fmllr.sh must be run from a subdirectory of the input
     # acoustic model directory (here decoder.am_dir). So we do: create
     # a subdir in am_dir as a symlink to the target recipe_dir, run
@@ -91,14 +81,11 @@ def decode(decoder, graph_dir):
 
         decoder._run_command((
             'steps/decode_fmllr.sh --nj {njobs} --cmd "{cmd}" '
-            '{decode_opts} {skip_scoring} --scoring-opts "{score_opts}" '
+            '{decode_opts} --skip-scoring true '
             '{graph} {data} {decode}'.format(
                 njobs=decoder.njobs,
-                cmd=utils.config.get('kaldi', 'decode-cmd'),
+                cmd=utils.kaldi_cmd('decode'),
                 decode_opts=decode_opts,
-                skip_scoring=_score.skip_scoring(decoder.score_opts),
-                score_opts=_score.format(
-                    decoder.score_opts, decoder.mkgraph_opts),
                 graph=graph_dir,
                 data=os.path.join(decoder.recipe_dir, 'data', decoder.name),
                 decode=tempdir_sa)))
@@ -14,15 +14,14 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 """Wrapper on egs/wsj/s5/steps/decode_nnet.sh
 
-Ignored options are: stage, iter, skip_scoring, feat_type,
-online_ivector_dir
+Ignored options are: stage, iter, feat_type,
+online_ivector_dir. Scoring is done apart (see _score.py).
 
 """
 
 import os
 import abkhazia.utils as utils
 import abkhazia.kaldi as kaldi
-import _score
 
 
 def options():
@@ -52,7 +51,7 @@ def options():
 
 
 def decode(decoder, graph_dir):
-    decoder.log.info('nnet decoding and computing WER')
+    decoder.log.info('nnet decoding')
 
     # generate option string for decoding
     decode_opts = ' '.join('--{} {}'.format(n, str(o))
@@ -72,8 +71,12 @@ def decode(decoder, graph_dir):
     for linked in ('final.mdl', 'cmvn_opts', 'final.mat',
                    'splice_opts', 'delta_order', 'log'):
         src = os.path.join(decoder.am_dir, linked)
+        dest = os.path.join(decoder.recipe_dir, linked)
         if os.path.exists(src):
-            os.symlink(src, os.path.join(decoder.recipe_dir, linked))
+            # the link may exist if the decoding is resumed
+            if os.path.lexists(dest):
+                os.remove(dest)
+            os.symlink(src, dest)
         elif linked == 'final.mdl':
             raise IOError('model file not found {}'.format(src))
         else:
@@ -87,16 +90,13 @@ def decode(decoder, graph_dir):
 
     decoder._run_command((
         'steps/nnet2/decode.sh --nj {njobs} --cmd "{cmd}" {decode_opts} '
-        '--parallel-opts "{paral}" '
-        '{skip_scoring} --scoring-opts "{score_opts}" '
+        '--parallel-opts "{paral}" --skip-scoring true '
         '{graph} {data} {decode}'.format(
             njobs=decoder.njobs,
-            cmd=utils.config.get('kaldi', 'decode-cmd'),
+            cmd=utils.kaldi_cmd('decode'),
             decode_opts=decode_opts,
             paral='--num-threads {}'.format(
                 decoder.decode_opts['num-threads'].value),
-            skip_scoring=_score.skip_scoring(decoder.score_opts),
-            score_opts=_score.format(decoder.score_opts, decoder.mkgraph_opts),
             graph=graph_dir,
             data=os.path.join(decoder.recipe_dir, 'data', decoder.name),
             decode=target)))
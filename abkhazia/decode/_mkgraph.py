@@ -50,8 +50,7 @@ def mkgraph(decoder, verbose=True):
         '{cmd} {log} utils/mkgraph.sh {mono} {reverse} '
         '--transition-scale {tscale} --self-loop-scale {slscale} '
         '{lang} {model} {graph}'.format(
-            cmd=os.path.join(
-                'utils', utils.config.get('kaldi', 'highmem-cmd')),
+            cmd=utils.kaldi_cmd('highmem', direct=True),
             log=os.path.join(target, 'mkgraph.log'),
             mono='--mono' if decoder.am_type == 'mono' else '',
             reverse='--reverse' if opts['reverse'].value else '',
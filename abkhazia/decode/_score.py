@@ -12,14 +12,17 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
-"""Options to feed egs/wsj/s5/utils/score.sh
+"""Wrapper on egs/wsj/s5/local/score.sh
 
 Following score options are ignored: iter, stage, stats. The reverse
 option is linked to the mkgraph.reverse option
 
 """
 
+import os
+
 import abkhazia.kaldi as kaldi
+import abkhazia.utils as utils
 
 
 def options():
@@ -57,4 +60,22 @@ def format(score_opts, mkgraph_opts):
 
 
 def skip_scoring(score_opts):
-    return '--skip-scoring true' if score_opts['skip-scoring'] is True else ''
+    """Return True if the scoring is disabled in `score_opts`"""
+    return str(score_opts['skip-scoring']) == 'true'
+
+
+def score(decoder, graph_dir, decode_dir):
+    """Compute the WER of the lattices in `decode_dir`
+
+    The decoding scripts are called with --skip-scoring true so that
+    the scoring is executed as a separate stage of the recipe.
+
+    """
+    decoder.log.info('computing WER')
+    decoder._run_command(
+        'local/score.sh --cmd "{cmd}" {opts} {data} {graph} {decode}'.format(
+            cmd=utils.kaldi_cmd('decode'),
+            opts=format(decoder.score_opts, decoder.mkgraph_opts),
+            data=os.path.join(decoder.recipe_dir, 'data', decoder.name),
+            graph=graph_dir,
+            decode=decode_dir))
@@ -39,6 +39,8 @@ decoders = {
 class Decode(abstract_recipe.AbstractRecipe):
     name = 'decode'
 
+    memory_stages = {'decode': 6.0}
+
     def __init__(self, corpus, lm_dir, feats_dir, am_dir, output_dir,
                  decode_type=None, log=utils.logger.null_logger(),
                  fmllr_dir=None):
@@ -102,18 +104,50 @@ class Decode(abstract_recipe.AbstractRecipe):
         # setup local/score.sh
         self.a2k.setup_score()
 
-        # copy features scp files in the recipe_dir
+        # copy features scp files in the recipe_dir and split them in
+        # duration balanced jobs
         features.Features.export_features(
             self.feat_dir,
             os.path.join(self.recipe_dir, 'data', self.name))
+        self.a2k.setup_split_data(self.njobs)
+
+    def _input_paths(self):
+        return [self.feat_dir, self.lm_dir, self.am_dir, self.fmllr_dir]
+
+    def _memory_predictors(self):
+        # the decoding graph grows with the language model
+        return {'dim': self._features_dim(self.feat_dir),
+                'model_size': self._files_size(
+                    os.path.join(self.am_dir, 'final.mdl'),
+                    os.path.join(self.lm_dir, 'G.fst')),
+                'beam': (self.decode_opts['beam'].value
+                         if 'beam' in self.decode_opts else None)}
+
+    def _intermediate_files(self):
+        # the speaker independent pass of the fmllr decoder, the
+        # lattices of the final pass in decode/ are exported
+        return {'decode': (['decode'], ['decode.si'])}
 
     def run(self):
         """Run the created recipe and decode speech data"""
+        graph_dir = os.path.join(self.recipe_dir, 'graph')
+        decode_dir = os.path.join(self.recipe_dir, 'decode')
+
         # build the full decoding graph
-        graph_dir = _mkgraph.mkgraph(self)
+        self._run_stage(
+            'mkgraph', lambda: _mkgraph.mkgraph(self),
+            params=[self.mkgraph_opts])
 
         # decode the corpus according to input am type
-        self._decoder.decode(self, graph_dir)
+        self._run_stage(
+            'decode', lambda: self._decoder.decode(self, graph_dir),
+            params=[self._decoder_type, self.decode_opts])
+
+        # compute the WER on decoded lattices
+        if not _score.skip_scoring(self.score_opts):
+            self._run_stage(
+                'score', lambda: _score.score(self, graph_dir, decode_dir),
+                params=[self.score_opts])
 
     def export(self):
         """Copy the whole <recipe-dir>/decode to <output-dir>, copy
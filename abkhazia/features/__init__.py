@@ -14,3 +14,4 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 
 from features import Features
+from features_cache import FeaturesCache
@@ -0,0 +1,118 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Split utterances in overlapping chunks for parallel pitch tracking
+
+The Kaldi pitch tracker is much slower than the MFCC computation and
+processes an utterance in a single job, so a long recording is a
+bottleneck. Here the utterances are split in overlapping chunks
+aligned on the frames, the raw pitch (NCCF and pitch) of each chunk
+is computed by compute-kaldi-pitch-feats in parallel jobs, and the
+chunks are stitched back with a linear cross-fade over the frames
+they share. The post-processing (process-kaldi-pitch-feats) is then
+applied on the whole utterances.
+
+"""
+
+import numpy as np
+
+
+def split_segments(segments, chunk_size, overlap=1.0, frame_shift=0.01):
+    """Split utterances in overlapping chunks
+
+    Parameters:
+    -----------
+
+    segments (dict): utt_id -> (wav_id, tbegin, tend), with explicit
+      timestamps in seconds
+
+    chunk_size (float): the duration of the chunks in seconds,
+      without the overlap, rounded to a multiple of `frame_shift`
+
+    overlap (float): the duration shared by two successive chunks,
+      in seconds
+
+    frame_shift (float): the shift between two frames in seconds
+
+    Return:
+    -------
+
+    A list of (chunk_id, utt_id, wav_id, tbegin, tend, offset), with
+    `offset` the index of the first frame of the chunk in the
+    utterance. Utterances shorter than `chunk_size` + `overlap` are a
+    single chunk.
+
+    """
+    step = max(1, int(round(chunk_size / frame_shift)))
+    chunks = []
+    for utt in sorted(segments):
+        wav, tbegin, tend = segments[utt]
+        duration = tend - tbegin
+        nchunks = max(1, int(np.ceil(
+            (duration - overlap) / (step * frame_shift))))
+
+        for k in range(nchunks):
+            begin = tbegin + k * step * frame_shift
+            end = (tend if k == nchunks - 1 else
+                   min(tend, begin + step * frame_shift + overlap))
+            chunks.append((
+                '{}-pitch{:04d}'.format(utt, k), utt, wav, begin, end,
+                k * step))
+    return chunks
+
+
+def stitch(chunks, nframes=None):
+    """Stitch the features of overlapping chunks in a single matrix
+
+    Over the frames shared by two successive chunks, the features are
+    linearly cross-faded from the first chunk to the second.
+
+    Parameters:
+    -----------
+
+    chunks (list): (offset, features) of the chunks, sorted by
+      offset, with `offset` the index of the first frame of the
+      chunk in the stitched matrix
+
+    nframes (int): the number of frames of the stitched matrix, the
+      last frame is repeated or dropped to match it. By default, up
+      to the last frame of the last chunk.
+
+    """
+    ends = [offset + feats.shape[0] for offset, feats in chunks]
+    total = max(ends)
+    weights = [np.ones(feats.shape[0]) for _, feats in chunks]
+
+    for k in range(len(chunks) - 1):
+        shared = min(ends[k] - chunks[k + 1][0], weights[k + 1].shape[0])
+        if shared > 0:
+            ramp = np.arange(1, shared + 1) / (shared + 1.0)
+            weights[k][-shared:] *= ramp[::-1]
+            weights[k + 1][:shared] *= ramp
+
+    dim = chunks[0][1].shape[1]
+    output = np.zeros((total, dim), dtype=np.float64)
+    norm = np.zeros(total, dtype=np.float64)
+    for (offset, feats), weight in zip(chunks, weights):
+        end = offset + feats.shape[0]
+        output[offset:end] += weight[:, None] * feats
+        norm[offset:end] += weight
+
+    # frames not covered by any chunk (if any) are left to 0
+    output[norm > 0] /= norm[norm > 0, None]
+
+    if nframes is not None:
+        output = output.take(
+            np.minimum(np.arange(nframes), total - 1), axis=0)
+    return output.astype(np.float32)
@@ -16,10 +16,14 @@
 
 import os
 import shutil
-import joblib
 
 import abkhazia.utils as utils
 import abkhazia.abstract_recipe as abstract_recipe
+import abkhazia.kaldi as kaldi
+import chunked_pitch
+import features_cache
+import numpy_features
+from abkhazia.kaldi import ArkWriter
 
 
 class Features(abstract_recipe.AbstractRecipe):
@@ -56,6 +60,37 @@ class Features(abstract_recipe.AbstractRecipe):
         for scp in scps:
             shutil.copy(scp, os.path.join(destdir, os.path.basename(scp)))
 
+    @staticmethod
+    def import_h5features(h5_file, corpus, output_dir, njobs=1,
+                          h5_group=None, compress=False,
+                          log=utils.logger.null_logger()):
+        """Convert features from a h5features file to a features directory
+
+        This is used to train or align with features computed out of
+        abkhazia. The features of each utterance of the `corpus`
+        are written to Kaldi arks, sharded as the split`njobs` data
+        directories of the recipes. The `output_dir` is then a valid
+        features directory, as exported by the Features recipe.
+
+        Utterances present in `h5_file` but not in the `corpus` are
+        ignored.
+
+        """
+        njobs = min(njobs, len(corpus.spks()))
+        utt2spk = corpus.utt2spk
+        spk2job = kaldi.abkhazia2kaldi.spk2job(corpus, njobs)
+        utt2job = {utt: spk2job[utt2spk[utt]] for utt in corpus.utts()
+                   if utt2spk[utt] in spk2job}
+
+        kaldi.h5f_to_ark(
+            h5_file, output_dir, h5_group=h5_group, utt2job=utt2job,
+            njobs=njobs, compress=compress, log=log)
+
+        with open(os.path.join(output_dir, 'wav.scp'), 'w') as scp:
+            for wav in sorted(set(w for w, _, _ in corpus.segments.values())):
+                scp.write('{} {}\n'.format(
+                    wav, os.path.join(corpus.wav_folder, wav)))
+
     def __init__(self, corpus, output_dir,
                  type='mfcc', use_pitch=False, use_cmvn=False, delta_order=0,
                  log=utils.logger.null_logger()):
@@ -69,9 +104,79 @@ class Features(abstract_recipe.AbstractRecipe):
         # overload a kaldi default parameter
         self.features_options = [('use-energy', 'false')]
 
+        # compute the features with Kaldi or in-process with numpy
+        self.extractor = 'kaldi'
+
+        # store the features as Kaldi compressed matrices (lossy, about
+        # 4 times smaller than float matrices), as the Kaldi scripts do
+        # by default
+        self.compress = True
+
+        # other features types computed in the same pass over the
+        # audio, exported to feats_<type>.scp (numpy extractor only)
+        self.extra_types = []
+
+        # when True and features have already been computed in
+        # output_dir with the same parameters, compute only the
+        # features of new or modified utterances
+        self.incremental = False
+
+        # when > 0 and use_pitch is True, the utterances are split in
+        # chunks of that duration (in seconds) overlapping by
+        # pitch_chunk_overlap seconds, the pitch of the chunks being
+        # computed in parallel (Kaldi extractor only)
+        self.pitch_chunk_size = 0
+        self.pitch_chunk_overlap = 1.0
+
+        # energy based voice activity detection, exported to vad.scp,
+        # the options are the ones of numpy_features.vad_energy. When
+        # drop_unvoiced is True, only the voiced frames are exported.
+        self.use_vad = False
+        self.vad_options = {}
+        self.drop_unvoiced = False
+
+        # when not None, a FeaturesCache from which the features are
+        # restored if already computed, and where they are stored
+        self.cache = None
+
         if self.type not in ['mfcc', 'plp', 'fbank']:
             raise IOError('unknown feature type "{}"'.format(self.type))
 
+    def check_parameters(self):
+        super(Features, self).check_parameters()
+
+        if self.extractor not in ('kaldi', 'numpy'):
+            raise IOError(
+                'unknown features extractor "{}"'.format(self.extractor))
+
+        if self.extractor == 'numpy' and (
+                self.type not in ('mfcc', 'fbank') or self.use_pitch):
+            raise IOError(
+                'numpy extractor supports only mfcc and fbank without pitch')
+
+        if self.pitch_chunk_size > 0 and (
+                not self.use_pitch or self.extractor != 'kaldi'):
+            raise IOError(
+                'pitch chunks require pitch with the kaldi extractor')
+
+        if self.pitch_chunk_size < 0 or self.pitch_chunk_overlap < 0:
+            raise IOError('pitch chunk size and overlap must be positive')
+
+        if self.drop_unvoiced and not self.use_vad:
+            raise IOError('dropping unvoiced frames requires VAD')
+
+        if self.extra_types:
+            if self.extractor != 'numpy':
+                raise IOError(
+                    'extra features types require the numpy extractor')
+
+            types = [self.type] + list(self.extra_types)
+            if (len(set(types)) != len(types) or
+                    any(t not in ('mfcc', 'fbank') for t in types)):
+                raise IOError(
+                    'extra features types must be distinct mfcc or fbank: {}'
+                    .format(', '.join(types)))
+
     def _setup_conf_dir(self):
         """Setup the configurtion files for feature extraction
 
@@ -104,6 +209,12 @@ class Features(abstract_recipe.AbstractRecipe):
             with open(os.path.join(conf_dir, 'pitch.conf'), mode='w') as out:
                 pass
 
+    def _raw_scps(self, type):
+        """Return the scp files of raw features of that `type`"""
+        return [f for f in utils.list_files_with_extension(
+            self.output_dir, '.scp', abspath=True, recursive=False)
+                if os.path.basename(f).startswith('raw_{}_'.format(type))]
+
     def _get_kaldi_script(self):
         """Path to the Kaldi script according to `type` and `use_pitch`"""
         return ('steps/make_' + self.type +
@@ -111,20 +222,172 @@ class Features(abstract_recipe.AbstractRecipe):
 
     def _compute_features(self):
         """Wrapper on steps/make_*type*_pitch.sh or steps/make_*type*.sh"""
+        if self.extractor == 'numpy':
+            return self._compute_features_numpy()
+
+        if self.use_pitch and self.pitch_chunk_size > 0:
+            return self._compute_features_chunked_pitch()
+
         script = self._get_kaldi_script()
         self.log.info('computing %s features%s',
                       self.type,
                       ' with pitch' if self.use_pitch else '')
 
         self._run_command(
-            script + ' --nj {0} --cmd "{1}" {2} {3} {4}'.format(
+            script + ' --nj {0} --cmd "{1}" --compress {5} {2} {3} {4}'.format(
                 self.njobs,
-                utils.config.get('kaldi', 'train-cmd'),
+                utils.kaldi_cmd('train'),
                 os.path.join('data', self.name),
                 os.path.join('exp', 'make_{}'.format(self.type), self.name),
-                self.output_dir),
+                self.output_dir,
+                str(self.compress).lower()),
+            verbose=False)
+
+    def _compute_features_chunked_pitch(self):
+        """Replace steps/make_*type*_pitch.sh with pitch on chunks
+
+        The features without pitch are computed by make_*type*.sh. The
+        utterances are split in overlapping chunks, the raw pitch of
+        the chunks is computed in parallel, with the chunks of long
+        utterances spread over several jobs. The chunks are stitched
+        back and the pitch post-processed on whole utterances before
+        being pasted to the features.
+
+        """
+        self.log.info(
+            'computing %s features with pitch on chunks of %ss',
+            self.type, self.pitch_chunk_size)
+
+        data_dir = os.path.join(self.recipe_dir, 'data', self.name)
+        nopitch_dir = os.path.join(self.recipe_dir, 'nopitch')
+        pitch_dir = os.path.join(
+            self.recipe_dir, 'exp', 'make_pitch', self.name)
+        for directory in (nopitch_dir, pitch_dir):
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        self._run_command(
+            'steps/make_{0}.sh --nj {1} --cmd "{2}" {3} {4} {5}'.format(
+                self.type, self.njobs, utils.kaldi_cmd('train'),
+                os.path.join('data', self.name),
+                os.path.join('exp', 'make_{}'.format(self.type), self.name),
+                nopitch_dir),
             verbose=False)
 
+        # split the utterances in chunks, the timestamps in data
+        # segments are explicit, spread the chunks over the jobs by
+        # decreasing duration to balance their load
+        segments = {}
+        for line in open(os.path.join(data_dir, 'segments'), 'r'):
+            utt, wav, tbegin, tend = line.strip().split(' ')
+            segments[utt] = (wav, float(tbegin), float(tend))
+
+        chunks = chunked_pitch.split_segments(
+            segments, self.pitch_chunk_size, self.pitch_chunk_overlap)
+        load, jobs = [0.0] * self.njobs, [[] for _ in range(self.njobs)]
+        for chunk in sorted(chunks, key=lambda c: c[3] - c[4]):
+            job = load.index(min(load))
+            load[job] += chunk[4] - chunk[3]
+            jobs[job].append(chunk)
+
+        njobs = len([j for j in jobs if j])
+        for n, job in enumerate([j for j in jobs if j], 1):
+            with open(os.path.join(
+                    pitch_dir, 'segments.{}'.format(n)), 'w') as out:
+                for chunk, _, wav, tbegin, tend, _ in sorted(job):
+                    out.write('{} {} {:.3f} {:.3f}\n'.format(
+                        chunk, wav, tbegin, tend))
+
+        self._run_command(
+            '{0} JOB=1:{1} {2}/log/pitch.JOB.log '
+            'extract-segments scp:{3}/wav.scp {2}/segments.JOB ark:- | '
+            'compute-kaldi-pitch-feats --config=conf/pitch.conf ark:- '
+            'ark,scp:{2}/raw_pitch_chunks.JOB.ark,'
+            '{2}/raw_pitch_chunks.JOB.scp'.format(
+                utils.kaldi_cmd('train', direct=True), njobs,
+                pitch_dir, data_dir),
+            verbose=False)
+
+        chunks_scp = os.path.join(pitch_dir, 'raw_pitch_chunks.scp')
+        with open(chunks_scp, 'w') as out:
+            for n in range(1, njobs + 1):
+                out.write(open(os.path.join(
+                    pitch_dir, 'raw_pitch_chunks.{}.scp'.format(n))).read())
+
+        utt2chunks = {}
+        for chunk, utt, _, _, _, offset in chunks:
+            utt2chunks.setdefault(utt, []).append((offset, chunk))
+
+        # stitch the raw pitch of the utterances of each features job
+        with kaldi.ScpReader(chunks_scp, cache_size=0) as pitch:
+            for n in range(1, self.njobs + 1):
+                name = 'raw_{}_{}.{}'.format(self.type, self.name, n)
+                with kaldi.ScpReader(
+                        os.path.join(nopitch_dir, name + '.scp'),
+                        cache_size=0) as feats, ArkWriter(os.path.join(
+                            pitch_dir, 'raw_pitch.{}.ark'.format(n))) as ark:
+                    for utt in feats.keys():
+                        # chunks may be missing if too short for pitch
+                        utt_chunks = [
+                            (offset, pitch[chunk]) for offset, chunk in
+                            sorted(utt2chunks[utt]) if chunk in pitch]
+                        if utt_chunks:
+                            ark.write(utt, chunked_pitch.stitch(
+                                utt_chunks, nframes=feats.shape(utt)[0]))
+
+        name = 'raw_{}_pitch_{}.JOB'.format(self.type, self.name)
+        self._run_command(
+            '{0} JOB=1:{1} {2}/log/paste.JOB.log '
+            'paste-feats --length-tolerance=2 '
+            'scp:{3}/raw_{4}_{5}.JOB.scp '
+            '"ark,s,cs:process-kaldi-pitch-feats '
+            'ark:{2}/raw_pitch.JOB.ark ark:- |" ark:- | '
+            'copy-feats --compress={8} ark:- '
+            'ark,scp:{6}/{7}.ark,{6}/{7}.scp'.format(
+                utils.kaldi_cmd('train', direct=True), self.njobs,
+                pitch_dir, nopitch_dir, self.type, self.name,
+                self.output_dir, name, str(self.compress).lower()),
+            verbose=False)
+
+        # the data directory features, as written by the Kaldi scripts
+        with open(os.path.join(data_dir, 'feats.scp'), 'w') as out:
+            for scp in self._raw_scps(self.type):
+                out.write(open(scp, 'r').read())
+
+    def _compute_features_numpy(self):
+        """Compute the features in-process, replacing steps/make_*type*.sh
+
+        The utterances are split in jobs as the data directories of
+        the other recipes and each job is computed by a worker process.
+
+        """
+        self.log.info('computing %s features with numpy', ', '.join(
+            [self.type] + list(self.extra_types)))
+
+        # the extra types share the options they support (frames
+        # options, use-energy, etc...) with the main type
+        extractors = [numpy_features.Extractor.from_kaldi_options(
+            self.type, self.features_options)] + [
+                numpy_features.Extractor.from_kaldi_options(
+                    t, self.features_options, strict=False)
+                for t in self.extra_types]
+
+        corpus = self.a2k.corpus
+        spk2job = self.a2k.spk2job(self.njobs)
+        utt2job = {utt: spk2job[spk]
+                   for utt, spk in corpus.utt2spk.iteritems()}
+
+        scps = numpy_features.compute_corpus(
+            corpus, extractors, self.output_dir, utt2job,
+            name=self.name, compress=self.compress, log=self.log)[self.type]
+
+        # the data directory features, as written by the Kaldi scripts
+        data_scp = os.path.join(
+            self.recipe_dir, 'data', self.name, 'feats.scp')
+        with open(data_scp, 'w') as out:
+            for scp in scps:
+                out.write(open(scp, 'r').read())
+
     def _compute_delta(self):
         """Wrapper on add-deltas Kaldi executable
 
@@ -137,13 +400,34 @@ class Features(abstract_recipe.AbstractRecipe):
                 'Cannot compute deltas because order is lower than 1')
         self.log.info('computing deltas (order %s)', self.delta_order)
 
-        inputs = [f for f in utils.list_files_with_extension(
-            self.output_dir, '.scp', abspath=True, recursive=False)
-                  if 'raw_' in f]
-
-        # compute deltas in parallel, one job per scp file
-        joblib.Parallel(n_jobs=self.njobs, verbose=1, backend='threading')(
-            joblib.delayed(_delta_joblib_fnc)(scp, self) for scp in inputs)
+        # the deltas of each scp file are written to a new ark, the
+        # scp being replaced only once its job is completed. When the
+        # stage is resumed, the scp files already indexing their
+        # deltas are not processed again.
+        inputs = []
+        for scp in self._raw_scps(self.type):
+            if numpy_features.is_rewritten(scp, 'deltas'):
+                numpy_features.commit_scp(scp)
+            else:
+                inputs.append(scp)
+
+        # compute deltas in parallel, one job per scp file, all the
+        # add-deltas commands being multiplexed in a single event loop
+        try:
+            self._run_commands(
+                ['copy-feats --compress={2} '
+                 '"ark:add-deltas --delta-order={0} scp:{1} ark:- |" '
+                 'ark,scp:{3},{1}.tmp'.format(
+                     self.delta_order, scp, str(self.compress).lower(),
+                     numpy_features.rewritten_ark(scp, 'deltas'))
+                 for scp in inputs],
+                verbose=False)
+
+            for scp in inputs:
+                numpy_features.commit_scp(scp, scp + '.tmp')
+        finally:
+            for scp in inputs:
+                utils.remove(scp + '.tmp', safe=True)
 
     def _compute_cmvn_stats(self):
         """Wrapper on steps/compute_cmvn_stats.sh"""
@@ -159,35 +443,391 @@ class Features(abstract_recipe.AbstractRecipe):
         dest = os.path.join(self.output_dir, 'cmvn.scp')
         shutil.move(src, dest)
 
+    def _manifest(self):
+        return os.path.join(self.output_dir, 'features.manifest')
+
+    def _params_fingerprint(self):
+        return utils.checkpoint.fingerprint(
+            params=self._input_params() + [
+                self.use_cmvn, self.delta_order, self.use_vad,
+                self.vad_options, self.drop_unvoiced])
+
+    def _write_manifest(self):
+        """Write the fingerprint of each exported utterance
+
+        The manifest has a first line '# <params fingerprint>' followed
+        by a line 'utt spk fingerprint' per utterance. It is read by
+        _compute_incremental() to detect the modified utterances.
+
+        """
+        utt2spk = self.corpus.utt2spk
+        fingerprints = utils.checkpoint.utt_fingerprints(self.corpus)
+        with open(self._manifest(), 'w') as out:
+            out.write('# {}\n'.format(self._params_fingerprint()))
+            for utt in sorted(fingerprints):
+                out.write('{} {} {}\n'.format(
+                    utt, utt2spk[utt], fingerprints[utt]))
+
+    def _read_manifest(self):
+        """Return the manifest as (params, {utt: (spk, fingerprint)})
+
+        Return None if there is no manifest in output_dir
+
+        """
+        if not os.path.isfile(self._manifest()):
+            return None
+
+        utts = {}
+        with open(self._manifest(), 'r') as manifest:
+            params = manifest.readline().strip().lstrip('# ')
+            for line in manifest:
+                utt, spk, fingerprint = line.strip().split(' ')
+                utts[utt] = (spk, fingerprint)
+        return params, utts
+
+    def _write_wav_scp(self):
+        """Write output_dir/wav.scp with paths relative to the corpus"""
+        with open(os.path.join(self.output_dir, 'wav.scp'), 'w') as scp:
+            for wav in sorted(set(
+                    w for w, _, _ in self.corpus.segments.values())):
+                scp.write('{} {}\n'.format(
+                    wav, os.path.join(self.corpus.wav_folder, wav)))
+
+    def _compute_incremental(self, previous):
+        """Update the exported features for the modified utterances
+
+        `previous` is the dict utt -> (spk, fingerprint) read from the
+        manifest. The features of the new or modified utterances are
+        computed by a Features recipe in 'output_dir/increment.<k>'
+        and merged in the exported scp files, the removed utterances
+        are dropped from them. The CMVN statistics are updated only
+        for the speakers of those utterances.
+
+        The features of modified or removed utterances are left in
+        their ark files but are no more referenced.
+
+        """
+        utt2spk = self.corpus.utt2spk
+        current = utils.checkpoint.utt_fingerprints(self.corpus)
+        changed = sorted(
+            utt for utt, fingerprint in current.iteritems()
+            if previous.get(utt) != (utt2spk[utt], fingerprint))
+        removed = sorted(set(previous) - set(current))
+
+        if not changed and not removed:
+            self.log.info('features are up to date, nothing to compute')
+            return
+
+        self.log.info(
+            'updating features: %s new or modified utterances, '
+            '%s removed', len(changed), len(removed))
+
+        # a new directory for that increment
+        k = 1
+        while os.path.exists(
+                os.path.join(self.output_dir, 'increment.{}'.format(k))):
+            k += 1
+        increment_dir = os.path.join(
+            self.output_dir, 'increment.{}'.format(k))
+        os.makedirs(increment_dir)
+
+        scps = [scp for scp in self._exported_scps() if scp != 'cmvn.scp']
+        lines = {scp: self._read_scp_lines(
+            os.path.join(self.output_dir, scp), keep=current) for scp in scps}
+        for scp in scps:
+            for utt in changed:
+                lines[scp].pop(utt, None)
+
+        if changed:
+            recipe = Features(
+                self.corpus.subcorpus(changed, validate=False),
+                increment_dir, type=self.type, use_pitch=self.use_pitch,
+                use_cmvn=False, delta_order=self.delta_order, log=self.log)
+            recipe.features_options = self.features_options
+            recipe.extractor = self.extractor
+            recipe.extra_types = self.extra_types
+            recipe.pitch_chunk_size = self.pitch_chunk_size
+            recipe.pitch_chunk_overlap = self.pitch_chunk_overlap
+            recipe.compress = self.compress
+            recipe.use_vad = self.use_vad
+            recipe.vad_options = self.vad_options
+            recipe.drop_unvoiced = self.drop_unvoiced
+            recipe.njobs = self.njobs
+            recipe.delete_recipe = self.delete_recipe
+            recipe.compute()
+
+            for scp in scps:
+                lines[scp].update(self._read_scp_lines(
+                    os.path.join(increment_dir, scp)))
+
+        for scp in scps:
+            with open(os.path.join(self.output_dir, scp), 'w') as out:
+                for utt in sorted(lines[scp]):
+                    out.write(lines[scp][utt])
+
+        if self.use_cmvn:
+            # speakers of an utterance before and after the change
+            self._update_cmvn_stats(
+                set(utt2spk[utt] for utt in changed) |
+                set(previous[utt][0] for utt in changed + removed
+                    if utt in previous),
+                os.path.join(increment_dir, 'cmvn_{}.ark'.format(self.name)))
+
+        self._write_wav_scp()
+        self._write_manifest()
+
+    @staticmethod
+    def _read_scp_lines(scp, keep=None):
+        """Return a dict utt -> line read from `scp`
+
+        If `keep` is specified, ignore the utterances not in it
+
+        """
+        lines = {}
+        if os.path.isfile(scp):
+            for line in open(scp, 'r'):
+                utt = line.split(' ', 1)[0]
+                if keep is None or utt in keep:
+                    lines[utt] = line
+        return lines
+
+    def _update_cmvn_stats(self, speakers, arkfile):
+        """Recompute the CMVN statistics of `speakers` in numpy
+
+        The statistics are computed on the raw features of each
+        speaker (without deltas) and written to `arkfile`. The
+        output_dir/cmvn.scp is updated to point on them, the speakers
+        without any utterance left are removed from it.
+
+        """
+        self.log.info(
+            'updating CMVN statistics for %s speakers', len(speakers))
+
+        cmvn_scp = os.path.join(self.output_dir, 'cmvn.scp')
+        lines = self._read_scp_lines(cmvn_scp)
+
+        spk2utts = {}
+        for utt, spk in self.corpus.utt2spk.iteritems():
+            spk2utts.setdefault(spk, []).append(utt)
+
+        with kaldi.ScpReader(
+                os.path.join(self.output_dir, 'feats.scp'),
+                cache_size=0) as feats:
+            with ArkWriter(arkfile) as ark:
+                for spk in sorted(speakers):
+                    utts = [u for u in spk2utts.get(spk, []) if u in feats]
+                    if not utts:
+                        lines.pop(spk, None)
+                        continue
+
+                    # deltas are appended to the raw features
+                    dim = feats[utts[0]].shape[1] // (self.delta_order + 1)
+                    stats = numpy_features.cmvn_stats(
+                        feats[utt][:, :dim] for utt in utts)
+                    lines[spk] = '{} {}:{}\n'.format(
+                        spk, arkfile, ark.write(spk, stats))
+
+        with open(cmvn_scp, 'w') as out:
+            for spk in sorted(lines):
+                out.write(lines[spk])
+
+    def _exported_scps(self):
+        """Return the scp files exported in output_dir"""
+        return (['feats.scp'] +
+                ['feats_{}.scp'.format(t) for t in self.extra_types] +
+                (['cmvn.scp'] if self.use_cmvn else []) +
+                (['vad.scp'] if self.use_vad else []))
+
+    def _cache_key(self):
+        """Return the key of the features in cache
+
+        The key covers the wavs and segments of the utterances, the
+        speakers and the features parameters.
+
+        """
+        return utils.checkpoint.fingerprint(params=[
+            sorted(utils.checkpoint.utt_fingerprints(self.corpus).items()),
+            sorted(self.corpus.utt2spk.items()),
+            self._params_fingerprint()])
+
+    def _restore_from_cache(self):
+        """Restore the features from cache, return True on a cache hit"""
+        if not self.cache.restore(
+                self._cache_key(), self.output_dir, self._exported_scps()):
+            return False
+
+        self._write_wav_scp()
+        self._write_manifest()
+        self.meta.save(os.path.join(self.output_dir, 'meta.txt'))
+        return True
+
+    def compute(self):
+        """Create, run and export the recipe
+
+        If `self.incremental` is True and the features have already
+        been exported to output_dir with the same parameters, compute
+        only the features of the new or modified utterances.
+
+        If `self.cache` is defined, the features are restored from it
+        when already computed, or stored in it once computed.
+
+        """
+        previous = self._read_manifest() if self.incremental else None
+        if previous is not None and previous[0] == self._params_fingerprint():
+            self.check_parameters()
+            self._compute_incremental(previous[1])
+        else:
+            if self.incremental:
+                self.log.info(
+                    'no previous features with the same parameters '
+                    'in %s, computing all the features', self.output_dir)
+
+            if self.cache is not None:
+                if self._restore_from_cache():
+                    self._completed = True
+                    return
+                features_cache.unshare(self.output_dir)
+
+            super(Features, self).compute()
+
+        if self.cache is not None:
+            self.cache.store(
+                self._cache_key(), self.output_dir, self._exported_scps())
+        self._completed = True
+
+    def _compute_cmvn_deltas_numpy(self):
+        """Compute CMVN statistics and deltas in a single pass with numpy
+
+        This replaces _compute_cmvn_stats() and _compute_delta() for
+        the numpy extractor: the raw features are read once by worker
+        processes, the deltas replace the raw features and the CMVN
+        statistics (on raw features) are written to
+        'output_dir/cmvn_<name>.ark' and indexed in cmvn.scp.
+
+        """
+        self.log.info('computing %s with numpy', ' and '.join(
+            (['CMVN statistics'] if self.use_cmvn else []) +
+            (['deltas (order {})'.format(self.delta_order)]
+             if self.delta_order > 0 else [])))
+
+        stats = numpy_features.postprocess_scps(
+            self._raw_scps(self.type), delta_order=self.delta_order,
+            utt2spk=self.a2k.corpus.utt2spk if self.use_cmvn else None,
+            compress=self.compress, log=self.log)
+
+        if self.use_cmvn:
+            with ArkWriter(
+                    os.path.join(
+                        self.output_dir, 'cmvn_{}.ark'.format(self.name)),
+                    os.path.join(self.output_dir, 'cmvn.scp')) as ark:
+                for spk in sorted(stats):
+                    ark.write(spk, stats[spk])
+
+    def _compute_vad(self):
+        """Compute the voice activity decisions to output_dir/vad.scp
+
+        The decisions are computed with numpy on the raw features,
+        this replaces the Kaldi program compute-vad.
+
+        """
+        self.log.info('computing voice activity detection')
+        scps = numpy_features.compute_vad(
+            self._raw_scps(self.type), self.output_dir, name=self.name,
+            options=self.vad_options, log=self.log)
+
+        lines = {}
+        for scp in scps:
+            lines.update(self._read_scp_lines(scp))
+            utils.remove(scp)
+
+        with open(os.path.join(self.output_dir, 'vad.scp'), 'w') as out:
+            for utt in sorted(lines):
+                out.write(lines[utt])
+
+    def _select_voiced_frames(self):
+        """Remove the unvoiced frames from the raw features
+
+        The frames are dropped after the deltas computation, so the
+        deltas are computed on contiguous frames. The original index
+        of each remaining frame is given by vad.scp.
+
+        """
+        self.log.info('dropping unvoiced frames')
+        dropped = 0
+        for type in [self.type] + list(self.extra_types):
+            dropped += numpy_features.select_voiced_frames(
+                self._raw_scps(type),
+                os.path.join(self.output_dir, 'vad.scp'),
+                compress=self.compress, log=self.log)
+
+        if dropped:
+            self.log.warning(
+                '%s utterances without voiced frames removed', dropped)
+
     def create(self):
         super(Features, self).create()
         self._setup_conf_dir()
 
-    def run(self):
-        self._compute_features()
+    def _input_params(self):
+        return [self.type, self.use_pitch, self.features_options,
+                self.extractor, self.extra_types, self.pitch_chunk_size,
+                self.pitch_chunk_overlap, self.compress]
 
-        if self.use_cmvn:
-            self._compute_cmvn_stats()
+    def _intermediate_files(self):
+        # the features without pitch and the pitch arks, pasted to
+        # the features in output_dir
+        return {'compute features': (
+            ['compute features'],
+            ['nopitch',
+             os.path.join('exp', 'make_pitch', self.name, '*.ark')])}
 
-        if self.delta_order != 0:
-            self._compute_delta()
+    def run(self):
+        # the following stages rewrite the raw features, they are
+        # computed again when the parameters of those stages change
+        self._run_stage(
+            'compute features', self._compute_features,
+            params=[self.use_cmvn, self.delta_order, self.use_vad,
+                    self.vad_options, self.drop_unvoiced])
+
+        if self.use_vad:
+            self._run_stage(
+                'VAD', self._compute_vad, params=[self.vad_options])
+
+        if self.extractor == 'numpy':
+            if self.use_cmvn or self.delta_order > 0:
+                self._run_stage(
+                    'CMVN and deltas', self._compute_cmvn_deltas_numpy,
+                    params=[self.use_cmvn, self.delta_order])
+        else:
+            if self.use_cmvn:
+                self._run_stage('CMVN', self._compute_cmvn_stats)
+
+            if self.delta_order != 0:
+                self._run_stage(
+                    'deltas', self._compute_delta,
+                    params=[self.delta_order])
+
+        if self.drop_unvoiced:
+            self._run_stage('select voiced frames', self._select_voiced_frames)
 
     def export(self):
         super(Features, self).export()
 
         # merge the features output scp files into a single one
-        # 'feats.scp', and delete them, sort them in natural order to
-        # preserve Kaldi ordering
-        inputs = [f for f in utils.list_files_with_extension(
-            self.output_dir, '.scp', abspath=True, recursive=False)
-                  if 'raw_' in f]
-        inputs.sort(key=utils.natural_sort_keys)
-
-        output_scp = os.path.join(self.output_dir, 'feats.scp')
-        with open(output_scp, 'w') as outfile:
-            for infile in inputs:
-                outfile.write(open(infile, 'r').read())
-                utils.remove(infile)
+        # 'feats.scp' (or 'feats_<type>.scp' for extra types), and
+        # delete them, sort them in natural order to preserve Kaldi
+        # ordering
+        outputs = [(self.type, 'feats.scp')] + [
+            (t, 'feats_{}.scp'.format(t)) for t in self.extra_types]
+        for type, output_scp in outputs:
+            inputs = self._raw_scps(type)
+            inputs.sort(key=utils.natural_sort_keys)
+
+            with open(os.path.join(
+                    self.output_dir, output_scp), 'w') as outfile:
+                for infile in inputs:
+                    outfile.write(open(infile, 'r').read())
+                    utils.remove(infile)
 
         # export wav.scp, correct paths to be relative to corpus
         # instead of recipe_dir. TODO Do we really need a reference to
@@ -203,32 +843,5 @@ class Features(abstract_recipe.AbstractRecipe):
                 wav = os.path.join(self.corpus.wav_folder, key)
                 scp.write('{} {}\n'.format(key, wav))
 
+        self._write_manifest()
 
-def _delta_joblib_fnc(scp, instance):
-    """A tweak to compute deltas inplace and in parallel using joblib
-
-    class methods are not pickable so we pass a Features instance as a
-    parameter instead of using self.
-
-    scp is a str or a 1-length tuple containing the scp to compute delta on
-
-    """
-    # filename of the input
-    if isinstance(scp, tuple):
-        scp = scp[0]
-
-    # temp file for pseudo-inplace operation
-    tmp = scp + '_tmp'
-
-    try:
-        # compute deltas to tmp
-        instance._run_command(
-            'add-deltas --delta-order={0} scp:{1} ark:{2}'.format(
-                instance.delta_order, scp, tmp), verbose=False)
-
-        # move tmp to scp
-        instance._run_command(
-            'copy-feats ark:{} ark,scp:{},{}'.format(
-                tmp, scp.replace('.scp', '.ark'), scp), verbose=False)
-    finally:
-        utils.remove(tmp, safe=True)
@@ -0,0 +1,219 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""A content-addressed cache of computed features
+
+The cache is a directory with an entry per key, the key being a
+fingerprint of the corpus and of the features configuration. An entry
+stores the exported scp files (with paths relative to the entry) and
+the ark files they reference. The arks are hardlinked between the
+cache and the features directories whenever possible, so a cache hit
+costs no copy.
+
+The cache size is bounded, the least recently used entries are
+evicted first.
+
+"""
+
+import os
+import shutil
+
+import abkhazia.utils as utils
+from abkhazia.kaldi.scp import parse_scp
+
+
+def _link(src, dest):
+    """Hardlink `src` to `dest`, fallback to a copy
+
+    A symlink is never used: the restored features would be left
+    dangling once the entry is evicted from the cache.
+
+    """
+    if not os.path.isdir(os.path.dirname(dest)):
+        os.makedirs(os.path.dirname(dest))
+    try:
+        os.link(src, dest)
+    except OSError:  # cross-device link
+        shutil.copy(src, dest)
+
+
+def unshare(directory):
+    """Replace the arks in `directory` linked to the cache by copies
+
+    The arks restored from (or stored in) the cache are links on the
+    cached ones, they must be unshared before computing new features
+    in place, or the cache would be corrupted.
+
+    """
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if (name.endswith('.ark') and
+                    (os.path.islink(path) or os.stat(path).st_nlink > 1)):
+                shutil.copy(path, path + '.tmp')
+                os.rename(path + '.tmp', path)
+
+
+class FeaturesCache(object):
+    """Store and restore features directories given their key
+
+    Parameters:
+    -----------
+
+    directory (str): the cache directory, created if non existing
+
+    max_size (float): the maximal size of the cache in GB
+
+    log (logging.Logger): optional log for messages
+
+    """
+    def __init__(self, directory, max_size=50,
+                 log=utils.logger.null_logger()):
+        self.directory = os.path.abspath(directory)
+        self.max_size = max_size
+        self.log = log
+
+    @classmethod
+    def from_config(cls, log=utils.logger.null_logger()):
+        """Return the cache defined in the abkhazia configuration
+
+        Read the 'features-cache-directory' and 'features-cache-size'
+        entries of the [abkhazia] section, the default directory is
+        ~/.cache/abkhazia/features and the default size 50 GB.
+
+        """
+        config = utils.config
+        directory = (config.get('abkhazia', 'features-cache-directory')
+                     .strip() if config.has_option(
+                         'abkhazia', 'features-cache-directory') else '')
+        size = (config.get('abkhazia', 'features-cache-size').strip()
+                if config.has_option('abkhazia', 'features-cache-size')
+                else '')
+
+        return cls(
+            directory or os.path.join(
+                os.path.expanduser('~'), '.cache', 'abkhazia', 'features'),
+            max_size=float(size) if size else 50, log=log)
+
+    def _entry(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._entry(key))
+
+    def restore(self, key, output_dir, scps):
+        """Restore the `scps` files of the entry `key` in `output_dir`
+
+        The arks are linked in `output_dir` and the scp files
+        rewritten to reference them. Return False if the entry is not
+        in cache, True otherwise.
+
+        """
+        entry = self._entry(key)
+        if key not in self or not all(
+                os.path.isfile(os.path.join(entry, scp)) for scp in scps):
+            return False
+
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        linked = set()
+        for scp in scps:
+            lines = []
+            for utt, (ark, offset) in parse_scp(
+                    os.path.join(entry, scp)).iteritems():
+                dest = os.path.join(output_dir, ark)
+                if dest not in linked:
+                    # replace any previous ark with the same name
+                    if os.path.lexists(dest):
+                        utils.remove(dest)
+                    _link(os.path.join(entry, ark), dest)
+                    linked.add(dest)
+                lines.append('{} {}:{}\n'.format(utt, dest, offset))
+
+            with open(os.path.join(output_dir, scp), 'w') as out:
+                out.write(''.join(lines))
+
+        # mark the entry as the most recently used
+        os.utime(entry, None)
+        self.log.info('features restored from cache %s', entry)
+        return True
+
+    def store(self, key, output_dir, scps):
+        """Store the `scps` files from `output_dir` under `key`
+
+        The arks referenced by the scp files must be in `output_dir`.
+        The entry is not stored if it is larger than the cache. Evict
+        the least recently used entries to bound the cache size.
+
+        """
+        if key in self:
+            os.utime(self._entry(key), None)
+            return
+
+        tmp = self._entry(key) + '.tmp.{}'.format(os.getpid())
+        try:
+            for scp in scps:
+                lines = []
+                for utt, (ark, offset) in parse_scp(
+                        os.path.join(output_dir, scp)).iteritems():
+                    ark = os.path.relpath(ark, output_dir)
+                    if ark.startswith(os.pardir):
+                        self.log.debug(
+                            'not caching %s: %s is out of %s',
+                            key, ark, output_dir)
+                        return
+                    if not os.path.exists(os.path.join(tmp, ark)):
+                        _link(os.path.join(output_dir, ark),
+                              os.path.join(tmp, ark))
+                    lines.append('{} {}:{}\n'.format(utt, ark, offset))
+
+                if not os.path.isdir(tmp):
+                    os.makedirs(tmp)
+                with open(os.path.join(tmp, scp), 'w') as out:
+                    out.write(''.join(lines))
+
+            if utils.directory_size(tmp) > self.max_size * 2**30:
+                self.log.warning(
+                    'features too large to be cached (%.1f GB)',
+                    utils.directory_size(tmp) / float(2**30))
+                return
+
+            # concurrent stores of the same key keep the first one
+            try:
+                os.rename(tmp, self._entry(key))
+            except OSError:
+                return
+            self.log.info('features stored in cache %s', self._entry(key))
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until under max_size"""
+        entries = sorted(
+            (os.path.getmtime(path), utils.directory_size(path), path)
+            for path in (os.path.join(self.directory, d)
+                         for d in os.listdir(self.directory))
+            if os.path.isdir(path) and '.tmp.' not in path)
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_size * 2**30:
+                break
+            self.log.debug('evicting %s from features cache', path)
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
@@ -0,0 +1,831 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""MFCC and filterbank features computed with numpy
+
+This is a vectorized reimplementation of the Kaldi programs
+compute-mfcc-feats and compute-fbank-feats: framing, dithering, DC
+offset removal, pre-emphasis, windowing, mel filterbank, DCT and
+liftering follow the Kaldi implementation, with the same options and
+defaults. Apart from the dithering (which is random), the features
+match the Kaldi ones up to float precision.
+
+The features of a corpus are computed in-process by a pool of workers
+with the compute_corpus function, without any Kaldi installation.
+Deltas and CMVN statistics (as add-deltas and compute-cmvn-stats) are
+computed in a single pass over the raw arks by postprocess_scps. An
+energy based voice activity detection (as compute-vad) is given by
+compute_vad and select_voiced_frames.
+
+"""
+
+import glob
+import multiprocessing
+import os
+import wave
+
+import numpy as np
+
+import abkhazia.utils as utils
+from abkhazia.kaldi import ArkWriter, ScpReader
+from abkhazia.kaldi.scp import parse_scp
+
+
+_EPSILON = np.finfo(np.float32).eps
+"""The floor of energies before log, as in Kaldi"""
+
+
+_DEFAULTS = {
+    # frame extraction options
+    'frame-length': 25.0,
+    'frame-shift': 10.0,
+    'dither': 1.0,
+    'preemphasis-coefficient': 0.97,
+    'remove-dc-offset': True,
+    'window-type': 'povey',
+    'blackman-coeff': 0.42,
+    'round-to-power-of-two': True,
+    # mel banks options
+    'num-mel-bins': 23,
+    'low-freq': 20.0,
+    'high-freq': 0.0,
+    # mfcc and fbank options
+    'num-ceps': 13,
+    'cepstral-lifter': 22.0,
+    'use-energy': True,
+    'energy-floor': 0.0,
+    'raw-energy': True,
+    'use-log-fbank': True,
+    'use-power': True}
+"""Default options of compute-mfcc-feats and compute-fbank-feats"""
+
+
+_OPTIONS = {
+    'mfcc': ('frame-length', 'frame-shift', 'dither',
+             'preemphasis-coefficient', 'remove-dc-offset', 'window-type',
+             'blackman-coeff', 'round-to-power-of-two', 'num-mel-bins',
+             'low-freq', 'high-freq', 'num-ceps', 'cepstral-lifter',
+             'use-energy', 'energy-floor', 'raw-energy'),
+    'fbank': ('frame-length', 'frame-shift', 'dither',
+              'preemphasis-coefficient', 'remove-dc-offset', 'window-type',
+              'blackman-coeff', 'round-to-power-of-two', 'num-mel-bins',
+              'low-freq', 'high-freq', 'use-energy', 'energy-floor',
+              'raw-energy', 'use-log-fbank', 'use-power')}
+"""The options supported for each type of features"""
+
+
+def read_wav(filename, tbegin=None, tend=None):
+    """Return the samples of a mono 16 bits wav and its sample rate
+
+    The samples are returned as a float array of values in [-32768,
+    32767], as read by Kaldi. If `tbegin` and/or `tend` are
+    specified, only the samples in that segment are returned.
+
+    Raise IOError if the wav is not mono or not 16 bits
+
+    """
+    wav = wave.open(filename, 'rb')
+    try:
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise IOError('{} must be mono with 16 bits samples'.format(
+                filename))
+        rate = wav.getframerate()
+        samples = np.frombuffer(
+            wav.readframes(wav.getnframes()), dtype='<i2')
+    finally:
+        wav.close()
+
+    return _segment(samples, rate, tbegin, tend).astype(np.float64), rate
+
+
+def _segment(samples, rate, tbegin=None, tend=None):
+    """Return the `samples` between `tbegin` and `tend` in seconds"""
+    # same rounding as Kaldi extract-segments
+    start = int(tbegin * rate) if tbegin else 0
+    stop = int(tend * rate) if tend else samples.shape[0]
+    return samples[start:stop]
+
+
+def mel_scale(freq):
+    return 1127.0 * np.log(1.0 + freq / 700.0)
+
+
+def mel_banks(num_bins, padded_length, sample_frequency,
+              low_freq=20.0, high_freq=0.0):
+    """Return the triangular mel filters as a (num_bins, N/2) matrix
+
+    N is the `padded_length` of the FFT. As in Kaldi the Nyquist
+    frequency bin is not used and a non positive `high_freq` is an
+    offset from the Nyquist frequency.
+
+    """
+    nyquist = 0.5 * sample_frequency
+    if high_freq <= 0:
+        high_freq += nyquist
+
+    mel_low, mel_high = mel_scale(low_freq), mel_scale(high_freq)
+    delta = (mel_high - mel_low) / (num_bins + 1)
+
+    fft_mels = mel_scale(
+        np.arange(padded_length // 2) * sample_frequency / padded_length)
+    left = mel_low + np.arange(num_bins)[:, None] * delta
+    center, right = left + delta, left + 2 * delta
+
+    up = (fft_mels - left) / (center - left)
+    down = (right - fft_mels) / (right - center)
+    return np.where(
+        (fft_mels > left) & (fft_mels < right),
+        np.where(fft_mels <= center, up, down), 0.0)
+
+
+def dct_matrix(num_ceps, num_bins):
+    """Return the normalized DCT-II matrix used by Kaldi"""
+    dct = np.sqrt(2.0 / num_bins) * np.cos(
+        np.pi / num_bins * np.outer(
+            np.arange(num_ceps), np.arange(num_bins) + 0.5))
+    dct[0, :] = np.sqrt(1.0 / num_bins)
+    return dct
+
+
+def window_function(length, window_type='povey', blackman_coeff=0.42):
+    """Return the analysis window of a frame of `length` samples
+
+    Raise RuntimeError if the `window_type` is unknown
+
+    """
+    a = 2 * np.pi / (length - 1)
+    i = np.arange(length)
+    if window_type == 'povey':
+        return (0.5 - 0.5 * np.cos(a * i)) ** 0.85
+    if window_type == 'hanning':
+        return 0.5 - 0.5 * np.cos(a * i)
+    if window_type == 'hamming':
+        return 0.54 - 0.46 * np.cos(a * i)
+    if window_type == 'sine':
+        return np.sin(0.5 * a * i)
+    if window_type == 'blackman':
+        return (blackman_coeff - 0.5 * np.cos(a * i) +
+                (0.5 - blackman_coeff) * np.cos(2 * a * i))
+    if window_type == 'rectangular':
+        return np.ones(length)
+    raise RuntimeError('unknown window type "{}"'.format(window_type))
+
+
+class Extractor(object):
+    """Compute MFCC or filterbank features as Kaldi does
+
+    Parameters:
+    -----------
+
+    type (str): the features to compute, 'mfcc' or 'fbank'
+
+    options (dict): the Kaldi options of compute-mfcc-feats or
+      compute-fbank-feats, as option name (without leading '--') ->
+      value, values being str or numbers. Missing options take their
+      Kaldi default.
+
+    seed (int): the seed of the random generator used for dithering
+
+    Raise:
+    ------
+
+    RuntimeError if the type of features or an option is not
+    supported
+
+    """
+    def __init__(self, type='mfcc', options=None, seed=0):
+        if type not in _OPTIONS:
+            raise RuntimeError(
+                'features type "{}" not supported by numpy, choose '
+                'mfcc or fbank'.format(type))
+        self.type = type
+
+        self.options = dict(
+            (k, v) for k, v in _DEFAULTS.iteritems() if k in _OPTIONS[type])
+        if type == 'fbank':
+            # the only default differing between mfcc and fbank
+            self.options['use-energy'] = False
+
+        for name, value in (options or {}).iteritems():
+            if name not in self.options:
+                raise RuntimeError(
+                    'option --{} not supported by numpy {} features'
+                    .format(name, type))
+            default = self.options[name]
+            if isinstance(default, bool):
+                value = utils.str2bool(value)
+            elif isinstance(default, int):
+                value = int(value)
+            elif isinstance(default, float):
+                value = float(value)
+            self.options[name] = value
+
+        self.random = np.random.RandomState(seed)
+        self._cache = {}
+
+    @classmethod
+    def from_kaldi_options(cls, type, options, seed=0, strict=True):
+        """Return an extractor from a list of (name, value) options
+
+        This is the format of Features.features_options. If `strict`
+        is False, the options not supported by that `type` are
+        ignored.
+
+        """
+        options = dict(options)
+        if not strict:
+            options = {k: v for k, v in options.iteritems()
+                       if k in _OPTIONS.get(type, ())}
+        return cls(type, options, seed=seed)
+
+    def dim(self):
+        """Return the dimension of the computed features"""
+        if self.type == 'mfcc':
+            return self.options['num-ceps']
+        return self.options['num-mel-bins'] + int(self.options['use-energy'])
+
+    def _setup(self, sample_frequency):
+        """Return the frame sizes, window and matrices at that frequency"""
+        if sample_frequency not in self._cache:
+            opt = self.options
+            length = int(sample_frequency * 0.001 * opt['frame-length'])
+            shift = int(sample_frequency * 0.001 * opt['frame-shift'])
+            padded = (2 ** int(np.ceil(np.log2(length)))
+                      if opt['round-to-power-of-two'] else length)
+
+            banks = mel_banks(
+                opt['num-mel-bins'], padded, sample_frequency,
+                opt['low-freq'], opt['high-freq'])
+
+            if self.type == 'mfcc':
+                dct = dct_matrix(opt['num-ceps'], opt['num-mel-bins'])
+                lifter = opt['cepstral-lifter']
+                if lifter:
+                    dct *= (1.0 + 0.5 * lifter * np.sin(
+                        np.pi * np.arange(opt['num-ceps']) / lifter))[:, None]
+            else:
+                dct = None
+
+            self._cache[sample_frequency] = (
+                length, shift, padded,
+                window_function(
+                    length, opt['window-type'], opt['blackman-coeff']),
+                banks, dct)
+        return self._cache[sample_frequency]
+
+    def frames(self, signal, sample_frequency):
+        """Return the (num_frames, frame_length) frames of a signal
+
+        The frames are extracted as Kaldi does with --snip-edges=true
+
+        """
+        length, shift = self._setup(sample_frequency)[:2]
+        if signal.shape[0] < length:
+            return np.zeros((0, length))
+
+        nframes = 1 + (signal.shape[0] - length) // shift
+        signal = np.ascontiguousarray(signal, dtype=np.float64)
+        return np.lib.stride_tricks.as_strided(
+            signal, shape=(nframes, length),
+            strides=(signal.strides[0] * shift, signal.strides[0])).copy()
+
+    def compute(self, signal, sample_frequency=16000):
+        """Return the features of a `signal` as a float32 matrix
+
+        `signal` is a 1D array of samples, in the int16 range.
+
+        """
+        opt = self.options
+        length, _, padded, window, banks, dct = self._setup(
+            sample_frequency)
+
+        frames = self.frames(signal, sample_frequency)
+        if frames.shape[0] == 0:
+            return np.zeros((0, self.dim()), dtype=np.float32)
+
+        if opt['dither']:
+            frames += opt['dither'] * self.random.standard_normal(
+                frames.shape)
+
+        if opt['remove-dc-offset']:
+            frames -= frames.mean(axis=1)[:, None]
+
+        if opt['raw-energy']:
+            energy = (frames ** 2).sum(axis=1)
+
+        coeff = opt['preemphasis-coefficient']
+        if coeff:
+            frames[:, 1:] -= coeff * frames[:, :-1]
+            frames[:, 0] -= coeff * frames[:, 0]
+
+        frames *= window
+
+        if not opt['raw-energy']:
+            energy = (frames ** 2).sum(axis=1)
+        energy = np.log(np.maximum(energy, _EPSILON))
+        if opt['energy-floor'] > 0:
+            energy = np.maximum(energy, np.log(opt['energy-floor']))
+
+        spectrum = np.abs(np.fft.rfft(frames, n=padded))[:, :padded // 2]
+        if self.type == 'mfcc' or opt['use-power']:
+            spectrum **= 2
+        mel = spectrum.dot(banks.T)
+
+        if self.type == 'mfcc':
+            features = np.log(np.maximum(mel, _EPSILON)).dot(dct.T)
+            if opt['use-energy']:
+                features[:, 0] = energy
+        else:
+            features = (np.log(np.maximum(mel, _EPSILON))
+                        if opt['use-log-fbank'] else mel)
+            if opt['use-energy']:
+                features = np.hstack((energy[:, None], features))
+
+        return features.astype(np.float32)
+
+
+def cmvn_stats(features):
+    """Return the CMVN statistics of a sequence of features matrices
+
+    The statistics are accumulated as Kaldi compute-cmvn-stats does,
+    in a (2, dim + 1) double matrix: the first row is the sum of the
+    frames followed by the number of frames, the second row is the
+    sum of the squared frames followed by 0.
+
+    """
+    stats = None
+    for feats in features:
+        if stats is None:
+            stats = np.zeros((2, feats.shape[1] + 1), dtype=np.float64)
+        feats = feats.astype(np.float64)
+        stats[0, :-1] += feats.sum(axis=0)
+        stats[1, :-1] += (feats ** 2).sum(axis=0)
+        stats[0, -1] += feats.shape[0]
+    return stats
+
+
+def delta_scales(order, window=2):
+    """Return the filters computing the deltas up to `order`
+
+    The filters are computed iteratively from a window of +/-
+    `window` frames, as in the Kaldi DeltaFeatures class. The
+    returned list has `order` + 1 elements, the first one being the
+    identity.
+
+    """
+    normalizer = 2.0 * sum(j * j for j in range(1, window + 1))
+    scales = [np.ones(1)]
+    for _ in range(order):
+        previous = scales[-1]
+        current = np.zeros(previous.shape[0] + 2 * window)
+        for j in range(-window, window + 1):
+            current[j + window:j + window + previous.shape[0]] += (
+                j * previous)
+        scales.append(current / normalizer)
+    return scales
+
+
+def add_deltas(features, order, window=2):
+    """Return the `features` with their deltas up to `order` appended
+
+    This is the equivalent of the Kaldi program add-deltas, the edge
+    frames are replicated to compute the deltas at the boundaries.
+
+    """
+    scales = delta_scales(order, window)
+    nframes, dim = features.shape
+    max_offset = (scales[-1].shape[0] - 1) // 2
+    padded = features.astype(np.float64).take(
+        np.clip(np.arange(-max_offset, nframes + max_offset),
+                0, nframes - 1), axis=0)
+
+    output = np.zeros((nframes, dim * len(scales)), dtype=np.float64)
+    for i, scale in enumerate(scales):
+        offset = max_offset - (scale.shape[0] - 1) // 2
+        for j in np.nonzero(scale)[0]:
+            output[:, i * dim:(i + 1) * dim] += (
+                scale[j] * padded[offset + j:offset + j + nframes])
+    return output.astype(np.float32)
+
+
+def vad_energy(features, energy_threshold=5.0, energy_mean_scale=0.5,
+               frames_context=0, proportion_threshold=0.6):
+    """Return the voice activity decision of each frame of `features`
+
+    This is the energy based detector of the Kaldi program
+    compute-vad, with the same options and defaults: a frame is voiced
+    if, in a window of +/- `frames_context` frames, the proportion of
+    frames with a log energy (the first column of `features`) above
+    `energy_threshold` + `energy_mean_scale` * mean log energy is at
+    least `proportion_threshold`.
+
+    Return a float32 vector of 1 (voiced) and 0 (unvoiced) frames.
+
+    """
+    log_energy = features[:, 0].astype(np.float64)
+    nframes = log_energy.shape[0]
+    if nframes == 0:
+        return np.zeros(0, dtype=np.float32)
+
+    threshold = energy_threshold + energy_mean_scale * log_energy.mean()
+    above = np.concatenate(([0], np.cumsum(log_energy > threshold)))
+
+    # number of frames above threshold in each window
+    begin = np.maximum(np.arange(nframes) - frames_context, 0)
+    end = np.minimum(np.arange(nframes) + frames_context + 1, nframes)
+    return ((above[end] - above[begin]) >=
+            (end - begin) * proportion_threshold).astype(np.float32)
+
+
+def _run_jobs(function, jobs):
+    """Return the results of `function` called on each `jobs` arguments
+
+    The jobs are computed by a pool of processes, one per job but at
+    most one per core of the local machine.
+
+    """
+    pool = multiprocessing.Pool(
+        max(1, min(len(jobs), utils.default_njobs(local=True))))
+    try:
+        results = [pool.apply_async(function, args) for args in jobs]
+        results = [result.get() for result in results]
+        pool.close()
+        return results
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def rewritten_ark(scp, tag):
+    """Return the ark where the features of `scp` are rewritten by `tag`
+
+    As 'raw_mfcc_features.1.deltas.ark' for the scp
+    'raw_mfcc_features.1.scp' and the tag 'deltas'.
+
+    """
+    return '{}.{}.ark'.format(os.path.splitext(scp)[0], tag)
+
+
+def is_rewritten(scp, tag):
+    """Return True if the features of `scp` are rewritten by `tag`
+
+    This is the case when `scp` indexes only the ark given by
+    rewritten_ark(), or when it is empty.
+
+    """
+    arks = set(os.path.abspath(ark) for ark, _ in parse_scp(scp).values())
+    return not arks or arks == set([os.path.abspath(rewritten_ark(scp, tag))])
+
+
+def commit_scp(scp, tmp=None):
+    """Replace `scp` by `tmp` and delete the arks it no longer indexes
+
+    The features of a job are rewritten to a new ark indexed by the
+    scp `tmp`, its rename to `scp` commits the rewrite, so that an
+    interrupted job is either fully rewritten or not at all. The arks
+    '<scp basename>.ark' and '<scp basename>.*.ark' not indexed by
+    the new `scp` are then deleted. When `tmp` is None, only delete
+    those arks (as left by an interrupted commit).
+
+    """
+    if tmp is not None:
+        os.rename(tmp, scp)
+
+    indexed = set(os.path.abspath(ark) for ark, _ in parse_scp(scp).values())
+    base = os.path.splitext(scp)[0]
+    for ark in glob.glob(base + '.ark') + glob.glob(base + '.*.ark'):
+        if os.path.abspath(ark) not in indexed:
+            utils.remove(ark, safe=True)
+
+
+def _rewrite_scp(scp, transform, tag, compress=False):
+    """Transform the features indexed by `scp`
+
+    `transform(utt, features)` returns the new features of an
+    utterance, or None to drop it. The features are written to the
+    ark rewritten_ark(`scp`, `tag`), indexed by a temporary scp
+    replacing `scp` once all the utterances are transformed (see
+    commit_scp). Nothing is done if `scp` is already rewritten by
+    `tag`, so an interrupted rewrite can be run again.
+
+    Return the number of dropped utterances.
+
+    """
+    if is_rewritten(scp, tag):
+        commit_scp(scp)
+        return 0
+
+    tmp, dropped = scp + '.tmp', 0
+    try:
+        with ScpReader(scp, cache_size=0) as feats:
+            with ArkWriter(
+                    rewritten_ark(scp, tag), tmp, compress=compress) as ark:
+                for utt, data in feats.iteritems():
+                    data = transform(utt, data)
+                    if data is None:
+                        dropped += 1
+                    else:
+                        ark.write(utt, data)
+
+        commit_scp(scp, tmp)
+        return dropped
+    finally:
+        utils.remove(tmp, safe=True)
+
+
+def _postprocess_job(scp, delta_order, utt2spk, compress=False):
+    """Compute deltas and CMVN statistics on the features in `scp`
+
+    The features are read once. When `delta_order` > 0, the deltas
+    are appended to the features, rewritten to a new ark (see
+    _rewrite_scp). When `utt2spk` is not None, the CMVN statistics
+    are accumulated on the raw features of each speaker.
+
+    If `scp` already indexes its deltas (the job being resumed), the
+    features are not rewritten again and the CMVN statistics are
+    accumulated on their raw part.
+
+    Return a dict speaker -> CMVN statistics.
+
+    """
+    stats = {}
+
+    def _transform(utt, data):
+        if utt2spk is not None:
+            spk = utt2spk[utt]
+            if spk in stats:
+                stats[spk] += cmvn_stats([data])
+            else:
+                stats[spk] = cmvn_stats([data])
+        return add_deltas(data, delta_order) if delta_order > 0 else data
+
+    if delta_order > 0 and is_rewritten(scp, 'deltas'):
+        commit_scp(scp)
+        if utt2spk is not None:
+            with ScpReader(scp, cache_size=0) as feats:
+                for utt, data in feats.iteritems():
+                    _transform(utt, data[:, :data.shape[1] // (
+                        delta_order + 1)])
+    elif delta_order > 0:
+        _rewrite_scp(scp, _transform, 'deltas', compress=compress)
+    else:
+        with ScpReader(scp, cache_size=0) as feats:
+            for utt, data in feats.iteritems():
+                _transform(utt, data)
+    return stats
+
+
+def postprocess_scps(scps, delta_order=0, utt2spk=None, compress=False,
+                     log=utils.logger.null_logger()):
+    """Compute deltas and CMVN statistics in a single pass over `scps`
+
+    Each scp file is processed by a worker process reading the raw
+    features once, accumulating the CMVN statistics per speaker and
+    rewriting the features with their deltas to a new ark replacing
+    the raw one. This replaces the Kaldi programs add-deltas and
+    compute-cmvn-stats, without any intermediate copy of the
+    features. The scp files already rewritten by a previous call are
+    not rewritten again, so an interrupted call can be repeated.
+
+    Parameters:
+    -----------
+
+    scps (list of str): the scp files of the raw features, each one
+      indexing a single ark file
+
+    delta_order (int): the order of the deltas to append to the
+      features, no delta computed if 0
+
+    utt2spk (dict): utterance -> speaker, if specified the CMVN
+      statistics of each speaker are computed
+
+    compress (bool): when True, compress the features in the arks
+
+    log (logging.Logger): optional log for messages
+
+    Return:
+    -------
+
+    A dict speaker -> CMVN statistics (empty if utt2spk is None), as
+    returned by cmvn_stats
+
+    """
+    log.debug('processing %s scp files (delta order %s%s)',
+              len(scps), delta_order,
+              ', CMVN' if utt2spk is not None else '')
+
+    stats = {}
+    for result in _run_jobs(
+            _postprocess_job,
+            [(scp, delta_order, utt2spk, compress) for scp in scps]):
+        for spk, spk_stats in result.iteritems():
+            if spk in stats:
+                stats[spk] += spk_stats
+            else:
+                stats[spk] = spk_stats
+    return stats
+
+
+def _vad_job(scp, arkfile, scpfile, options):
+    """Write the VAD decisions of the features in `scp` to `arkfile`"""
+    with ScpReader(scp, cache_size=0) as feats:
+        with ArkWriter(arkfile, scpfile) as ark:
+            for utt, data in feats.iteritems():
+                ark.write(utt, vad_energy(data, **options))
+
+
+def compute_vad(scps, output_dir, name='features', options=None,
+                log=utils.logger.null_logger()):
+    """Compute the voice activity decisions of the features in `scps`
+
+    The decisions are computed by vad_energy on the raw features
+    (mfcc or fbank with energy) and written, as vectors of 0 and 1,
+    to 'vad_<name>.<n>.{ark,scp}' in `output_dir`, one per input scp.
+
+    Parameters:
+    -----------
+
+    scps (list of str): the scp files of the raw features
+
+    output_dir (str): the directory where to write the arks
+
+    name (str): the name of the arks, default to 'features'
+
+    options (dict): optional parameters of vad_energy
+
+    log (logging.Logger): optional log for messages
+
+    Return:
+    -------
+
+    The list of written scp files
+
+    """
+    log.debug('computing VAD on %s scp files', len(scps))
+
+    outputs = [os.path.join(output_dir, 'vad_{}.{}'.format(name, n))
+               for n in range(1, len(scps) + 1)]
+    _run_jobs(_vad_job, [
+        (scp, output + '.ark', output + '.scp', options or {})
+        for scp, output in zip(scps, outputs)])
+    return [output + '.scp' for output in outputs]
+
+
+def _select_voiced_job(scp, vad_scp, compress=False):
+    """Keep only the voiced frames of the features in `scp`"""
+    with ScpReader(vad_scp, cache_size=0) as vad:
+        def _transform(utt, data):
+            voiced = np.nonzero(vad[utt])[0]
+            if vad[utt].shape[0] != data.shape[0]:
+                raise IOError(
+                    'VAD and features have different lengths for {}: '
+                    '{} != {}'.format(utt, vad[utt].shape[0], data.shape[0]))
+            return data[voiced] if voiced.shape[0] else None
+
+        return _rewrite_scp(scp, _transform, 'voiced', compress=compress)
+
+
+def select_voiced_frames(scps, vad_scp, compress=False,
+                         log=utils.logger.null_logger()):
+    """Keep only the voiced frames of the features in `scps`
+
+    This is the equivalent of the Kaldi program select-voiced-frames,
+    the features are rewritten to new arks replacing the input ones
+    (see _rewrite_scp), the scp files already rewritten are left
+    untouched. The utterances without any voiced frame are removed
+    from the scp files. The original index of each remaining frame is
+    given by the nonzero entries of its VAD.
+
+    Return the number of removed utterances.
+
+    """
+    log.debug('selecting voiced frames in %s scp files', len(scps))
+    return sum(_run_jobs(
+        _select_voiced_job, [(scp, vad_scp, compress) for scp in scps]))
+
+
+def _compute_job(extractors, utterances, outputs, seed, compress=False):
+    """Compute the features of `utterances` for several extractors
+
+    utterances is a list of (utt_id, wav, tbegin, tend) and outputs a
+    list of (arkfile, scpfile), one per extractor. The audio of each
+    utterance is read once for all the extractors, consecutive
+    utterances from the same wav reuse the loaded samples. As in
+    Kaldi, the utterances too short to have a single frame are not
+    written.
+
+    Return the number of such utterances.
+
+    """
+    writers = []
+    try:
+        for extractor, (arkfile, scpfile) in zip(extractors, outputs):
+            extractor.random.seed(seed)
+            writers.append(ArkWriter(arkfile, scpfile, compress=compress))
+
+        empty = 0
+        loaded = (None, None, None)
+        for utt, wav, tbegin, tend in utterances:
+            if loaded[0] != wav:
+                loaded = (wav,) + read_wav(wav)
+            _, samples, rate = loaded
+            signal = _segment(samples, rate, tbegin, tend)
+
+            features = [e.compute(signal, rate) for e in extractors]
+            if any(f.shape[0] == 0 for f in features):
+                empty += 1
+                continue
+
+            for writer, feats in zip(writers, features):
+                writer.write(utt, feats)
+        return empty
+    finally:
+        for writer in writers:
+            writer.close()
+
+
+def compute_corpus(corpus, extractors, output_dir, utt2job, name='features',
+                   compress=False, log=utils.logger.null_logger()):
+    """Compute the features of a `corpus` with a pool of processes
+
+    The utterances are split in jobs as given by `utt2job`, with
+    job indices in [1, njobs]. Each job is computed by a worker
+    reading the audio of each utterance once and computing the
+    features for all the `extractors`, at most one worker per core of
+    the local machine. The arks of each extractor are
+    written as 'raw_<type>_<name>.<job>.{ark,scp}' in `output_dir`, as
+    the Kaldi scripts steps/make_*.sh do.
+
+    Parameters:
+    -----------
+
+    corpus (Corpus): the corpus to compute the features from
+
+    extractors (list of Extractor): the extractors to compute, with
+      distinct types
+
+    output_dir (str): the directory where to write the arks
+
+    utt2job (dict): utterance -> job index, the utterances not in
+      utt2job are ignored
+
+    name (str): the name of the arks, default to 'features'
+
+    compress (bool): when True, compress the features in the arks
+
+    log (logging.Logger): optional log for messages
+
+    Return:
+    -------
+
+    A dict type -> list of written scp files sorted by job
+
+    """
+    njobs = max(utt2job.values())
+    jobs = [[] for _ in range(njobs)]
+    for utt in sorted(utt2job.keys()):
+        wav, tbegin, tend = corpus.segments[utt]
+        jobs[utt2job[utt] - 1].append(
+            (utt, os.path.join(corpus.wav_folder, wav), tbegin, tend))
+
+    types = [extractor.type for extractor in extractors]
+    if len(set(types)) != len(types):
+        raise RuntimeError('extractors must be of distinct types')
+    log.debug('computing numpy %s features in %s jobs',
+              ', '.join(types), njobs)
+
+    def _output(type, job, ext):
+        return os.path.join(
+            output_dir, 'raw_{}_{}.{}.{}'.format(type, name, job, ext))
+
+    outputs = {n: [(_output(t, n, 'ark'), _output(t, n, 'scp'))
+                   for t in types] for n in range(1, njobs + 1)}
+
+    # njobs can be the capacity of a cluster backend, but the
+    # workers run on the local machine
+    pool = multiprocessing.Pool(min(njobs, utils.default_njobs(local=True)))
+    try:
+        results = [pool.apply_async(
+            _compute_job, (extractors, utts, outputs[n], n, compress))
+                   for n, utts in enumerate(jobs, 1)]
+        empty = sum(result.get() for result in results)
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if empty:
+        log.warning('%s utterances too short to be processed', empty)
+    return {t: [outputs[n][i][1] for n in range(1, njobs + 1)]
+            for i, t in enumerate(types)}
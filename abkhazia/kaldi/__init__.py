@@ -16,4 +16,6 @@
 from .path import kaldi_path
 from .abkhazia2kaldi import Abkhazia2Kaldi
 from .options import *
+from .binary_ark import ArkReader, ArkWriter
+from .scp import ScpReader
 from .ark import *
@@ -14,6 +14,7 @@
 # along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
 '''Provides the Abkhazia2Kaldi class'''
 
+import heapq
 import os
 import pkg_resources
 import shutil
@@ -22,6 +23,66 @@ from abkhazia.utils import config, logger, open_utf8
 from abkhazia.corpus.corpus_saver import CorpusSaver
 
 
+def balanced_bins(weights, nbins):
+    """Pack the keys of `weights` into `nbins` bins of similar total weight
+
+    This is the greedy LPT (longest processing time first) heuristic:
+    keys are sorted by decreasing weight and each one is put in the
+    bin with the lowest total weight so far. Ties are broken on the
+    keys themselves so that the packing is deterministic.
+
+    Parameters:
+    -----------
+
+    weights (dict): key -> weight, weights are positive numbers
+
+    nbins (int): the number of bins, must be in [1, len(weights)]
+
+    Return:
+    -------
+
+    A list of `nbins` non-empty and sorted lists of keys
+
+    Raise:
+    ------
+
+    RuntimeError if `nbins` is not in [1, len(weights)]
+
+    """
+    if not 1 <= nbins <= len(weights):
+        raise RuntimeError(
+            'cannot pack {} items in {} bins'.format(len(weights), nbins))
+
+    # heap of (total weight, bin index), the lightest bin on top
+    heap = [(0.0, n) for n in range(nbins)]
+    bins = [[] for _ in range(nbins)]
+    for key in sorted(weights, key=lambda k: (-weights[k], k)):
+        total, n = heapq.heappop(heap)
+        bins[n].append(key)
+        heapq.heappush(heap, (total + weights[key], n))
+
+    return [sorted(b) for b in bins]
+
+
+def spk2job(corpus, njobs):
+    """Return a dict speaker -> job index in [1, njobs] for a `corpus`
+
+    This is the split used by Abkhazia2Kaldi.setup_split_data, on the
+    utterances kept in the recipes (see Abkhazia2Kaldi.spk2job)
+
+    """
+    corpus = corpus.subcorpus(
+        Abkhazia2Kaldi._desired_utterances(corpus), validate=False)
+
+    spk2dur = {}
+    for utt, dur in corpus.utt2duration().iteritems():
+        spk = corpus.utt2spk[utt]
+        spk2dur[spk] = spk2dur.get(spk, 0.0) + dur
+
+    return {spk: n for n, spks in enumerate(
+        balanced_bins(spk2dur, njobs), 1) for spk in spks}
+
+
 class Abkhazia2Kaldi(object):
     '''Instanciate a kaldi recipe from an abkhazia corpus
 
@@ -175,6 +236,103 @@ class Abkhazia2Kaldi(object):
                 wav_path = os.path.join(self.corpus.wav_folder, wav)
                 out.write(u'{} {}\n'.format(wav, wav_path))
 
+    def spk2job(self, njobs):
+        """Return a dict speaker -> job index in [1, njobs]
+
+        Speakers are packed in `njobs` bins balanced on their total
+        speech duration (see the balanced_bins function).
+
+        """
+        return spk2job(self.corpus, njobs)
+
+    # files of a Kaldi data directory indexed by utterance, by speaker
+    # or by recording, as known by utils/split_data.sh
+    _utt_files = ('utt2spk', 'text', 'segments', 'feats.scp', 'utt2dur',
+                  'utt2num_frames', 'utt2lang', 'vad.scp')
+    _spk_files = ('cmvn.scp', 'spk2gender', 'spk2warp')
+    _reco_files = ('wav.scp', 'reco2file_and_channel')
+
+    def setup_split_data(self, njobs):
+        """Create the split`njobs` subdirectory of the data directory
+
+        This is a replacement of the Kaldi script utils/split_data.sh,
+        that splits the data by speakers in contiguous blocks of
+        similar number of speakers. Here speakers are distributed in
+        `njobs` blocks of similar speech duration, so that each Kaldi
+        JOB have a similar amount of work.
+
+        The split directory is timestamped more recent than the data
+        directory files, so that Kaldi scripts use it as is and do not
+        split the data again.
+
+        Return the path to the created split directory
+
+        """
+        data_dir = self._output_path()
+        split_dir = os.path.join(data_dir, 'split{}'.format(njobs))
+        if os.path.isdir(split_dir):
+            shutil.rmtree(split_dir)
+
+        self.log.debug('splitting %s in %s duration balanced jobs',
+                       os.path.relpath(data_dir, self.recipe_dir), njobs)
+
+        # job index of each speaker, utterance and recording
+        spk2job = self.spk2job(njobs)
+        utt2job = {utt: spk2job[spk]
+                   for utt, spk in self.corpus.utt2spk.iteritems()}
+        reco2jobs = {}
+        for utt, (reco, _, _) in self.corpus.segments.iteritems():
+            reco2jobs.setdefault(reco, set()).add(utt2job[utt])
+
+        def _split_file(name, key2jobs):
+            lines = [[] for _ in range(njobs)]
+            for line in open_utf8(os.path.join(data_dir, name), 'r'):
+                try:
+                    jobs = key2jobs[line.split(None, 1)[0]]
+                except (IndexError, KeyError):
+                    continue
+                for job in ([jobs] if isinstance(jobs, int) else jobs):
+                    lines[job - 1].append(line)
+
+            for job in range(1, njobs + 1):
+                with open_utf8(os.path.join(
+                        split_dir, str(job), name), 'w') as out:
+                    out.write(u''.join(sorted(lines[job - 1])))
+
+        for job in range(1, njobs + 1):
+            os.makedirs(os.path.join(split_dir, str(job)))
+
+        existing = set(os.listdir(data_dir))
+        for files, key2jobs in (
+                (self._utt_files, utt2job),
+                (self._spk_files, spk2job),
+                (self._reco_files, reco2jobs)):
+            for name in (f for f in files if f in existing):
+                _split_file(name, key2jobs)
+
+        # spk2utt is built from the split utt2spk
+        for job in range(1, njobs + 1):
+            job_dir = os.path.join(split_dir, str(job))
+            spk2utt = {}
+            for line in open_utf8(os.path.join(job_dir, 'utt2spk'), 'r'):
+                utt, spk = line.split()
+                spk2utt.setdefault(spk, []).append(utt)
+            with open_utf8(os.path.join(job_dir, 'spk2utt'), 'w') as out:
+                for spk, utts in sorted(spk2utt.iteritems()):
+                    out.write(u'{} {}\n'.format(spk, ' '.join(sorted(utts))))
+
+        # make the split more recent than the data files (Kaldi
+        # scripts re-split the data if they are not)
+        stamp = 1 + max(os.path.getmtime(os.path.join(data_dir, f))
+                        for f in existing
+                        if os.path.isfile(os.path.join(data_dir, f)))
+        for path, _, files in os.walk(split_dir):
+            for name in files:
+                os.utime(os.path.join(path, name), (stamp, stamp))
+            os.utime(path, (stamp, stamp))
+
+        return split_dir
+
     def setup_wav_folder(self):
         """using a symbolic link to avoid copying voluminous data"""
         target = os.path.join(self.recipe_dir, 'wavs')
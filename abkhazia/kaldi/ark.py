@@ -18,16 +18,17 @@ Read/write ark files into numpy arrays or h5features file.
 
 Provides the ark_to_dict, ark_to_h5f and scp_to_h5f functions to
 convert Kaldi ark files to Python dictionaries and h5features files
-respectively.
+respectively, and the h5f_to_ark function for the reverse conversion.
 
 Provides the dict_to_ark function to write ark files from numpy
-arrays.
+arrays. Binary arks are read and written without Kaldi, see the
+abkhazia.kaldi.binary_ark module.
 
 """
 
+import collections
+import multiprocessing
 import os
-import re
-import struct
 import tempfile
 
 import numpy as np
@@ -36,6 +37,8 @@ import h5py
 
 import abkhazia.utils as utils
 from abkhazia.kaldi import kaldi_path
+from abkhazia.kaldi.binary_ark import ArkReader, ArkWriter
+from abkhazia.kaldi.scp import parse_scp
 
 
 def ark_to_dict(arkfile):
@@ -45,7 +48,8 @@ def ark_to_dict(arkfile):
     -----------
 
     arkfile (str): path to a Kaldi ark file, either in binary or text
-        format.
+        format. Binary arks of float matrices, either plain or
+        compressed, are read without Kaldi.
 
     Return:
     -------
@@ -59,12 +63,15 @@ def ark_to_dict(arkfile):
 
     try:
         return _ark_to_dict_binary(arkfile)
-    except AssertionError:
+    except IOError:
+        # type not supported by ArkReader, convert it with Kaldi
         return _ark_to_dict_binary_bytext(arkfile)
 
 
 def ark_to_h5f(ark_files, h5_file, h5_group='features',
-               sample_frequency=100, tstart=0.0125,
+               sample_frequency=100, tstart=0.0125, segments=None,
+               buffer_size=100, njobs=1, utts=None, vad=None,
+               dtype=None, compression=None,
                log=utils.logger.null_logger()):
     """Convert a sequence of kaldi ark files into a single h5features file
 
@@ -72,6 +79,11 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
     extra parameters for specifiying the time labels in the h5features
     file.
 
+    The conversion is streamed: the utterances are read from the arks
+    and appended to the h5features file by chunks of `buffer_size`
+    MB. With `njobs` > 1 the binary arks are read by parallel workers,
+    the h5features file being written by the calling process only.
+
     Parameters:
     -----------
 
@@ -87,6 +99,38 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    segments (dict): optional segments of the utterances, as
+        utt_id -> (wav_id, tbegin, tend) in abkhazia corpus. If
+        specified, the timestamps of an utterance start at `tbegin`
+        + `tstart`, else at `tstart`.
+
+    buffer_size (float): the size of the chunks appended to the
+        h5features file in MB, default to 100
+
+    njobs (int): number of parallel workers reading the arks,
+        default to 1
+
+    utts (set or dict): optional utterances to convert, the other
+        ones are ignored. When None, all the utterances are
+        converted. When a dict ark -> {utt: offset}, as indexed by a
+        scp file, an utterance is converted only from the ark (and
+        at the offset, for binary arks) the scp points to.
+
+    vad (dict): optional utt_id -> voice activity decision (a vector
+        of 0 and 1 for each frame, as in vad.scp). If specified, only
+        the voiced frames are converted and their timestamps are the
+        ones of the original frames. The features may be already
+        restricted to the voiced frames.
+
+    dtype (str or numpy.dtype): optional type of the features in the
+        h5features file, such as 'float16' to halve the size of
+        float32 features. By default the type of the arks (float32 or
+        float64) is preserved.
+
+    compression (str or int): optional compression of the features
+        in the h5features file, 'lzf' (fast), 'gzip' or a gzip level
+        in [0, 9]. Default to None (no compression).
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -105,17 +149,46 @@ def ark_to_h5f(ark_files, h5_file, h5_group='features',
               's' if len(ark_files) else '',
               h5_file, h5_group)
 
-    with h5f.Writer(h5_file) as fout:
-        for ark in ark_files:
-            log.debug('converting {}...'.format(os.path.basename(ark)))
-            fout.write(_ark_to_data(
-                ark, sample_frequency=sample_frequency, tstart=tstart),
-                       h5_group, append=True)
+    def _times(utt, frames):
+        offset = tstart
+        if segments and utt in segments and segments[utt][1] is not None:
+            offset += segments[utt][1]
+        return frames / float(sample_frequency) + offset
+
+    def _voiced(utt, feat):
+        """Return the voiced features and their frames indices"""
+        if vad is None:
+            return feat, np.arange(feat.shape[0])
+
+        decision = vad[utt]
+        frames = np.nonzero(decision)[0]
+        if feat.shape[0] == decision.shape[0]:
+            feat = feat[frames]
+        elif feat.shape[0] != frames.shape[0]:
+            raise IOError(
+                'features and VAD mismatch for {}'.format(utt))
+        return feat, frames
+
+    with h5f.Writer(h5_file, compression=compression) as fout:
+        for chunk in _iter_chunks(
+                ark_files, int(buffer_size * 2**20), njobs, log, utts):
+            items, times, feats = [], [], []
+            for utt, feat in chunk:
+                feat, frames = _voiced(utt, feat)
+                if frames.shape[0]:
+                    items.append(utt)
+                    times.append(_times(utt, frames))
+                    feats.append(feat if dtype is None else feat.astype(dtype))
+
+            if items:
+                fout.write(
+                    h5f.Data(items, times, feats), h5_group, append=True)
 
 
 def scp_to_h5f(scp_file, h5_file, h5_group='features',
-               sample_frequency=100, tstart=0.0125,
-               log=utils.logger.null_logger()):
+               sample_frequency=100, tstart=0.0125, segments=None,
+               buffer_size=100, njobs=1, vad=None, dtype=None,
+               compression=None, log=utils.logger.null_logger()):
     """Convert ark files referenced in `scp_file` into a h5features file
 
     Because Kaldi ark does not store any time information, we need
@@ -137,6 +210,22 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
 
     tstart (float): timestamp of the first feature vector
 
+    segments (dict): optional utterances segments, see ark_to_h5f
+
+    vad (dict): optional voice activity decisions, see ark_to_h5f
+
+    dtype (str or numpy.dtype): optional type of the features in the
+        h5features file, see ark_to_h5f
+
+    compression (str or int): optional compression of the features
+        in the h5features file, see ark_to_h5f
+
+    buffer_size (float): the size of the chunks appended to the
+        h5features file in MB, default to 100
+
+    njobs (int): number of parallel workers reading the arks,
+        default to 1
+
     log (logging.Logger): optional log for messages
 
     Raise:
@@ -147,18 +236,18 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     IOError if the scp file is badly formatted
 
     """
-    # extract the ark files referenced in the scp
-    ark_files = set()
-    for n, line in enumerate(open(scp_file, 'r').readlines(), 1):
-        matched = re.match('^.* (.*):[0-9]*$', line)
-        if not matched:
-            raise IOError('Bad scp file line {}: {}'.format(n, scp_file))
-        ark_files.add(matched.group(1))
+    # extract the ark files and offsets referenced in the scp, the
+    # arks may contain utterances not referenced in it, or stale
+    # copies of utterances indexed in another ark (as the features
+    # replaced by an incremental computation)
+    utts = {}
+    for utt, (ark, offset) in parse_scp(scp_file).iteritems():
+        utts.setdefault(ark, {})[utt] = offset
 
     # sort them in natural order to have f.10.ark > f.9.ark. This is
     # important to concatenate features in order because some Kaldi
     # scripts assumes ordered features (with the rspecifier ark,s,cs).
-    ark_files = list(ark_files)
+    ark_files = list(utts.keys())
     ark_files.sort(key=utils.natural_sort_keys)
 
     log.info('writing {} ark files to {} in group {}'.format(
@@ -167,9 +256,130 @@ def scp_to_h5f(scp_file, h5_file, h5_group='features',
     # Then deleguate to ark_to_h5f
     ark_to_h5f(ark_files, h5_file, h5_group,
                sample_frequency=sample_frequency, tstart=tstart,
+               segments=segments, buffer_size=buffer_size, njobs=njobs,
+               utts=utts, vad=vad, dtype=dtype, compression=compression,
                log=log)
 
 
+def h5f_to_ark(h5_file, output_dir, h5_group=None, utt2job=None, njobs=1,
+               name='features', compress=False, buffer_size=100,
+               log=utils.logger.null_logger()):
+    """Convert a h5features file into sharded Kaldi binary arks
+
+    The features are read from the h5features file by chunks of
+    `buffer_size` MB and each utterance is written to the ark of its
+    job. The output directory has the layout of an exported Features
+    recipe: the arks 'raw_<name>.<job>.ark' indexed by a 'feats.scp'
+    sorted by utterances.
+
+    Parameters:
+    -----------
+
+    h5_file (str): the h5features file to read from
+
+    output_dir (str): the directory where to write the arks and
+        feats.scp, created if non existing
+
+    h5_group (str): the group to read in `h5_file`, may be omitted if
+        the file has a single group
+
+    utt2job (dict): utterance -> job index in [1, njobs], as
+        computed from the speakers split of the recipes. Utterances
+        missing in utt2job are ignored. If not specified, the
+        utterances are split in `njobs` contiguous jobs of similar
+        number of frames.
+
+    njobs (int): number of arks to write, default to 1
+
+    name (str): name of the arks, default to 'features'
+
+    compress (bool): when True, compress the matrices in the arks
+
+    buffer_size (float): the size of the chunks read from the
+        h5features file in MB, default to 100
+
+    log (logging.Logger): optional log for messages
+
+    Return:
+    -------
+
+    The path to the written scp file
+
+    Raise:
+    ------
+
+    IOError if the h5features file cannot be read or if the features
+    are sparse
+
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    arks = [os.path.join(output_dir, 'raw_{}.{}.ark'.format(name, job))
+            for job in range(1, njobs + 1)]
+    writers = []
+    scp_lines = []
+    ignored = 0
+
+    with h5f.Reader(h5_file, h5_group) as reader:
+        version = tuple(int(v) for v in reader.version.split('.'))
+        if reader.dformat == 'sparse' or version < (1, 0):
+            raise IOError(
+                'cannot convert sparse or version {} h5features to ark'
+                .format(reader.version))
+
+        items = reader.items.data
+        # the last frame of each item
+        ends = h5f.index.read_index(reader.group, reader.version)
+        features = reader.group['features']
+
+        if utt2job is None:
+            # contiguous jobs of similar number of frames, an item is
+            # in the job of its middle frame
+            starts = np.concatenate(([0], ends[:-1] + 1))
+            jobs = 1 + ((starts + ends) * njobs) // (2 * (ends[-1] + 1))
+            utt2job = dict(zip(items, jobs))
+
+        log.debug('converting %s utterances from %s to %s arks',
+                  len(items), os.path.basename(h5_file), njobs)
+
+        rows = max(1, int(buffer_size * 2**20 / max(
+            1, features.shape[1] * features.dtype.itemsize)))
+
+        try:
+            for ark in arks:
+                writers.append(ArkWriter(ark, compress=compress))
+
+            first = 0
+            while first < len(items):
+                lower = 0 if first == 0 else ends[first - 1] + 1
+                last = max(first + 1, np.searchsorted(
+                    ends, lower + rows - 1, side='right'))
+
+                data = reader.read(items[first], items[last - 1])
+                for item, feats in zip(data.items(), data.features()):
+                    if item not in utt2job:
+                        ignored += 1
+                        continue
+
+                    writer = writers[utt2job[item] - 1]
+                    offset = writer.write(item, feats)
+                    scp_lines.append('{} {}:{}\n'.format(
+                        item, writer.arkfile, offset))
+                first = last
+        finally:
+            for writer in writers:
+                writer.close()
+
+    if ignored:
+        log.warning('ignored %s utterances not in the split', ignored)
+
+    scp = os.path.join(output_dir, 'feats.scp')
+    with open(scp, 'w') as fscp:
+        fscp.write(''.join(sorted(scp_lines)))
+    return scp
+
+
 def dict_to_ark(arkfile, data, format='text'):
     """Write a data dictionary to a Kaldi ark file
 
@@ -194,14 +404,9 @@ def dict_to_ark(arkfile, data, format='text'):
     if format is 'text':
         _dict_to_txt_ark(arkfile, data)
     elif format is 'binary':
-        with tempfile.NamedTemporaryFile(
-                dir=utils.config.get('abkhazia', 'tmp-directory')) as tmp:
-            _dict_to_txt_ark(tmp.name, data)
-
-            utils.jobs.run(
-                'copy-feats ark,t:{0} ark:{1}'.format(tmp.name, arkfile),
-                env=kaldi_path(),
-                stdout=open(os.devnull, 'w').write)
+        with ArkWriter(arkfile) as ark:
+            for utt in sorted(data.iterkeys()):
+                ark.write(utt, data[utt])
     else:
         raise RuntimeError(
             'ark format must be "text" or "binary", it is "{}"'
@@ -213,14 +418,103 @@ def dict_to_ark(arkfile, data, format='text'):
 #
 
 
-def _ark_to_data(arkfile, sample_frequency=100, tstart=0.0125):
-    """ark to h5features.Data"""
-    d = ark_to_dict(arkfile)
+def _buffered(items, buffer_size):
+    """Yield lists of (utt, array) from `items` of about `buffer_size` bytes"""
+    chunk, size = [], 0
+    for utt, data in items:
+        chunk.append((utt, data))
+        size += data.nbytes
+        if size >= buffer_size:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def _split_binary_ark(arkfile, buffer_size, utts=None):
+    """Return the keys of a binary ark in lists of about `buffer_size` bytes
+
+    Only the keys in `utts` are returned, or all of them if None. If
+    `utts` is a dict key -> offset, only the keys at that offset are
+    returned.
+
+    Raise IOError if the ark is not readable by ArkReader
+
+    """
+    with ArkReader(arkfile) as ark:
+        offsets = ark.index.values() + [os.path.getsize(arkfile)]
+        keys = ark.keys()
 
-    times = [np.arange(val.shape[0], dtype=float) / sample_frequency + tstart
-             for val in d.values()]
+    chunks, start = [], 0
+    for n in range(1, len(keys) + 1):
+        if n == len(keys) or offsets[n] - offsets[start] >= buffer_size:
+            chunk = [keys[i] for i in range(start, n) if utts is None or (
+                keys[i] in utts and (not isinstance(utts, dict)
+                                     or utts[keys[i]] == offsets[i]))]
+            if chunk:
+                chunks.append(chunk)
+            start = n
+    return chunks
 
-    return h5f.Data(d.keys(), times, d.values())
+
+def _load_binary_ark(arkfile, keys):
+    """Return a list of (key, array) for the `keys` of a binary ark"""
+    with ArkReader(arkfile) as ark:
+        return [(key, ark[key]) for key in keys]
+
+
+def _iter_chunks(ark_files, buffer_size, njobs, log, utts=None):
+    """Yield lists of (utt, array) from the arks, preserving their order
+
+    The binary arks are split in chunks of about `buffer_size` bytes
+    loaded by a pool of `njobs` processes. At most `njobs` + 1 chunks
+    are loaded at once, so the memory usage is bounded whatever the
+    size of the arks. If `utts` is specified, only those utterances
+    are yielded (see ark_to_h5f).
+
+    """
+    pool = multiprocessing.Pool(njobs) if njobs > 1 else None
+    pending = collections.deque()
+    try:
+        for ark in ark_files:
+            log.debug('converting {}...'.format(os.path.basename(ark)))
+            selected = utts.get(ark, {}) if isinstance(utts, dict) else utts
+
+            try:
+                chunks = (_split_binary_ark(ark, buffer_size, selected)
+                          if _is_binary(ark) else None)
+            except IOError:
+                chunks = None
+
+            if chunks is None:
+                # text ark or binary not supported by ArkReader,
+                # loaded sequentially after the pending chunks
+                while pending:
+                    yield pending.popleft().get()
+
+                items = (_yield_utt(ark) if not _is_binary(ark)
+                         else sorted(ark_to_dict(ark).iteritems()))
+                if selected is not None:
+                    items = ((u, d) for u, d in items if u in selected)
+                for chunk in _buffered(items, buffer_size):
+                    yield chunk
+                continue
+
+            for keys in chunks:
+                if pool is None:
+                    yield _load_binary_ark(ark, keys)
+                    continue
+
+                pending.append(pool.apply_async(_load_binary_ark, (ark, keys)))
+                if len(pending) > njobs:
+                    yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
 
 
 def _is_binary(arkfile):
@@ -232,40 +526,9 @@ def _is_binary(arkfile):
 
 
 def _ark_to_dict_binary(arkfile):
-    res = {}
-    with open(arkfile) as fin:
-        while True:
-            # TODO break if empty buffer here
-            fname = ''
-            c = fin.read(1)
-            if c == '':  # EOF (EOFError not raised by read(empty))
-                break
-            while c != ' ':
-                fname += c
-                c = fin.read(1)
-
-            # end of fname
-            fin.read(1)
-
-            # data type
-            assert fin.read(4) == 'BFM ', 'type not supported'
-
-            # nrows type
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            nrows = struct.unpack('i', fin.read(4))[0]
-
-            # ncols type:
-            assert struct.unpack('b', fin.read(1))[0] == 4, \
-                'type not supported'
-            ncols = struct.unpack('i', fin.read(4))[0]
-
-            # data
-            size = nrows * ncols * 4
-            data = np.frombuffer(
-                fin.read(size), dtype=np.float32).reshape((nrows, ncols))
-            res[fname] = data
-    return res
+    """Load a binary ark to utterances indexed numpy arrays"""
+    with ArkReader(arkfile) as ark:
+        return dict(ark.iteritems())
 
 
 def _ark_to_dict_binary_bytext(arkfile):
@@ -290,36 +553,53 @@ def _ark_to_dict_text(arkfile):
     return {utt: data for utt, data in _yield_utt(arkfile)}
 
 
-def _str2np(data):
-    """Convert a list of str to a np.array of float"""
-    npdata = np.zeros((len(data), len(data[0].split())))
-    for i, line in enumerate(data):
-        try:
-            npdata[i, :] = map(float, line.split())
-        except ValueError:
-            raise ValueError(
-                'error converting str to float in:', line.strip())
-    return npdata
-
-
-def _yield_utt(arkfile):
-    """Yield (utt_id, data) tuples read from a text `arkfile`"""
-    utt_id = None
-    data = []
-
-    for line in open(arkfile, 'r'):
-        # a new utterance is starting, yield the previous utt if any
-        if not line.startswith('  '):
-            if utt_id:
-                yield utt_id, _str2np(data)
-                utt_id, data = None, []
-            utt_id = line[:-2].strip()
-        else:  # line of floats
-            data.append(line.replace(']', '').strip())
-
-    # yield the final utt
-    if utt_id:
-        yield utt_id, _str2np(data)
+def _text_to_np(utt_id, text):
+    """Convert the text of a Kaldi matrix or vector to a np.array
+
+    `text` is the content between the brackets, a matrix has each
+    row on its own line whereas a vector is on a single line.
+
+    """
+    data = np.fromstring(text, dtype=np.float64, sep=' ')
+
+    # np.fromstring stops silently on invalid data, so we check the
+    # size of the result against the number of values in first row
+    nrows = text.count('\n')
+    first_row = text.lstrip(' ').lstrip('\n').split('\n', 1)[0]
+    ncols = len(first_row.split())
+    if data.size != max(nrows, 1) * ncols:
+        raise ValueError(
+            'error converting str to float in utterance {}'.format(utt_id))
+
+    return data.reshape((nrows, ncols)) if nrows else data
+
+
+def _yield_utt(arkfile, chunk_size=2**24):
+    """Yield (utt_id, data) tuples read from a text `arkfile`
+
+    The file is read by chunks of `chunk_size` bytes, each utterance
+    being converted at once from text to numpy.
+
+    """
+    pending = ''
+    with open(arkfile, 'r') as fin:
+        while True:
+            chunk = fin.read(chunk_size)
+            pending += chunk
+
+            # the complete entries end at the last closing bracket
+            end = pending.rfind(']')
+            if end != -1:
+                for entry in pending[:end].split(']'):
+                    utt_id, _, text = entry.partition('[')
+                    yield utt_id.strip(), _text_to_np(utt_id.strip(), text)
+                pending = pending[end + 1:]
+
+            if not chunk:
+                break
+
+    if pending.strip():
+        raise IOError('unterminated entry in ark file {}'.format(arkfile))
 
 
 def _dict_to_txt_ark(arkfile, data, sort=True):
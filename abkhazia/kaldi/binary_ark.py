@@ -0,0 +1,481 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Read and write Kaldi binary ark files without Kaldi
+
+A binary ark is a sequence of entries '<key> \\0B<token> <data>' where
+the token gives the type of the data. The following types are
+supported and decoded as numpy arrays:
+
+* FM and DM: float and double matrices
+
+* FV and DV: float and double vectors
+
+* CM, CM2 and CM3: compressed float matrices, as written by Kaldi
+  programs with the --compress=true option (CM is the default
+  compression of the Kaldi features)
+
+The ArkReader class maps an ark file in memory and builds an index of
+its entries in a single pass, so that any entry can be loaded by key
+without reading the whole file.
+
+The ArkWriter class writes numpy arrays to a binary ark, along with
+its scp index, and optionally compresses the matrices as Kaldi does.
+
+"""
+
+import collections
+import mmap
+import os
+import struct
+
+import numpy as np
+
+
+_BINARY = '\0B'
+"""The marker of a binary object in a Kaldi ark"""
+
+_FLOATS = {'FM ': '<f4', 'DM ': '<f8', 'FV ': '<f4', 'DV ': '<f8'}
+"""Uncompressed types and their numpy dtypes"""
+
+_COMPRESSED = ('CM ', 'CM2 ', 'CM3 ')
+"""Compressed matrix types"""
+
+
+def _read_token(buf, offset):
+    """Return the token (with its final space) starting at `offset`"""
+    end = buf.find(' ', offset, offset + 8)
+    if end == -1:
+        raise IOError('invalid Kaldi token at offset {}'.format(offset))
+    return buf[offset:end + 1]
+
+
+def _read_int32(buf, offset):
+    """Read a Kaldi binary int32 (size byte + value) at `offset`"""
+    if buf[offset] != '\x04':
+        raise IOError('invalid int32 size at offset {}'.format(offset))
+    return struct.unpack('<i', buf[offset + 1:offset + 5])[0]
+
+
+def _object_size(buf, offset):
+    """Return the type and the size in bytes of the object at `offset`
+
+    `offset` points to the binary marker '\\0B'. Raise IOError if the
+    object is not binary or its type is not supported.
+
+    """
+    if buf[offset:offset + 2] != _BINARY:
+        raise IOError(
+            'not a binary Kaldi object at offset {}'.format(offset))
+
+    token = _read_token(buf, offset + 2)
+    header = offset + 2 + len(token)
+
+    if token in ('FM ', 'DM '):
+        rows = _read_int32(buf, header)
+        cols = _read_int32(buf, header + 5)
+        size = 10 + rows * cols * np.dtype(_FLOATS[token]).itemsize
+    elif token in ('FV ', 'DV '):
+        dim = _read_int32(buf, header)
+        size = 5 + dim * np.dtype(_FLOATS[token]).itemsize
+    elif token in _COMPRESSED:
+        rows, cols = struct.unpack('<ii', buf[header + 8:header + 16])
+        size = 16 + {'CM ': cols * 8 + rows * cols,
+                     'CM2 ': 2 * rows * cols,
+                     'CM3 ': rows * cols}[token]
+    else:
+        raise IOError('Kaldi type not supported: {}'.format(token.strip()))
+
+    return token, header - offset + size
+
+
+def _decode_compressed(token, buf, offset):
+    """Decode a compressed matrix whose header starts at `offset`"""
+    min_value, value_range, rows, cols = struct.unpack(
+        '<ffii', buf[offset:offset + 16])
+    offset += 16
+
+    if rows == 0 or cols == 0:
+        return np.zeros((rows, cols), dtype=np.float32)
+
+    if token == 'CM2 ':
+        data = np.frombuffer(
+            buf[offset:offset + 2 * rows * cols], dtype='<u2')
+        increment = value_range / 65535.0
+    elif token == 'CM3 ':
+        data = np.frombuffer(buf[offset:offset + rows * cols], dtype=np.uint8)
+        increment = value_range / 255.0
+    else:
+        return _decode_cm(buf, offset, min_value, value_range, rows, cols)
+
+    return (min_value + increment * data.astype(np.float32)).astype(
+        np.float32).reshape((rows, cols))
+
+
+def _decode_cm(buf, offset, min_value, value_range, rows, cols):
+    """Decode a CM matrix, stored column-wise with 3 pieces per column
+
+    Each column has 4 percentiles (0, 25, 75 and 100) stored as
+    uint16, each value is then a uint8 linearly interpolated between
+    two percentiles.
+
+    """
+    headers = np.frombuffer(
+        buf[offset:offset + 8 * cols], dtype='<u2').reshape((cols, 4))
+    percentiles = (np.float32(min_value) + np.float32(value_range) *
+                   np.float32(1.0 / 65535.0) * headers.astype(np.float32))
+    p0, p25, p75, p100 = (percentiles[:, i:i + 1] for i in range(4))
+
+    offset += 8 * cols
+    data = np.frombuffer(
+        buf[offset:offset + rows * cols],
+        dtype=np.uint8).reshape((cols, rows)).astype(np.float32)
+
+    decoded = np.where(
+        data <= 64,
+        p0 + (p25 - p0) * data * np.float32(1 / 64.0),
+        np.where(
+            data <= 192,
+            p25 + (p75 - p25) * (data - 64) * np.float32(1 / 128.0),
+            p75 + (p100 - p75) * (data - 192) * np.float32(1 / 63.0)))
+
+    return np.ascontiguousarray(decoded.T, dtype=np.float32)
+
+
+def read_shape(buf, offset):
+    """Return the shape of the binary Kaldi object at `offset` in `buf`
+
+    Only the header of the object is read, the data is not decoded.
+    Return (rows, cols) for matrices and (dim,) for vectors. Raise
+    IOError if the object type is not supported.
+
+    """
+    token, _ = _object_size(buf, offset)
+    header = offset + 2 + len(token)
+
+    if token in ('FM ', 'DM '):
+        return _read_int32(buf, header), _read_int32(buf, header + 5)
+
+    if token in ('FV ', 'DV '):
+        return (_read_int32(buf, header),)
+
+    return struct.unpack('<ii', buf[header + 8:header + 16])
+
+
+def read_object(buf, offset):
+    """Decode the binary Kaldi object at `offset` in `buf`
+
+    `buf` is a str or a mmap of a binary ark and `offset` points to
+    the binary marker '\\0B' following the key (as the offsets
+    referenced in scp files).
+
+    Return a numpy array: 2D for matrices, 1D for vectors. Raise
+    IOError if the object type is not supported.
+
+    """
+    token, _ = _object_size(buf, offset)
+    header = offset + 2 + len(token)
+
+    if token in ('FM ', 'DM '):
+        rows = _read_int32(buf, header)
+        cols = _read_int32(buf, header + 5)
+        dtype = np.dtype(_FLOATS[token])
+        start = header + 10
+        return np.frombuffer(
+            buf[start:start + rows * cols * dtype.itemsize],
+            dtype=dtype).reshape((rows, cols)).astype(dtype.newbyteorder('='))
+
+    if token in ('FV ', 'DV '):
+        dim = _read_int32(buf, header)
+        dtype = np.dtype(_FLOATS[token])
+        start = header + 5
+        return np.frombuffer(
+            buf[start:start + dim * dtype.itemsize],
+            dtype=dtype).astype(dtype.newbyteorder('='))
+
+    return _decode_compressed(token, buf, header)
+
+
+class ArkReader(object):
+    """Random access to the entries of a Kaldi binary ark
+
+    The ark file is mapped in memory and indexed at construction: the
+    index stores the offset of each entry. The arrays are decoded on
+    demand.
+
+    Exemple:
+    --------
+    ..
+
+      with ArkReader('raw_mfcc.1.ark') as ark:
+          for key in ark.keys():
+              print key, ark[key].shape
+
+    Parameters:
+    -----------
+
+    arkfile (str): path to a Kaldi binary ark file
+
+    Raise:
+    ------
+
+    IOError if the ark is not binary or contains unsupported types
+
+    """
+    def __init__(self, arkfile):
+        self.arkfile = arkfile
+        self._file = open(arkfile, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._buf = ''
+        else:
+            self._buf = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            self.index = self._build_index()
+        except:
+            self.close()
+            raise
+
+    def _build_index(self):
+        """Return an ordered dict key -> offset of the ark entries"""
+        index = collections.OrderedDict()
+        offset, end = 0, len(self._buf)
+        while offset < end:
+            space = self._buf.find(' ', offset)
+            if space == -1:
+                raise IOError('invalid ark entry at offset {} in {}'.format(
+                    offset, self.arkfile))
+
+            key = self._buf[offset:space]
+            offset = space + 1
+            index[key] = offset
+
+            _, size = _object_size(self._buf, offset)
+            offset += size
+        return index
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Release the mapped ark file"""
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        """Return the keys of the ark entries, in the order of the ark"""
+        return self.index.keys()
+
+    def __getitem__(self, key):
+        return read_object(self._buf, self.index[key])
+
+    def iteritems(self):
+        """Yield (key, array) pairs in the order of the ark"""
+        for key, offset in self.index.iteritems():
+            yield key, read_object(self._buf, offset)
+
+
+def _float_to_uint16(min_value, value_range, data):
+    """Quantize `data` on 16 bits in [min_value, min_value + range]"""
+    scaled = np.clip((data - min_value) / value_range, 0.0, 1.0)
+    return (scaled * 65535 + 0.499).astype(np.int64)
+
+
+def _uint16_to_float(min_value, value_range, data):
+    return np.float32(min_value) + np.float32(value_range) * np.float32(
+        1.0 / 65535.0) * data.astype(np.float32)
+
+
+def _global_header(array):
+    """Return (min, range) of `array` as computed by Kaldi"""
+    min_value, max_value = float(array.min()), float(array.max())
+    if max_value == min_value:
+        max_value = min_value + (1.0 + abs(min_value))
+    # Kaldi stores min and range as float32
+    min_value = np.float32(min_value)
+    return min_value, np.float32(max_value - min_value)
+
+
+def _col_headers(min_value, value_range, array):
+    """Return the uint16 percentiles (0, 25, 75, 100) of each column
+
+    `array` must have at least 5 rows
+
+    """
+    rows = array.shape[0]
+    quarter = rows // 4
+    data = np.sort(array, axis=0)[[0, quarter, 3 * quarter, rows - 1]]
+    headers = _float_to_uint16(min_value, value_range, data.T)
+
+    # ensure the percentiles are strictly increasing
+    headers[:, 0] = np.minimum(headers[:, 0], 65532)
+    headers[:, 1] = np.minimum(np.maximum(
+        headers[:, 1], headers[:, 0] + 1), 65533)
+    headers[:, 2] = np.minimum(np.maximum(
+        headers[:, 2], headers[:, 1] + 1), 65534)
+    headers[:, 3] = np.maximum(headers[:, 3], headers[:, 2] + 1)
+    return headers
+
+
+def _float_to_uint8(percentiles, data):
+    """Quantize `data` on 8 bits given the columns `percentiles`"""
+    p0, p25, p75, p100 = (percentiles[:, i:i + 1] for i in range(4))
+
+    def _piece(low, high, first, size):
+        # Kaldi truncates toward zero, then clips to the piece range
+        values = (data - low) / (high - low) * size + 0.5
+        return np.clip(np.trunc(values) + first, first, first + size)
+
+    return np.where(
+        data < p25, _piece(p0, p25, 0, 64),
+        np.where(data < p75, _piece(p25, p75, 64, 128),
+                 _piece(p75, p100, 192, 63))).astype(np.uint8)
+
+
+def _compress(array):
+    """Return the Kaldi compressed representation of a float matrix
+
+    Follow the automatic method of Kaldi: matrices with more than 8
+    rows are compressed on 8 bits with columns headers (CM), smaller
+    ones are compressed on 16 bits (CM2).
+
+    """
+    rows, cols = array.shape
+    if rows == 0 or cols == 0:
+        return 'CM ' + struct.pack('<ffii', 0, 0, 0, 0)
+
+    array = array.astype(np.float32)
+    min_value, value_range = _global_header(array)
+    header = struct.pack('<ffii', min_value, value_range, rows, cols)
+
+    if rows <= 8:
+        return 'CM2 ' + header + _float_to_uint16(
+            min_value, value_range, array).astype('<u2').tostring()
+
+    headers = _col_headers(min_value, value_range, array)
+    percentiles = _uint16_to_float(min_value, value_range, headers)
+    data = _float_to_uint8(percentiles, array.T)
+    return ('CM ' + header + headers.astype('<u2').tostring() +
+            data.tostring())
+
+
+def _serialize(array, compress=False):
+    """Return the binary Kaldi representation of a numpy array
+
+    Raise IOError if `array` is not a vector or a matrix
+
+    """
+    array = np.asarray(array)
+    if array.dtype not in (np.float32, np.float64):
+        array = array.astype(np.float32)
+    double = array.dtype == np.float64
+
+    if array.ndim == 2:
+        if compress:
+            return _BINARY + _compress(array)
+        return _BINARY + '{}\4{}\4{}{}'.format(
+            'DM ' if double else 'FM ',
+            struct.pack('<i', array.shape[0]),
+            struct.pack('<i', array.shape[1]),
+            array.astype('<f8' if double else '<f4').tostring())
+
+    if array.ndim == 1:
+        return _BINARY + '{}\4{}{}'.format(
+            'DV ' if double else 'FV ',
+            struct.pack('<i', array.shape[0]),
+            array.astype('<f8' if double else '<f4').tostring())
+
+    raise IOError('cannot write a {}D array to ark'.format(array.ndim))
+
+
+class ArkWriter(object):
+    """Write numpy arrays to a Kaldi binary ark and its scp index
+
+    Matrices and vectors are written as float or double according to
+    their dtype (other types are converted to float). This is the
+    equivalent of the Kaldi wspecifier 'ark,scp:<arkfile>,<scpfile>'.
+
+    Exemple:
+    --------
+    ..
+
+      with ArkWriter('feats.ark', 'feats.scp', compress=True) as ark:
+          for utt, features in compute_features():
+              ark.write(utt, features)
+
+    Parameters:
+    -----------
+
+    arkfile (str): the ark file to write, overwritten if existing
+
+    scpfile (str): optional scp file to write, referencing `arkfile`
+      as given
+
+    compress (bool): when True, the matrices are compressed as
+      written by Kaldi programs with the --compress=true option,
+      default to False
+
+    """
+    def __init__(self, arkfile, scpfile=None, compress=False):
+        self.arkfile = arkfile
+        self.compress = compress
+        self._ark = open(arkfile, 'wb')
+        self._scp = open(scpfile, 'w') if scpfile else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Flush and close the written files"""
+        self._ark.close()
+        if self._scp:
+            self._scp.close()
+
+    def write(self, key, array):
+        """Append the `array` indexed by `key` to the ark
+
+        Return the offset of the array in the ark, as referenced in
+        scp files.
+
+        Raise IOError if the key contains spaces or if the array is
+        not a vector or a matrix
+
+        """
+        if not key or ' ' in key:
+            raise IOError('invalid ark key "{}"'.format(key))
+
+        data = _serialize(array, compress=self.compress)
+        self._ark.write(key + ' ')
+        offset = self._ark.tell()
+        if self._scp:
+            self._scp.write('{} {}:{}\n'.format(key, self.arkfile, offset))
+        self._ark.write(data)
+        return offset
@@ -0,0 +1,174 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Random access to Kaldi features from a scp file
+
+A scp file such as feats.scp maps each utterance to an ark file and to
+the offset of its features within that ark, as in 'utt
+/path/to/raw_mfcc.1.ark:42'. The ScpReader class uses those offsets to
+load the features of any utterance without reading the whole arks.
+
+"""
+
+import collections
+import mmap
+import os
+
+from abkhazia.kaldi.binary_ark import read_object, read_shape
+
+
+def parse_scp(scp_file):
+    """Return an ordered dict utt -> (ark, offset) read from `scp_file`
+
+    Raise IOError if a line is not in the format 'utt ark:offset'
+
+    """
+    entries = collections.OrderedDict()
+    for n, line in enumerate(open(scp_file, 'r'), 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        try:
+            utt, rxfilename = line.split(None, 1)
+            ark, offset = rxfilename.rsplit(':', 1)
+            entries[utt] = (ark, int(offset))
+        except ValueError:
+            raise IOError('bad scp file line {} in {}: {}'.format(
+                n, scp_file, line))
+    return entries
+
+
+class ScpReader(object):
+    """Load the features of an utterance given its id
+
+    The ark files referenced in the scp are opened on demand and at
+    most `max_open_files` of them are kept open at once. The
+    recently loaded arrays are cached, the cache is bounded to
+    `cache_size` bytes. The returned arrays are read-only.
+
+    Exemple:
+    --------
+    ..
+
+      with ScpReader('data/features/feats.scp') as feats:
+          print feats['utt1'].shape
+
+    Parameters:
+    -----------
+
+    scp_file (str): the scp file indexing binary ark files, as
+      feats.scp or cmvn.scp
+
+    max_open_files (int): the maximal number of ark files kept open,
+      default to 16
+
+    cache_size (int): the maximal size of the cache in bytes, default
+      to 64 MB, no cache if 0
+
+    Raise:
+    ------
+
+    IOError if the scp file is badly formatted
+
+    """
+    def __init__(self, scp_file, max_open_files=16, cache_size=64 * 2**20):
+        self.scp_file = scp_file
+        self.index = parse_scp(scp_file)
+        self.max_open_files = max(1, max_open_files)
+        self.cache_size = cache_size
+
+        # the open arks as an ordered dict path -> (file, mmap), and
+        # the cache as an ordered dict utt -> array, in least
+        # recently used order
+        self._arks = collections.OrderedDict()
+        self._cache = collections.OrderedDict()
+        self._cached_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the open ark files and clear the cache"""
+        while self._arks:
+            _, (fark, buf) = self._arks.popitem()
+            buf.close()
+            fark.close()
+        self._cache.clear()
+        self._cached_bytes = 0
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, utt):
+        return utt in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        """Return the utterances ids, in the order of the scp"""
+        return self.index.keys()
+
+    def __getitem__(self, utt):
+        try:
+            data = self._cache.pop(utt)
+        except KeyError:
+            ark, offset = self.index[utt]
+            data = read_object(self._open(ark), offset)
+            data.flags.writeable = False  # shared with the cache
+            self._cached_bytes += data.nbytes
+
+        # (re)insert the data as the most recently used one
+        self._cache[utt] = data
+        while self._cache and self._cached_bytes > self.cache_size:
+            _, old = self._cache.popitem(last=False)
+            self._cached_bytes -= old.nbytes
+
+        return data
+
+    def shape(self, utt):
+        """Return the shape of the array of `utt`, without loading it"""
+        if utt in self._cache:
+            return self._cache[utt].shape
+        ark, offset = self.index[utt]
+        return read_shape(self._open(ark), offset)
+
+    def iteritems(self):
+        """Yield (utt, array) pairs in the order of the scp"""
+        for utt in self.index:
+            yield utt, self[utt]
+
+    def _open(self, ark):
+        """Return the mapped `ark`, open it if needed"""
+        try:
+            # move the ark at the end as the most recently used
+            entry = self._arks.pop(ark)
+        except KeyError:
+            if len(self._arks) >= self.max_open_files:
+                _, (fark, buf) = self._arks.popitem(last=False)
+                buf.close()
+                fark.close()
+
+            if not os.path.isfile(ark):
+                raise IOError('ark file not found: {}'.format(ark))
+            fark = open(ark, 'rb')
+            entry = (fark, mmap.mmap(
+                fark.fileno(), 0, access=mmap.ACCESS_READ))
+
+        self._arks[ark] = entry
+        return entry[1]
@@ -440,8 +440,15 @@ class LanguageModel(abstract_recipe.AbstractRecipe):
         self.a2k.setup_machine_specific_scripts()
         self._setup_prepare_lang_wpdpl()
 
+    def _input_params(self):
+        return [self.level, self.order, self.silence_probability,
+                self.position_dependent_phones]
+
     def run(self):
         """Run the created recipe and compute the language model"""
+        self._run_stage('language model', self._compute)
+
+    def _compute(self):
         self._prepare_lang()
 
         def _local(f):
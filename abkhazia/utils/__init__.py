@@ -23,4 +23,8 @@ import abkhazia_base
 import logger
 import wav
 import jobs
+import checkpoint
+import profiler
+import disk_budget
+import progress
 import cha
@@ -0,0 +1,181 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Stage markers and input fingerprints for resuming recipes
+
+A recipe is executed as a sequence of stages. When a stage is
+completed, a marker file is written with a fingerprint of the stage
+inputs. When resuming a recipe, a stage is skipped only if its marker
+exists with the same fingerprint.
+
+The fingerprint of files and directories is computed from their
+names, sizes and modification times (not their content), so it is
+cheap to compute even on large features or models directories.
+
+"""
+
+import hashlib
+import os
+
+
+def _update_path(sha, path):
+    """Update the `sha` digest with the stat of `path`, recursively"""
+    if not os.path.exists(path):
+        sha.update('{} missing\n'.format(path))
+        return
+
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        sha.update('{} {} {}\n'.format(path, stat.st_size, stat.st_mtime))
+        return
+
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            _path = os.path.join(root, name)
+            try:
+                stat = os.stat(_path)
+            except OSError:  # broken symlink
+                continue
+            sha.update('{} {} {}\n'.format(
+                os.path.relpath(_path, path), stat.st_size, stat.st_mtime))
+
+
+def fingerprint(paths=(), params=()):
+    """Return a sha1 hex digest of input `paths` and `params`
+
+    paths (sequence of str): files or directories (explored
+      recursively), None entries are ignored
+
+    params (sequence): parameters converted to str, dicts are sorted
+      by keys
+
+    """
+    sha = hashlib.sha1()
+
+    for path in paths:
+        if path is not None:
+            _update_path(sha, os.path.abspath(path))
+
+    for param in params:
+        if isinstance(param, dict):
+            param = sorted((k, str(v)) for k, v in param.iteritems())
+        sha.update(repr(param) + '\n')
+
+    return sha.hexdigest()
+
+
+def corpus_fingerprint(corpus):
+    """Return a sha1 hex digest of an abkhazia corpus
+
+    The digest is computed on the corpus data and on the wav files
+    metadata.
+
+    """
+    sha = hashlib.sha1()
+    for data in (corpus.utt2spk, corpus.segments, corpus.text,
+                 corpus.lexicon, corpus.phones):
+        for key in sorted(data.keys()):
+            sha.update(u'{} {}\n'.format(key, data[key]).encode('utf8'))
+
+    for data in (sorted(corpus.wavs), corpus.silences, corpus.variants):
+        sha.update(repr(data) + '\n')
+
+    if corpus.wav_folder:
+        _update_path(sha, corpus.wav_folder)
+
+    return sha.hexdigest()
+
+
+def utt_fingerprints(corpus):
+    """Return a dict utt_id -> sha1 hex digest of the utterance audio
+
+    The digest of an utterance is computed on its segment and on the
+    metadata of its wav file (name, size and modification time), so
+    it changes when the wav file or the segment is modified.
+
+    """
+    wavs = {}
+    digests = {}
+    for utt, (wav, tbegin, tend) in corpus.segments.iteritems():
+        if wav not in wavs:
+            path = os.path.join(corpus.wav_folder or '', wav)
+            try:
+                stat = os.stat(path)
+                wavs[wav] = '{} {} {}'.format(wav, stat.st_size, stat.st_mtime)
+            except OSError:
+                wavs[wav] = '{} missing'.format(wav)
+
+        digests[utt] = hashlib.sha1(
+            '{} {} {}'.format(wavs[wav], tbegin, tend)).hexdigest()
+    return digests
+
+
+class StageMarkers(object):
+    """Record the state of the stages of a recipe in `directory`
+
+    Each stage has a marker file '<directory>/<stage>.<state>' storing
+    the stage fingerprint, where state is 'started' or 'done'. A
+    '<directory>/<stage>.cleaned' marker records that the intermediate
+    files written by the stage have been deleted.
+
+    """
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _marker(self, name, state):
+        return os.path.join(
+            self.directory, '{}.{}'.format(name.replace(' ', '_'), state))
+
+    def state(self, name, fingerprint):
+        """Return the state of the stage `name` for that `fingerprint`
+
+        Return 'done', 'started' or None if the stage has never been
+        started with that fingerprint.
+
+        """
+        for state in ('done', 'started'):
+            marker = self._marker(name, state)
+            if (os.path.isfile(marker) and
+                    open(marker, 'r').read().strip() == fingerprint):
+                return state
+        return None
+
+    def _write(self, name, state, fingerprint):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        with open(self._marker(name, state), 'w') as marker:
+            marker.write(fingerprint + '\n')
+
+    def start(self, name, fingerprint):
+        """Mark the stage `name` as started"""
+        for state in ('done', 'cleaned'):
+            marker = self._marker(name, state)
+            if os.path.isfile(marker):
+                os.remove(marker)
+        self._write(name, 'started', fingerprint)
+
+    def done(self, name, fingerprint):
+        """Mark the stage `name` as done"""
+        self._write(name, 'done', fingerprint)
+        os.remove(self._marker(name, 'started'))
+
+    def clean(self, name):
+        """Mark the intermediate files of the stage `name` as deleted"""
+        self._write(name, 'cleaned', '')
+
+    def cleaned(self, name):
+        """Return True if the intermediate files of `name` are deleted"""
+        return os.path.isfile(self._marker(name, 'cleaned'))
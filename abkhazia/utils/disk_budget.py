@@ -0,0 +1,115 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the DiskBudget class bounding the disk usage of recipes
+
+The Kaldi scripts leave intermediate files in the recipe directory
+(alignment lattices, models of the training iterations...) which are
+no longer needed once the stages reading them are completed. The
+budget deletes them on demand, records the peak size of the recipe
+directory and raises an error when it exceeds a maximal size.
+
+"""
+
+import glob
+import os
+
+from abkhazia.utils.config import config
+from abkhazia.utils.logger import null_logger
+from abkhazia.utils.path import directory_size, remove
+
+
+class DiskBudget(object):
+    """Bound the disk usage of a recipe directory
+
+    Parameters:
+    -----------
+
+    directory (str): the recipe directory
+
+    max_size (float): maximal size of `directory` in GB, no bound if
+      None
+
+    log (logging.Logger): where to send log messages
+
+    """
+    def __init__(self, directory, max_size=None, log=null_logger()):
+        self.directory = directory
+        self.max_size = max_size
+        self.log = log
+
+        self.peak = 0
+        """Peak size of the directory in bytes, as measured"""
+
+    @classmethod
+    def from_config(cls, directory, log=null_logger()):
+        """Return the budget defined in the abkhazia configuration
+
+        Read the 'recipe-disk-budget' entry of the [abkhazia]
+        section, the directory size is not bounded if undefined.
+
+        """
+        size = (config.get('abkhazia', 'recipe-disk-budget').strip()
+                if config.has_option('abkhazia', 'recipe-disk-budget')
+                else '')
+        return cls(directory, max_size=float(size) if size else None,
+                   log=log)
+
+    def measure(self):
+        """Return the size of the directory in bytes, update the peak"""
+        size = directory_size(self.directory)
+        self.peak = max(self.peak, size)
+        return size
+
+    def check(self):
+        """Measure the directory, raise RuntimeError if over budget"""
+        size = self.measure()
+        if self.max_size is not None and size > self.max_size * 2**30:
+            raise RuntimeError(
+                'recipe directory {} uses {:.1f} GB, over the disk budget '
+                'of {} GB (see recipe-disk-budget in the abkhazia '
+                'configuration)'.format(
+                    self.directory, size / float(2**30), self.max_size))
+        return size
+
+    def clean(self, patterns):
+        """Delete the files matching `patterns` in the directory
+
+        The `patterns` are glob patterns relative to the directory,
+        they can match files or directories. The files targeted by a
+        symbolic link in their directory are kept (Kaldi links
+        final.mdl to the model of the last training iteration).
+
+        Return the number of bytes freed.
+
+        """
+        paths = sorted(set(
+            path for pattern in patterns
+            for path in glob.glob(os.path.join(self.directory, pattern))))
+
+        linked = set()
+        for directory in set(os.path.dirname(p) for p in paths):
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if os.path.islink(path):
+                    linked.add(os.path.realpath(path))
+
+        freed = 0
+        for path in (p for p in paths if os.path.realpath(p) not in linked):
+            size = (directory_size(path) if os.path.isdir(path)
+                    and not os.path.islink(path) else os.lstat(path).st_size)
+            self.log.debug('deleting intermediate %s', path)
+            remove(path, safe=True)
+            freed += size
+        return freed
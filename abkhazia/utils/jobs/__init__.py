@@ -0,0 +1,107 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkahzia. If not, see <http://www.gnu.org/licenses/>.
+"""Provide functions to launch command-line jobs
+
+The runner module executes groups of commands in a single event
+loop, it backs the run() and run_many() functions. The scheduler
+module provides a local job scheduler, usable as a replacement of the
+Kaldi run.pl script with the abkhazia-run command.
+The backends module provides a common interface to execute jobs
+locally or on a cluster. The pipeline module runs abkhazia commands as
+a graph of dependent steps, with the 'abkhazia pipeline' command.
+The sizing module chooses the number of jobs fitting in memory.
+
+"""
+
+import os
+import sys
+
+from abkhazia.utils.jobs.runner import Runner
+from abkhazia.utils.jobs.scheduler import (
+    LocalScheduler, Task, TaskResult, parse_job_range, parse_memory)
+from abkhazia.utils.jobs.backends import get_backend
+from abkhazia.utils.jobs.pipeline import Pipeline, Step, read_spec
+from abkhazia.utils.jobs.sizing import MemoryModel
+
+
+def run(command, stdin=None, stdout=sys.stdout.write,
+        cwd=None, env=os.environ, returncode=0, timeout=None,
+        monitor=None):
+    """Run 'command' as a subprocess
+
+    command : string to be executed as a subprocess
+
+    stdout : standard output/error redirection function. By default
+        redirect the output to stdout, but you can redirect to a
+        logger with stdout=log.debug for exemple. Use
+        stdout=open(os.devnull, 'w').write to ignore the command
+        output. The output is forwarded by batches of lines.
+
+    stdin : standard input redirection, can be a file or any readable
+        stream.
+
+    cwd : current working directory for executing the command
+
+    env : current environment for executing the command
+
+    returncode : expected return code of the command
+
+    timeout : maximum duration of the command in seconds, the command
+        is killed after that delay. By default no timeout.
+
+    monitor : an optional abkhazia.utils.progress.ProgressMonitor
+        polled while the command is running
+
+    Returns a dict with the resources used by the command: 'wall' and
+    'cpu' times in seconds (the CPU time being user and system time
+    of the command and its children), and 'maxrss' the peak resident
+    memory in kB. Raise a RuntimeError if the command did not returned
+    with `returncode` or timed out.
+
+    """
+    stats = Runner(stdout=stdout, cwd=cwd, env=env, timeout=timeout,
+                   monitor=monitor).run(
+                       [command], stdin=stdin, returncode=returncode)[0]
+    del stats['returncode']
+    return stats
+
+
+def run_many(commands, stdout=sys.stdout.write, cwd=None, env=os.environ,
+             returncode=0, timeout=None, max_jobs=None, cancel=True,
+             monitor=None):
+    """Run several commands as subprocesses in a single event loop
+
+    The arguments are the same as for run(), excepted:
+
+    commands : list of strings to be executed as subprocesses
+
+    max_jobs : maximum number of commands running at once, by
+        default all the commands are launched at once
+
+    cancel : when True (default), the first failed command kills the
+        running ones and cancels the pending ones
+
+    Returns a list of dict with the resources used by each command, as
+    returned by run(), in the order of `commands`. Raise a
+    RuntimeError if a command failed.
+
+    """
+    stats = Runner(stdout=stdout, cwd=cwd, env=env, max_jobs=max_jobs,
+                   timeout=timeout, monitor=monitor).run(
+                       commands, returncode=returncode, cancel=cancel)
+    for stat in stats:
+        if stat is not None:
+            del stat['returncode']
+    return stats
@@ -0,0 +1,499 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkahzia. If not, see <http://www.gnu.org/licenses/>.
+"""Job backends executing tasks locally or on a cluster
+
+A backend exposes a common interface to submit a task, query its
+status and wait for its completion, whatever the underlying execution
+system. The following backends are available:
+
+* local: each task runs as a local process, as with run.pl
+
+* multiworker: a fixed number of local workers consuming a queue of
+  tasks, emulating a cluster on a single machine (for testing)
+
+* gridengine: tasks are submitted with qsub, as with queue.pl
+
+* slurm: tasks are submitted with sbatch, as with slurm.pl
+
+The backend used by abkhazia is defined by the 'backend' entry of the
+[kaldi] section of the configuration file, with its options in
+'backend-options'. If no backend is defined there, it is guessed from
+the 'train-cmd' entry. The backend capacity (number of tasks it can
+run at once) is used to size the number of jobs of the recipes.
+
+Exemple:
+--------
+..
+
+  from abkhazia.utils.jobs import backends, Task
+
+  backend = backends.get_backend('multiworker', workers=4)
+  ids = [backend.submit(Task('sleep 1', 'log/{}.log'.format(i)))
+         for i in range(8)]
+  codes = backend.wait(ids)
+
+"""
+
+import multiprocessing
+import os
+import Queue
+import re
+import subprocess
+import threading
+import time
+
+from abkhazia.utils import config
+from abkhazia.utils.jobs.scheduler import TaskResult
+
+
+PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+"""The possible status of a submitted task"""
+
+
+class AbstractBackend(object):
+    """Base class of the job backends
+
+    A child class must implement the methods submit(), status(),
+    returncode() and capacity().
+
+    """
+    name = NotImplemented
+    """The name of the backend, as used in the configuration file"""
+
+    poll_interval = 0.1
+    """Seconds to wait between two status queries in wait()"""
+
+    def submit(self, task):
+        """Submit the `task` for execution and return its job id"""
+        raise NotImplementedError
+
+    def status(self, job_id):
+        """Return the status of a submitted job
+
+        The status is one of 'pending', 'running', 'done' or 'failed'
+
+        """
+        raise NotImplementedError
+
+    def returncode(self, job_id):
+        """Return the exit code of a terminated job"""
+        raise NotImplementedError
+
+    def capacity(self):
+        """Return the number of tasks the backend can run at once"""
+        raise NotImplementedError
+
+    def wait(self, job_ids):
+        """Wait for the `job_ids` to terminate, return their exit codes
+
+        Return a dict job_id -> returncode
+
+        """
+        return {job_id: code for job_id, (code, _) in
+                self._wait(job_ids).iteritems()}
+
+    def _wait(self, job_ids):
+        """Wait for the `job_ids` to terminate
+
+        Return a dict job_id -> (returncode, end time), the end time
+        being the time at which the job was seen terminated, up to
+        `poll_interval` seconds after its actual end.
+
+        """
+        remaining = set(job_ids)
+        ends = {}
+        while remaining:
+            for job_id in list(remaining):
+                if self.status(job_id) in (DONE, FAILED):
+                    ends[job_id] = (self.returncode(job_id), time.time())
+                    remaining.remove(job_id)
+
+            if remaining:
+                time.sleep(self.poll_interval)
+        return ends
+
+    def run(self, tasks, retries=0):
+        """Submit the `tasks`, wait for them and return their results
+
+        Each failed task is submitted again up to `retries` times.
+        Return a list of TaskResult in the order of `tasks`. Only the
+        wall time is measured by the backends, from the submission of
+        each job to its end (including the time it is pending): CPU
+        time and memory are reported as 0.
+
+        """
+        results = {}
+        pending = list(tasks)
+        for attempt in range(1, retries + 2):
+            submitted = {}
+            for task in pending:
+                start = time.time()
+                submitted[self.submit(task)] = (task, start)
+
+            for job_id, (code, end) in self._wait(
+                    submitted.keys()).iteritems():
+                task, start = submitted[job_id]
+                results[id(task)] = TaskResult(
+                    task, code, end - start, 0, 0, attempts=attempt)
+
+            pending = [t for t in pending if results[id(t)].failed]
+            if not pending:
+                break
+
+        return [results[id(t)] for t in tasks]
+
+
+def _open_log(task):
+    """Create the log file of a task with its header, return it opened"""
+    log_dir = os.path.dirname(task.log_file)
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+
+    log = open(task.log_file, 'w')
+    log.write('# {}\n'.format(task.command))
+    log.flush()
+    return log
+
+
+class LocalBackend(AbstractBackend):
+    """Run each submitted task at once as a local process, as run.pl"""
+    name = 'local'
+
+    def __init__(self, cwd=None, env=None):
+        self.cwd = cwd
+        self.env = env
+        self._jobs = {}
+
+    def submit(self, task):
+        with _open_log(task) as log:
+            job = subprocess.Popen(
+                ['bash', '-c', task.command],
+                stdout=log, stderr=subprocess.STDOUT,
+                cwd=self.cwd, env=self.env)
+        self._jobs[str(job.pid)] = job
+        return str(job.pid)
+
+    def status(self, job_id):
+        code = self._jobs[job_id].poll()
+        if code is None:
+            return RUNNING
+        return DONE if code == 0 else FAILED
+
+    def returncode(self, job_id):
+        return self._jobs[job_id].returncode
+
+    def capacity(self):
+        return multiprocessing.cpu_count()
+
+
+class MultiWorkerBackend(AbstractBackend):
+    """Emulate a cluster of `workers` nodes on the local machine
+
+    Submitted tasks are queued and executed by `workers` threads, so
+    tasks stay 'pending' until a worker is free, as on a cluster.
+
+    """
+    name = 'multiworker'
+
+    def __init__(self, workers=None, cwd=None, env=None):
+        self.workers = int(workers or multiprocessing.cpu_count())
+        self.cwd = cwd
+        self.env = env
+
+        self._queue = Queue.Queue()
+        self._lock = threading.Lock()
+        self._status = {}
+        self._codes = {}
+        self._counter = 0
+
+        for _ in range(self.workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+
+    def _work(self):
+        while True:
+            job_id, task = self._queue.get()
+            with self._lock:
+                self._status[job_id] = RUNNING
+
+            with _open_log(task) as log:
+                code = subprocess.call(
+                    ['bash', '-c', task.command],
+                    stdout=log, stderr=subprocess.STDOUT,
+                    cwd=self.cwd, env=self.env)
+
+            with self._lock:
+                self._codes[job_id] = code
+                self._status[job_id] = DONE if code == 0 else FAILED
+            self._queue.task_done()
+
+    def submit(self, task):
+        with self._lock:
+            self._counter += 1
+            job_id = str(self._counter)
+            self._status[job_id] = PENDING
+        self._queue.put((job_id, task))
+        return job_id
+
+    def status(self, job_id):
+        with self._lock:
+            return self._status[job_id]
+
+    def returncode(self, job_id):
+        with self._lock:
+            return self._codes[job_id]
+
+    def capacity(self):
+        return self.workers
+
+
+class AbstractClusterBackend(AbstractBackend):
+    """Base class of the backends submitting tasks to a cluster
+
+    Each task is wrapped in a bash script which records the task exit
+    code in a '<log_file>.exit' file, so the exit code is available
+    once the cluster forgot about the job. The script is written in
+    the directory of the log file.
+
+    options (str): additional options passed to the submission
+      command, e.g. '-q all.q' for a queue on GridEngine
+
+    default_capacity (int): capacity of the cluster when it cannot be
+      queried, default to 20, the standard number of jobs for
+      features computation in the kaldi WSJ recipe
+
+    """
+    poll_interval = 5
+
+    grace_delay = 60
+    """Seconds to wait for the exit file of a job no more on the cluster"""
+
+    def __init__(self, options='', default_capacity=20):
+        self.options = options or ''
+        self.default_capacity = default_capacity
+        self._capacity = None
+        self._exit_files = {}
+        self._vanished = {}
+
+    def _write_script(self, task):
+        _open_log(task).close()
+        script = task.log_file + '.sh'
+        with open(script, 'w') as fscript:
+            fscript.write(
+                '#!/bin/bash\ncd {cwd}\n( {cmd} ) >> {log} 2>&1\n'
+                'echo $? > {log}.exit\n'.format(
+                    cwd=os.getcwd(), cmd=task.command, log=task.log_file))
+        os.chmod(script, 0o755)
+
+        exit_file = task.log_file + '.exit'
+        if os.path.exists(exit_file):
+            os.remove(exit_file)
+        return script, exit_file
+
+    def submit(self, task):
+        script, exit_file = self._write_script(task)
+        job_id = self._submit(script, task).strip()
+        self._exit_files[job_id] = exit_file
+        return job_id
+
+    def status(self, job_id):
+        exit_file = self._exit_files[job_id]
+        if os.path.isfile(exit_file) and open(exit_file).read().strip():
+            return DONE if self.returncode(job_id) == 0 else FAILED
+
+        status = self._status(job_id)
+        if status is not None:
+            return status
+
+        # the job is no more on the cluster but its exit file is not
+        # (yet) visible on the shared file system: wait for it a
+        # little before considering the job failed
+        vanished = self._vanished.setdefault(job_id, time.time())
+        return (RUNNING if time.time() - vanished < self.grace_delay
+                else FAILED)
+
+    def returncode(self, job_id):
+        try:
+            return int(open(self._exit_files[job_id], 'r').read().strip())
+        except (IOError, ValueError):
+            # the job disappeared from the cluster without exit code
+            return 1
+
+    def capacity(self):
+        if self._capacity is None:
+            try:
+                self._capacity = self._query_capacity()
+            except (OSError, subprocess.CalledProcessError, ValueError):
+                self._capacity = self.default_capacity
+        return self._capacity
+
+    def _submit(self, script, task):
+        """Submit the `script` of `task` and return its job id"""
+        raise NotImplementedError
+
+    def _status(self, job_id):
+        """Return the status of a job, None if it is no more listed"""
+        raise NotImplementedError
+
+    def _query_capacity(self):
+        """Return the number of slots of the cluster"""
+        raise NotImplementedError
+
+
+class GridEngineBackend(AbstractClusterBackend):
+    """Submit tasks to a Sun GridEngine cluster with qsub"""
+    name = 'gridengine'
+
+    def _submit(self, script, task):
+        # as queue.pl, request a parallel environment only for
+        # multi-threaded tasks, not all the clusters define 'smp'
+        return subprocess.check_output(
+            'qsub -terse -V -S /bin/bash -j y -o {log}.qsub '
+            '{threads}{options} {script}'.format(
+                log=task.log_file,
+                threads=('-pe smp {} '.format(task.threads)
+                         if task.threads > 1 else ''),
+                options=self.options, script=script), shell=True)
+
+    def _status(self, job_id):
+        output = subprocess.Popen(
+            ['qstat'], stdout=subprocess.PIPE).communicate()[0]
+        for line in output.split('\n'):
+            words = line.split()
+            if words and words[0] == job_id:
+                # a job in error state (such as Eqw) never runs, it
+                # is deleted and considered failed
+                if 'E' in words[4]:
+                    subprocess.call(
+                        ['qdel', job_id], stdout=open(os.devnull, 'w'),
+                        stderr=subprocess.STDOUT)
+                    return FAILED
+                return PENDING if 'q' in words[4] else RUNNING
+        return None
+
+    def _query_capacity(self):
+        # sum the AVAIL and USED columns of the cluster queues summary
+        output = subprocess.check_output(['qstat', '-g', 'c'])
+        slots = 0
+        for line in output.split('\n')[2:]:
+            words = line.split()
+            if len(words) >= 5:
+                slots += int(words[2]) + int(words[4])
+        if not slots:
+            raise ValueError('no slots found in qstat output')
+        return slots
+
+
+class SlurmBackend(AbstractClusterBackend):
+    """Submit tasks to a SLURM cluster with sbatch"""
+    name = 'slurm'
+
+    def _submit(self, script, task):
+        return subprocess.check_output(
+            'sbatch --parsable --export=ALL --cpus-per-task {threads} '
+            '{mem} -o {log}.sbatch {options} {script}'.format(
+                log=task.log_file, threads=task.threads,
+                mem=('--mem {}K'.format(task.memory // 1024)
+                     if task.memory else ''),
+                options=self.options, script=script),
+            shell=True).split(';')[0]
+
+    def _status(self, job_id):
+        state = subprocess.Popen(
+            ['squeue', '-h', '-j', job_id, '-o', '%T'],
+            stdout=subprocess.PIPE,
+            stderr=open(os.devnull, 'w')).communicate()[0].strip()
+
+        if not state:
+            return None
+        if state in ('PENDING', 'CONFIGURING', 'REQUEUED'):
+            return PENDING
+        return RUNNING
+
+    def _query_capacity(self):
+        # sinfo %C is allocated/idle/other/total CPUs
+        output = subprocess.check_output(['sinfo', '-h', '-o', '%C'])
+        return int(output.strip().split('/')[3])
+
+
+BACKENDS = {b.name: b for b in (
+    LocalBackend, MultiWorkerBackend, GridEngineBackend, SlurmBackend)}
+"""The available backends indexed by name"""
+
+
+def configured_backend():
+    """Return the name and options of the backend in the configuration
+
+    Read the 'backend' and 'backend-options' entries of the [kaldi]
+    section. If no backend is defined, guess it from 'train-cmd':
+    'queue.pl' is gridengine, 'slurm.pl' is slurm, and anything else
+    is local.
+
+    """
+    if config.has_option('kaldi', 'backend'):
+        name = config.get('kaldi', 'backend').strip()
+    else:
+        name = None
+
+    options = (config.get('kaldi', 'backend-options').strip()
+               if config.has_option('kaldi', 'backend-options')
+               else '')
+
+    if not name:
+        cmd = config.get('kaldi', 'train-cmd')
+        if re.search(r'\bqueue\.pl\b', cmd):
+            name = 'gridengine'
+        elif re.search(r'\bslurm\.pl\b', cmd):
+            name = 'slurm'
+        else:
+            name = 'local'
+
+    return name, options
+
+
+_INSTANCES = {}
+
+
+def get_backend(name=None, **kwargs):
+    """Return an instance of the job backend `name`
+
+    If `name` is None, return the backend defined in the abkhazia
+    configuration file. The 'backend-options' from the configuration
+    file are used only for the configured backend. Instances are
+    cached, so that the capacity of a cluster is queried only
+    once. Raise RuntimeError if the backend is unknown.
+
+    """
+    configured, options = configured_backend()
+    if name is None:
+        name = configured
+    elif name != configured:
+        options = ''
+
+    if name not in BACKENDS:
+        raise RuntimeError(
+            'unknown job backend "{}", choose from {}'.format(
+                name, ', '.join(sorted(BACKENDS.keys()))))
+
+    if issubclass(BACKENDS[name], AbstractClusterBackend):
+        kwargs.setdefault('options', options)
+    elif name == 'multiworker' and options:
+        kwargs.setdefault('workers', options)
+
+    key = (name, tuple(sorted(kwargs.items())))
+    if key not in _INSTANCES:
+        _INSTANCES[key] = BACKENDS[name](**kwargs)
+    return _INSTANCES[key]
@@ -0,0 +1,283 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Run abkhazia commands as a graph of dependent steps
+
+A pipeline is declared in a specification file, with a section per
+step. A step is an abkhazia command (as typed after 'abkhazia' on the
+command line) with its dependencies, the outputs it produces and the
+resources it requires:
+
+  [features]
+  command: features mfcc mycorpus -j 4 --force
+  threads: 4
+  outputs: mycorpus/features
+
+  [language]
+  command: language mycorpus -n 3 --force
+  outputs: mycorpus/language
+
+  [acoustic]
+  command: acoustic monophone mycorpus -j 4 --force
+  depends: features language
+  outputs: mycorpus/acoustic
+
+The steps are run as soon as their dependencies are completed (here
+features and language run concurrently) by a LocalScheduler, bounded
+by a global CPU and memory budget. The 'threads' option defaults to
+the --njobs value of the command, 'memory' (e.g. 4G) to 0.
+
+When a step is completed, its fingerprint is recorded. It is computed
+from the command, the fingerprints of the step dependencies and the
+files in its outputs. When the pipeline is run again, a step is
+skipped if its fingerprint is unchanged and all its dependencies are
+skipped as well.
+
+"""
+
+import ConfigParser
+import os
+import re
+import sys
+
+from abkhazia.utils.checkpoint import StageMarkers, fingerprint
+from abkhazia.utils.jobs.scheduler import LocalScheduler, Task, parse_memory
+from abkhazia.utils.logger import null_logger
+
+
+class Step(object):
+    """A step of a pipeline
+
+    name (str): the step name, unique in the pipeline
+
+    command (str): the abkhazia command run by the step, without the
+      leading 'abkhazia'
+
+    depends (list of str): the names of the steps that must be
+      completed before this one
+
+    outputs (list of str): the files or directories produced by the
+      step
+
+    threads (int): the number of CPU cores used by the step, default
+      to the --njobs value of the command or 1
+
+    memory (int): the memory required by the step in bytes
+
+    """
+    def __init__(self, name, command, depends=(), outputs=(),
+                 threads=None, memory=0):
+        self.name = name
+        self.command = command
+        self.depends = list(depends)
+        self.outputs = list(outputs)
+        self.memory = memory
+
+        if threads is None:
+            matched = re.search(r'(?:^|\s)(?:-j|--njobs)[= ]?(\d+)', command)
+            threads = int(matched.group(1)) if matched else 1
+        self.threads = threads
+
+
+def read_spec(spec_file):
+    """Return the list of steps defined in `spec_file`
+
+    The outputs are relative to the directory of `spec_file`. Raise
+    IOError if the file is not a valid pipeline specification.
+
+    """
+    if not os.path.isfile(spec_file):
+        raise IOError('pipeline specification not found: {}'
+                      .format(spec_file))
+
+    parser = ConfigParser.RawConfigParser()
+    try:
+        parser.read(spec_file)
+    except ConfigParser.Error as err:
+        raise IOError('invalid pipeline specification: {}'.format(err))
+
+    directory = os.path.dirname(os.path.abspath(spec_file))
+
+    def _get(section, option, default=''):
+        return (parser.get(section, option).strip()
+                if parser.has_option(section, option) else default)
+
+    steps = []
+    for name in parser.sections():
+        command = _get(name, 'command')
+        if not command:
+            raise IOError('step {} has no command'.format(name))
+
+        threads = _get(name, 'threads')
+        try:
+            steps.append(Step(
+                name, command,
+                depends=_get(name, 'depends').split(),
+                outputs=[os.path.join(directory, path)
+                         for path in _get(name, 'outputs').split()],
+                threads=int(threads) if threads else None,
+                memory=parse_memory(_get(name, 'memory', '0'))))
+        except ValueError as err:
+            raise IOError('invalid step {}: {}'.format(name, err))
+
+    if not steps:
+        raise IOError('no step defined in {}'.format(spec_file))
+    return steps
+
+
+def sort_steps(steps):
+    """Return the `steps` sorted such as dependencies come first
+
+    The order of independent steps is preserved. Raise IOError on
+    unknown or cyclic dependencies.
+
+    """
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise IOError('duplicated step names in pipeline')
+
+    for step in steps:
+        for depend in step.depends:
+            if depend not in names:
+                raise IOError('step {} depends on unknown step {}'
+                              .format(step.name, depend))
+
+    sorted_steps = []
+    done = set()
+    pending = list(steps)
+    while pending:
+        ready = [s for s in pending if all(d in done for d in s.depends)]
+        if not ready:
+            raise IOError('cyclic dependencies between steps {}'.format(
+                ', '.join(s.name for s in pending)))
+
+        for step in ready:
+            pending.remove(step)
+            done.add(step.name)
+            sorted_steps.append(step)
+    return sorted_steps
+
+
+class Pipeline(object):
+    """Run the steps of a pipeline concurrently
+
+    Parameters:
+    -----------
+
+    steps (list of Step): the steps of the pipeline
+
+    directory (str): where to write the logs of the steps and their
+      fingerprints
+
+    cwd (str): the working directory of the steps, default to the
+      current directory
+
+    max_jobs (int): maximum number of CPU cores used at once, default
+      is the number of CPU cores
+
+    max_memory (int): maximum memory (in bytes) required by the steps
+      running at once, default is the available memory on the system
+
+    log (logging.Logger): where to send log messages
+
+    """
+    def __init__(self, steps, directory, cwd=None, max_jobs=None,
+                 max_memory=None, log=null_logger()):
+        self.steps = sort_steps(steps)
+        self.directory = os.path.abspath(directory)
+        self.cwd = cwd
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.log = log
+
+        self._markers = StageMarkers(os.path.join(self.directory, 'stages'))
+
+    def log_file(self, step):
+        """Return the log file of the `step`"""
+        return os.path.join(self.directory, step.name + '.log')
+
+    @staticmethod
+    def _command(step):
+        """Return the bash command running the `step`"""
+        return '{} -m abkhazia.commands.abkhazia_main {}'.format(
+            sys.executable, step.command)
+
+    @staticmethod
+    def _fingerprint(step, fingerprints):
+        return fingerprint(
+            paths=step.outputs,
+            params=[step.command] + [fingerprints[d] for d in step.depends])
+
+    def run(self, force=False):
+        """Run the steps of the pipeline
+
+        If `force` is True, run all the steps, else skip the ones
+        already completed. Return a dict step name -> state, the state
+        being 'skipped', 'done', 'failed' or 'cancelled' (when a
+        dependency failed). Raise RuntimeError if a step failed.
+
+        """
+        fingerprints = {}
+        states = {}
+        for step in self.steps:
+            states[step.name] = None
+            if force or any(states[d] != 'skipped' for d in step.depends):
+                continue
+
+            _fingerprint = self._fingerprint(step, fingerprints)
+            if self._markers.state(step.name, _fingerprint) == 'done':
+                self.log.info('skipping step %s, already completed',
+                              step.name)
+                fingerprints[step.name] = _fingerprint
+                states[step.name] = 'skipped'
+
+        tasks = {}
+        for step in (s for s in self.steps if states[s.name] is None):
+            self.log.info('scheduling step %s: %s', step.name, step.command)
+            self._markers.start(step.name, '')
+            tasks[step.name] = Task(
+                self._command(step), self.log_file(step),
+                memory=step.memory, threads=step.threads,
+                depends=[tasks[d] for d in step.depends if d in tasks])
+
+        results = {
+            result.task: result for result in LocalScheduler(
+                max_jobs=self.max_jobs, max_memory=self.max_memory,
+                cwd=self.cwd).run(tasks.values())}
+
+        # the fingerprints are computed in the order of the
+        # dependencies, on the outputs of the completed steps
+        for step in (s for s in self.steps if s.name in tasks):
+            result = results[tasks[step.name]]
+            if result.returncode is None:
+                states[step.name] = 'cancelled'
+                self.log.warning(
+                    'step %s cancelled, a dependency failed', step.name)
+            elif result.failed:
+                states[step.name] = 'failed'
+                self.log.error('step %s failed, see %s',
+                               step.name, self.log_file(step))
+            else:
+                states[step.name] = 'done'
+                fingerprints[step.name] = self._fingerprint(
+                    step, fingerprints)
+                self._markers.done(step.name, fingerprints[step.name])
+                self.log.info('step %s done in %ds', step.name,
+                              int(round(result.wall)))
+
+        failed = [s.name for s in self.steps if states[s.name] == 'failed']
+        if failed:
+            raise RuntimeError('pipeline failed on step {}, logs are in {}'
+                               .format(', '.join(failed), self.directory))
+        return states
@@ -0,0 +1,328 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Run subprocesses in a single event loop
+
+A Runner executes a group of commands as subprocesses, with no
+thread: the outputs of all the running commands are multiplexed with
+select() and forwarded by batches of complete lines, the terminated
+commands are reaped with os.wait4() to get back their resources
+usage. Each command runs in its own process group so that it can be
+killed with its children on timeout, or when another command of the
+group failed.
+
+"""
+
+import errno
+import fcntl
+import os
+import select
+import shlex
+import signal
+import subprocess
+import sys
+import time
+
+
+class _Child(object):
+    """A command running as a subprocess, with its output buffer"""
+    def __init__(self, index, command, job):
+        self.index = index
+        self.command = command
+        self.job = job
+        self.start = time.time()
+        self.buffer = []
+        self.buffered = 0
+        self.flushed = self.start
+        self.eof = False
+        self.status = None
+        self.rusage = None
+        self.ended = None
+        self.killed = None
+        self.timed_out = False
+
+        fd = job.stdout.fileno()
+        fcntl.fcntl(fd, fcntl.F_SETFL,
+                    fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    @property
+    def fd(self):
+        return self.job.stdout.fileno()
+
+    @property
+    def returncode(self):
+        return (os.WEXITSTATUS(self.status) if os.WIFEXITED(self.status)
+                else -os.WTERMSIG(self.status))
+
+    def kill(self, sig):
+        """Send `sig` to the process group of the command"""
+        try:
+            os.killpg(self.job.pid, sig)
+        except OSError:  # the group has already exited
+            pass
+
+
+class Runner(object):
+    """Run groups of commands in a single event loop
+
+    Parameters:
+    -----------
+
+    stdout (callable): receives the output (stdout and stderr) of the
+      commands, by batches of complete lines. By default redirect to
+      sys.stdout, use stdout=log.debug to redirect to a logger.
+
+    cwd (str): working directory of the commands
+
+    env (dict): environment of the commands
+
+    max_jobs (int): maximum number of commands running at once, by
+      default all the commands are launched at once
+
+    timeout (float): maximum duration of a command in seconds, a
+      command still running after that delay is killed and considered
+      failed. By default no timeout.
+
+    flush_interval (float): maximum delay in seconds before the
+      output of a command is forwarded to `stdout`
+
+    flush_size (int): the output of a command is forwarded to `stdout`
+      as soon as it exceeds that size in bytes
+
+    monitor (abkhazia.utils.progress.ProgressMonitor): when specified,
+      its poll() method is called in the event loop and the output of
+      the commands is forwarded to its output() method
+
+    """
+    poll_interval = 0.05
+    """Seconds to wait for an output before polling the commands"""
+
+    kill_delay = 5
+    """Seconds between SIGTERM and SIGKILL when killing a command"""
+
+    exit_delay = 1
+    """Seconds to wait for the output of a terminated command"""
+
+    def __init__(self, stdout=sys.stdout.write, cwd=None, env=os.environ,
+                 max_jobs=None, timeout=None, flush_interval=0.5,
+                 flush_size=65536, monitor=None):
+        self.stdout = stdout
+        self.cwd = cwd
+        self.env = env
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.monitor = monitor
+
+    def run(self, commands, stdin=None, returncode=0, cancel=True):
+        """Run the `commands` and return their resources usage
+
+        Parameters:
+        -----------
+
+        commands (list of str): the commands to run, they are not
+          interpreted by a shell
+
+        stdin (file): standard input of the commands, default to None
+
+        returncode (int): expected return code of the commands
+
+        cancel (bool): when True, the first failed command cancels the
+          whole group: the running commands are killed and the pending
+          ones are not launched
+
+        Return:
+        -------
+
+        A list of dict with the resources used by each command, in
+        the order of `commands`: 'wall' and 'cpu' times in seconds
+        (the CPU time being user and system time of the command and
+        its children), 'maxrss' the peak resident memory in kB and
+        'returncode'.
+
+        Raise a RuntimeError if a command did not returned with
+        `returncode`, or timed out.
+
+        """
+        pending = list(enumerate(commands))
+        running = []
+        results = [None] * len(commands)
+        failed = None
+
+        try:
+            while pending or running:
+                while pending and (
+                        not self.max_jobs or len(running) < self.max_jobs):
+                    index, command = pending.pop(0)
+                    running.append(self._launch(index, command, stdin))
+
+                self._read(running)
+                self._check_timeouts(running)
+                if self.monitor is not None:
+                    self.monitor.poll()
+
+                for child in self._reap(running):
+                    running.remove(child)
+                    results[child.index] = {
+                        'wall': child.ended - child.start,
+                        'cpu': (child.rusage.ru_utime +
+                                child.rusage.ru_stime),
+                        'maxrss': child.rusage.ru_maxrss,
+                        'returncode': child.returncode}
+
+                    if failed is None and (
+                            child.timed_out or
+                            child.returncode != returncode):
+                        failed = child
+                        if cancel:
+                            pending = []
+                            self._cancel(running)
+        finally:
+            # on an unexpected error (KeyboardInterrupt for instance),
+            # do not leave orphan commands
+            if running:
+                self._cancel(running, signal.SIGKILL)
+                self._reap(running, block=True)
+
+        if failed is not None:
+            if failed.timed_out:
+                raise RuntimeError(
+                    'command "{}" timed out after {}s'.format(
+                        failed.command, self.timeout))
+            raise RuntimeError('command "{}" returned with {}'.format(
+                failed.command, failed.returncode))
+
+        return results
+
+    def _launch(self, index, command, stdin):
+        job = subprocess.Popen(
+            shlex.split(command),
+            stdin=stdin,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=self.cwd, env=self.env,
+            preexec_fn=os.setsid)
+        return _Child(index, command, job)
+
+    def _read(self, running):
+        """Wait for outputs of the `running` commands and buffer them"""
+        children = {c.fd: c for c in running if not c.eof}
+        if not children:
+            time.sleep(self.poll_interval)
+            return
+
+        try:
+            ready, _, _ = select.select(
+                children.keys(), [], [], self.poll_interval)
+        except select.error as err:
+            if err.args[0] == errno.EINTR:
+                return
+            raise
+
+        for fd in ready:
+            child = children[fd]
+            try:
+                data = os.read(fd, self.flush_size)
+            except OSError as err:
+                if err.errno in (errno.EAGAIN, errno.EINTR):
+                    continue
+                raise
+
+            if data:
+                child.buffer.append(data)
+                child.buffered += len(data)
+            else:
+                child.eof = True
+
+        now = time.time()
+        for child in running:
+            if (child.buffered >= self.flush_size or
+                    now - child.flushed >= self.flush_interval):
+                self._flush(child, now)
+
+    def _flush(self, child, now, final=False):
+        """Forward the complete lines buffered by `child` to stdout
+
+        When `final` is True, forward the whole buffer followed by a
+        newline.
+
+        """
+        child.flushed = now
+        data = ''.join(child.buffer)
+        end = len(data) if final else data.rfind('\n') + 1
+
+        child.buffer = [data[end:]]
+        child.buffered = len(data) - end
+        if self.monitor is not None and end:
+            self.monitor.output(data[:end])
+        if final:
+            self.stdout(data + '\n')
+        elif end:
+            self.stdout(data[:end])
+
+    def _check_timeouts(self, running):
+        now = time.time()
+        for child in running:
+            if child.status is not None:
+                continue
+            if (self.timeout is not None and child.killed is None and
+                    now - child.start > self.timeout):
+                child.timed_out = True
+                child.killed = now
+                child.kill(signal.SIGTERM)
+            elif (child.killed is not None and
+                  now - child.killed > self.kill_delay):
+                child.kill(signal.SIGKILL)
+
+    @staticmethod
+    def _cancel(running, sig=signal.SIGTERM):
+        """Send `sig` to the `running` commands
+
+        A command still running `kill_delay` seconds after SIGTERM is
+        killed with SIGKILL by _check_timeouts().
+
+        """
+        now = time.time()
+        for child in running:
+            if child.status is None and (
+                    child.killed is None or sig == signal.SIGKILL):
+                child.killed = now
+                child.kill(sig)
+
+    def _reap(self, running, block=False):
+        """Return the commands terminated with their output consumed"""
+        now = time.time()
+        terminated = []
+        for child in running:
+            if child.status is None:
+                pid, status, rusage = os.wait4(
+                    child.job.pid, 0 if block else os.WNOHANG)
+                if pid == 0:
+                    continue
+
+                child.status, child.rusage, child.ended = (
+                    status, rusage, now)
+                # the process is reaped with os.wait4, not by the
+                # Popen instance
+                child.job.returncode = child.returncode
+
+            # children of the command may keep the pipe open, so do
+            # not wait its end of file forever
+            if block or child.eof or now - child.ended > self.exit_delay:
+                self._flush(child, now, final=True)
+                child.job.stdout.close()
+                terminated.append(child)
+
+        return terminated
@@ -0,0 +1,436 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkahzia. If not, see <http://www.gnu.org/licenses/>.
+"""A local job scheduler, replacement of the Kaldi utils/run.pl script
+
+The Kaldi run.pl script forks all the JOB=1:N tasks at once,
+regardless of the memory they need. The LocalScheduler class runs
+them through a bounded pool instead: at most `max_jobs` CPU slots and
+`max_memory` bytes are used at once. Failed tasks can be retried and
+the wall time, CPU time and peak memory of each task are reported.
+
+The scheduler is usable from the command line as a drop-in
+replacement of run.pl, with the 'abkhazia-run' command. To use it in
+the abkhazia recipes, edit the 'kaldi' section of the abkhazia
+configuration file as follow:
+
+  train-cmd: abkhazia-run --max-jobs 8
+  decode-cmd: abkhazia-run --max-jobs 8
+  highmem-cmd: abkhazia-run --max-jobs 2 --max-memory 32G
+
+The command line usage is the same as run.pl:
+
+  abkhazia-run [options] [JOB=1:N] <log-file> <command> [<args>...]
+
+The 'JOB' string is replaced by the task index in <log-file> and
+<command>. The options --max-jobs, --max-memory and --retries
+configure the scheduler. With --backend <name>, the tasks are
+submitted to a job backend instead of the local pool (see
+abkhazia.utils.jobs.backends). The options --num-threads and --mem (the
+memory required by each task, e.g. 2G) are the ones passed by the
+Kaldi scripts to queue.pl. Any other option (--gpu, --config, etc.)
+is ignored, as in run.pl.
+
+"""
+
+import datetime
+import multiprocessing
+import os
+import re
+import subprocess
+import sys
+import time
+
+
+def parse_job_range(arg):
+    """Parse a 'JOB=1:N' job range specification
+
+    Return a tuple (name, first, last), e.g. ('JOB', 1, N), or None
+    if `arg` is not a job range.
+
+    Raise ValueError if first > last
+
+    """
+    matched = re.match(r'^([\w_][\w\d_]*)=(\d+):(\d+)$', arg)
+    if not matched:
+        return None
+
+    name, first, last = (
+        matched.group(1), int(matched.group(2)), int(matched.group(3)))
+    if first > last:
+        raise ValueError('invalid job range {}'.format(arg))
+    return name, first, last
+
+
+def parse_memory(value):
+    """Convert a memory specification such as '2G' or '500M' to bytes"""
+    matched = re.match(r'^([\d.]+)\s*([kKmMgGtT]?)[bB]?$', str(value).strip())
+    if not matched:
+        raise ValueError('invalid memory specification: {}'.format(value))
+
+    factor = {'': 1, 'k': 2**10, 'm': 2**20, 'g': 2**30, 't': 2**40}
+    return int(float(matched.group(1)) * factor[matched.group(2).lower()])
+
+
+def available_memory():
+    """Return the memory available on the system in bytes
+
+    Read MemAvailable from /proc/meminfo, if not found return the
+    total physical memory.
+
+    """
+    try:
+        for line in open('/proc/meminfo', 'r'):
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def quote_command(args):
+    """Join command line arguments in a bash command, as run.pl does
+
+    Arguments without white spaces are copied as is (so that '|' is
+    a pipe), others are quoted with double quotes, or single quotes
+    if they contain double quotes.
+
+    """
+    quoted = []
+    for arg in args:
+        if re.match(r'^\S+$', arg):
+            quoted.append(arg)
+        elif '"' in arg:
+            quoted.append("'{}'".format(arg))
+        else:
+            quoted.append('"{}"'.format(arg))
+    return ' '.join(quoted)
+
+
+class Task(object):
+    """A bash command to be executed with its output sent to a log file
+
+    command (str): the command, interpreted by bash
+
+    log_file (str): the file where to write the command output
+
+    index (int): optional index of the task in a job range
+
+    memory (int): memory required by the task in bytes, default to 0
+
+    threads (int): number of CPU cores required by the task, default
+      to 1
+
+    depends (list of Task): tasks that must be completed successfully
+      before this one is launched, default to none
+
+    """
+    def __init__(self, command, log_file, index=None, memory=0, threads=1,
+                 depends=()):
+        self.command = command
+        self.log_file = log_file
+        self.index = index
+        self.memory = memory
+        self.threads = threads
+        self.depends = list(depends)
+
+    @classmethod
+    def expand(cls, command, log_file, job_range=None, **kwargs):
+        """Return a list of tasks from a job range specification
+
+        `job_range` is a tuple (name, first, last) as returned by
+        parse_job_range(). The string `name` is replaced by the task
+        index in both `command` and `log_file`. If `job_range` is
+        None, return a single task.
+
+        """
+        if job_range is None:
+            return [cls(command, log_file, **kwargs)]
+
+        name, first, last = job_range
+        return [cls(command.replace(name, str(n)),
+                    log_file.replace(name, str(n)),
+                    index=n, **kwargs)
+                for n in range(first, last + 1)]
+
+
+class TaskResult(object):
+    """Execution report of a Task
+
+    task (Task): the executed task
+
+    returncode (int): exit code of the task, None if the task has not
+      been launched because one of its dependencies failed
+
+    wall (float): elapsed time in seconds
+
+    cpu (float): user and system CPU time of the task in seconds
+
+    maxrss (int): peak resident memory of the task in kB
+
+    attempts (int): number of times the task has been run
+
+    """
+    def __init__(self, task, returncode, wall, cpu, maxrss, attempts=1):
+        self.task = task
+        self.returncode = returncode
+        self.wall = wall
+        self.cpu = cpu
+        self.maxrss = maxrss
+        self.attempts = attempts
+
+    @property
+    def failed(self):
+        return self.returncode != 0
+
+
+class LocalScheduler(object):
+    """Run tasks locally through a bounded pool of processes
+
+    max_jobs (int): maximum number of CPU slots used at once, default
+      is the number of CPU cores
+
+    max_memory (int): maximum memory (in bytes) required by the tasks
+      running at once, default is the available memory on the system
+
+    cwd (str): working directory of the tasks, default to current
+      directory
+
+    env (dict): environment of the tasks, default to os.environ
+
+    A task requiring more slots or memory than available is run alone
+    rather than never. A task is launched only when all its
+    dependencies are completed, the tasks depending on a failed one
+    are never launched.
+
+    """
+    poll_interval = 0.05
+    """Seconds to wait between two polls of the running tasks"""
+
+    def __init__(self, max_jobs=None, max_memory=None, cwd=None, env=None):
+        self.max_jobs = max_jobs or multiprocessing.cpu_count()
+        self.max_memory = max_memory or available_memory()
+        self.cwd = cwd
+        self.env = env
+
+    def run(self, tasks, retries=0):
+        """Run the `tasks` and return their results
+
+        Each failed task is run again up to `retries` times, only the
+        failed ones are retried. Return a list of TaskResult, in the
+        order of the `tasks`. Raise RuntimeError if the dependencies
+        of the tasks are cyclic.
+
+        """
+        results = {}
+        pending = list(tasks)
+        for attempt in range(1, retries + 2):
+            for result in self._run_pool(pending, attempt):
+                results[id(result.task)] = result
+
+            pending = [t for t in pending if results[id(t)].failed]
+            if not pending:
+                break
+
+        return [results[id(t)] for t in tasks]
+
+    def _run_pool(self, tasks, attempt):
+        """Run the `tasks` once, never exceeding the pool limits"""
+        pending = list(tasks)
+        running = {}
+        results = []
+
+        # the dependencies out of `tasks` are already completed
+        pool = set(id(t) for t in tasks)
+        finished = {}
+
+        while pending or running:
+            # a task depending on a failed one is never launched
+            for task in [t for t in pending if any(
+                    id(d) in finished and finished[id(d)].failed
+                    for d in t.depends)]:
+                pending.remove(task)
+                result = TaskResult(task, None, 0, 0, 0, attempts=attempt)
+                finished[id(task)] = result
+                results.append(result)
+
+            # launch as many ready tasks as the pool allows, in order
+            ready = [t for t in pending if all(
+                id(d) not in pool or id(d) in finished
+                for d in t.depends)]
+            if pending and not ready and not running:
+                raise RuntimeError('cyclic dependencies between tasks')
+
+            for task in ready:
+                if not self._can_launch(task, running):
+                    break
+                pending.remove(task)
+                running[self._launch(task, attempt)] = (task, time.time())
+
+            # collect the terminated tasks
+            reaped = False
+            for pid in list(running.keys()):
+                _pid, status, rusage = os.wait4(pid, os.WNOHANG)
+                if _pid == 0:
+                    continue
+
+                task, start = running.pop(pid)
+                result = self._terminate(task, start, status, rusage, attempt)
+                finished[id(task)] = result
+                results.append(result)
+                reaped = True
+
+            if not reaped:
+                time.sleep(self.poll_interval)
+
+        return results
+
+    def _can_launch(self, task, running):
+        """Return True if the pool has room for `task`"""
+        if not running:
+            return True
+
+        slots = sum(t.threads for t, _ in running.itervalues())
+        memory = sum(t.memory for t, _ in running.itervalues())
+        return (slots + task.threads <= self.max_jobs and
+                memory + task.memory <= self.max_memory)
+
+    def _launch(self, task, attempt):
+        """Start `task` as a subprocess and return its pid"""
+        log_dir = os.path.dirname(task.log_file)
+        if log_dir and not os.path.isdir(log_dir):
+            os.makedirs(log_dir)
+
+        with open(task.log_file, 'w') as log:
+            log.write('# {}\n'.format(task.command))
+            log.write('# Started at {}{}\n'.format(
+                _now(), '' if attempt == 1 else ' (attempt {})'.format(
+                    attempt)))
+            log.flush()
+
+            job = subprocess.Popen(
+                ['bash', '-c', task.command],
+                stdout=log, stderr=subprocess.STDOUT,
+                cwd=self.cwd, env=self.env)
+
+        # the process is reaped with os.wait4, not by the Popen
+        # instance, so we keep only its pid
+        job.returncode = 0
+        return job.pid
+
+    @staticmethod
+    def _terminate(task, start, status, rusage, attempt):
+        """Write accounting to the task log and return its TaskResult"""
+        wall = time.time() - start
+        returncode = (os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                      else -os.WTERMSIG(status))
+
+        result = TaskResult(
+            task, returncode, wall,
+            rusage.ru_utime + rusage.ru_stime, rusage.ru_maxrss,
+            attempts=attempt)
+
+        with open(task.log_file, 'a') as log:
+            log.write(
+                '# Accounting: time={} threads={} cpu={:.2f} maxrss={}\n'
+                .format(int(round(wall)), task.threads,
+                        result.cpu, result.maxrss))
+            log.write('# Ended (code {}) at {}\n'.format(returncode, _now()))
+
+        return result
+
+
+def _now():
+    return datetime.datetime.now().strftime('%a %b %d %H:%M:%S %Y')
+
+
+def _parse_arguments(argv):
+    """Parse run.pl-like arguments, return (options, job_range, log, cmd)
+
+    Raise ValueError on invalid arguments
+
+    """
+    options = {'max-jobs': None, 'max-memory': None, 'retries': 0,
+               'num-threads': 1, 'mem': 0, 'backend': None}
+    argv = list(argv)
+
+    while argv and argv[0].startswith('-'):
+        option = argv.pop(0)
+        if option == '-V':  # exports the environment in queue.pl
+            continue
+        if not argv:
+            raise ValueError('missing value for option {}'.format(option))
+
+        value = argv.pop(0)
+        if option in ('-tc', '--max-jobs-run', '--max-jobs'):
+            # limit the number of jobs running at once for this call
+            options['max-jobs'] = min(
+                int(value), options['max-jobs'] or int(value))
+        elif option.lstrip('-') in options:
+            options[option.lstrip('-')] = value
+        # else the option is ignored, as in run.pl
+
+    job_range = parse_job_range(argv[0]) if argv else None
+    if job_range:
+        argv.pop(0)
+
+    if len(argv) < 2:
+        raise ValueError('usage: abkhazia-run [options] [JOB=1:N] '
+                         '<log-file> <command> [<args>...]')
+
+    return options, job_range, argv[0], quote_command(argv[1:])
+
+
+def main(argv=None):
+    """Entry point of the abkhazia-run command, a replacement of run.pl"""
+    try:
+        options, job_range, log_file, command = _parse_arguments(
+            sys.argv[1:] if argv is None else argv)
+
+        tasks = Task.expand(
+            command, log_file, job_range,
+            memory=parse_memory(options['mem']),
+            threads=int(options['num-threads']))
+
+        if options['backend']:
+            # execution delegated to a job backend, local limits
+            # are not applied
+            from abkhazia.utils.jobs import backends
+            scheduler = backends.get_backend(options['backend'])
+        else:
+            scheduler = LocalScheduler(
+                max_jobs=options['max-jobs'],
+                max_memory=(parse_memory(options['max-memory'])
+                            if options['max-memory'] else None))
+    except (ValueError, RuntimeError) as err:
+        sys.stderr.write('abkhazia-run: {}\n'.format(err))
+        sys.exit(1)
+
+    results = scheduler.run(tasks, retries=int(options['retries']))
+
+    failed = [r for r in results if r.failed]
+    if failed:
+        if len(results) == 1:
+            sys.stderr.write('abkhazia-run: job failed, log is in {}\n'
+                             .format(failed[0].task.log_file))
+        else:
+            sys.stderr.write(
+                'abkhazia-run: {} / {} failed, log is in {}\n'.format(
+                    len(failed), len(results), log_file))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
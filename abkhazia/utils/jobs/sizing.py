@@ -0,0 +1,177 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Choose the number of jobs of a stage given the available memory
+
+The peak memory of a Kaldi job is modeled as
+
+  base + coefficient * (model_size + frames * dim * 4) * beam / 13
+
+where `frames` is the number of frames processed by the largest job,
+`dim` the features dimension, `model_size` the size in bytes of the
+models loaded by the job (acoustic model, decoding graph) and `beam`
+the decoding beam (13 being the Kaldi default).
+
+The coefficient is specific to a stage of a recipe, identified by a
+key such as 'Align.align' (the recipe class and the stage name). It
+is calibrated on the peak memory recorded by the previous runs of the
+stage: the calibration file stores the last coefficients observed for
+each key and the largest one is used, so that the estimation stays
+conservative. Before any calibration, a prior coefficient is used.
+
+"""
+
+import json
+import os
+
+from abkhazia.utils.jobs.scheduler import available_memory
+
+
+def job_frames(durations, njobs):
+    """Return the number of frames processed by the largest job
+
+    `durations` is a dict speaker -> speech duration in seconds, the
+    speakers being split in `njobs` jobs of balanced durations, as
+    done by Abkhazia2Kaldi.setup_split_data.
+
+    """
+    # imported here because abkhazia.kaldi imports abkhazia.utils
+    from abkhazia.kaldi.abkhazia2kaldi import balanced_bins
+
+    njobs = min(njobs, len(durations))
+    return int(100 * max(sum(durations[s] for s in spks)
+                         for spks in balanced_bins(durations, njobs)))
+
+
+class MemoryModel(object):
+    """Estimate the peak memory of the jobs of a stage
+
+    Parameters:
+    -----------
+
+    calibration_file (str): the JSON file where to store the
+      calibrated coefficients, default to
+      ~/.cache/abkhazia/memory.json
+
+    """
+    base = 200 * 2**20
+    """Memory used by a job independently of its inputs, in bytes"""
+
+    default_prior = 2.0
+    """Coefficient of the stages not yet calibrated and without prior"""
+
+    history = 10
+    """Number of coefficients recorded for each stage"""
+
+    def __init__(self, calibration_file=None):
+        self.calibration_file = calibration_file or os.path.join(
+            os.path.expanduser('~'), '.cache', 'abkhazia', 'memory.json')
+
+        try:
+            self.coefficients = json.load(open(self.calibration_file, 'r'))
+        except (IOError, ValueError):
+            self.coefficients = {}
+
+    def coefficient(self, key, prior=None):
+        """Return the coefficient of the stage `key`
+
+        Return the `prior` if the stage is not yet calibrated, or
+        `default_prior` if None.
+
+        """
+        if self.coefficients.get(key):
+            return max(self.coefficients[key])
+        return prior or self.default_prior
+
+    @staticmethod
+    def _predictor(frames, dim, model_size=0, beam=None):
+        return (model_size + frames * dim * 4.0) * (
+            beam / 13.0 if beam else 1.0)
+
+    def estimate(self, key, frames, dim, model_size=0, beam=None,
+                 prior=None):
+        """Return the estimated peak memory of a job in bytes
+
+        `frames` is the number of frames processed by the job, the
+        other parameters are described in the module documentation.
+
+        """
+        return int(self.base + self.coefficient(key, prior) * (
+            self._predictor(frames, dim, model_size, beam)))
+
+    def calibrate(self, key, frames, dim, maxrss, model_size=0, beam=None):
+        """Record the peak memory `maxrss` (in kB) of a job of `key`
+
+        The calibration file is updated.
+
+        """
+        predictor = self._predictor(frames, dim, model_size, beam)
+        if predictor <= 0 or maxrss <= 0:
+            return
+
+        coefficient = max(0, maxrss * 1024.0 - self.base) / predictor
+        self.coefficients[key] = (
+            self.coefficients.get(key, []) + [coefficient])[-self.history:]
+
+        directory = os.path.dirname(self.calibration_file)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # atomic write, concurrent recipes may update the file
+        tmp = self.calibration_file + '.tmp.{}'.format(os.getpid())
+        with open(tmp, 'w') as out:
+            json.dump(self.coefficients, out, indent=2)
+        os.rename(tmp, self.calibration_file)
+
+    def njobs(self, key, durations, dim, max_jobs, model_size=0,
+              beam=None, memory=None, prior=None):
+        """Return the number of jobs of the stage `key` fitting in `memory`
+
+        Parameters:
+        -----------
+
+        key (str): the stage identifier, as 'Align.align'
+
+        durations (dict): speaker -> speech duration in seconds, the
+          speakers being split in jobs of balanced durations
+
+        dim (int): the features dimension
+
+        max_jobs (int): the maximum number of jobs, usually the number
+          of CPU cores
+
+        model_size (int): the size of the models loaded by a job, in
+          bytes
+
+        beam (float): the decoding beam, if any
+
+        memory (int): the memory available in bytes, default to the
+          available memory of the system
+
+        prior (float): the coefficient used if the stage is not yet
+          calibrated
+
+        Return the largest number of jobs in [1, `max_jobs`] such as
+        the jobs running at once fit in memory, or 1.
+
+        """
+        memory = memory or available_memory()
+        max_jobs = min(max_jobs, len(durations))
+
+        for njobs in range(max_jobs, 1, -1):
+            if njobs * self.estimate(
+                    key, job_frames(durations, njobs), dim,
+                    model_size, beam, prior) <= memory:
+                return njobs
+        return 1
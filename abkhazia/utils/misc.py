@@ -22,16 +22,37 @@ import re
 import config  # this is abkhazia.utils.config
 
 
-def default_njobs(nj_queue=20, local=False):
-    """Return `nj_queue` if running on a queue, ncores if running locally
+def default_njobs(local=False):
+    """Return the number of jobs the job backend can run at once
 
-    Default for `nj_queue` is 20, the standard number of jobs for
-    features computation in the kaldi WSJ recipe.
+    If `local` is True, return the number of cores on the local
+    machine, else return the capacity of the job backend defined in
+    the configuration file (see abkhazia.utils.jobs.backends).
 
     """
-    cmd = config.config.get('kaldi', 'train-cmd')
-    return (nj_queue if not local and 'queue' in cmd
-            else multiprocessing.cpu_count())
+    if local:
+        return multiprocessing.cpu_count()
+
+    import jobs  # this is abkhazia.utils.jobs, imported after misc
+    return jobs.get_backend().capacity()
+
+
+def kaldi_cmd(name='train', direct=False):
+    """Return the job dispatcher command `name` from the configuration
+
+    `name` is 'train', 'decode' or 'highmem', as in the [kaldi]
+    section of the configuration file (e.g. 'run.pl' for train-cmd).
+
+    If `direct` is True, the command is meant to be executed from the
+    recipe directory (and not passed to a Kaldi script with --cmd),
+    so Kaldi dispatchers such as run.pl or queue.pl are prefixed by
+    'utils/'. Others (such as abkhazia-run) are returned as is.
+
+    """
+    cmd = config.config.get('kaldi', '{}-cmd'.format(name))
+    if direct and cmd.split(' ')[0].endswith('.pl'):
+        cmd = 'utils/' + cmd
+    return cmd
 
 
 def str2bool(s, safe=False):
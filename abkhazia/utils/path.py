@@ -82,6 +82,32 @@ def remove(path, safe=False):
             pass
 
 
+def free_space(path):
+    """Return the space available to the user on the disk of `path`
+
+    The free space is returned in bytes. `path` must exist.
+
+    """
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def directory_size(path):
+    """Return the size in bytes of the files in `path`, recursively
+
+    Symbolic links are not followed.
+
+    """
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
 def is_empty_file(path):
     """Return True if the file `path` is empty"""
     return os.stat(path).st_size == 0
@@ -0,0 +1,186 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the Profiler class recording resources used by recipes
+
+For each stage of a recipe, the profiler records the wall time, the
+CPU time of the child processes and their peak resident memory. The
+commands executed during the stage are recorded as well, along with
+the JOB level timings read from the Kaldi log files (the ones named
+'<name>.<job>.log' written by run.pl, queue.pl or abkhazia-run).
+
+The profile is saved as a JSON file and summarized as a table.
+
+"""
+
+import contextlib
+import json
+import os
+import re
+import resource
+import time
+
+
+_JOB_LOG = re.compile(r'^(.+)\.(\d+)\.log$')
+
+_ACCOUNTING = re.compile(
+    r'^# Accounting: time=(\d+) threads=(\d+)'
+    r'(?: cpu=([\d.]+) maxrss=(\d+))?')
+
+
+def _children_cpu():
+    """Return the CPU time of the terminated child processes"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def read_job_logs(directory, since=0):
+    """Aggregate the JOB level timings from Kaldi logs in `directory`
+
+    Look recursively for log files named '<name>.<job>.log' modified
+    after the timestamp `since`, read the accounting line written at
+    their end by the job dispatcher and aggregate the timings for each
+    <name>.
+
+    Return a dict name -> {'njobs', 'total', 'max', 'cpu', 'maxrss'}
+    where times are in seconds and maxrss in kB. 'cpu' and 'maxrss'
+    are only reported by abkhazia-run, they are 0 otherwise.
+
+    """
+    jobs = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            matched = _JOB_LOG.match(name)
+            if not matched:
+                continue
+
+            path = os.path.join(root, name)
+            if os.path.getmtime(path) < since:
+                continue
+
+            accounting = None
+            for line in open(path, 'r'):
+                if line.startswith('# Accounting:'):
+                    accounting = _ACCOUNTING.match(line)
+            if accounting is None:
+                continue
+
+            key = os.path.join(
+                os.path.relpath(root, directory), matched.group(1))
+            job = jobs.setdefault(
+                key, {'njobs': 0, 'total': 0, 'max': 0, 'cpu': 0,
+                      'maxrss': 0})
+
+            wall = int(accounting.group(1))
+            job['njobs'] += 1
+            job['total'] += wall
+            job['max'] = max(job['max'], wall)
+            if accounting.group(3) is not None:
+                job['cpu'] += float(accounting.group(3))
+                job['maxrss'] = max(
+                    job['maxrss'], int(accounting.group(4)))
+    return jobs
+
+
+class Profiler(object):
+    """Record the resources used by the stages of a recipe
+
+    Attributes:
+    -----------
+
+    stages (list of dict): the recorded stages, in execution order.
+      Each stage has the entries 'name', 'skipped', 'wall' and 'cpu'
+      (in seconds), 'maxrss' (in kB), 'commands' (a list of dict with
+      'command', 'wall', 'cpu' and 'maxrss') and 'jobs' (as returned
+      by read_job_logs)
+
+    """
+    def __init__(self):
+        self.stages = []
+        self._current = None
+
+    @contextlib.contextmanager
+    def stage(self, name, log_dir=None):
+        """Record the stage `name` executed in the context
+
+        If `log_dir` is specified, the JOB level logs written in it
+        during the stage are aggregated in the stage profile.
+
+        """
+        stage = {'name': name, 'skipped': False, 'wall': 0, 'cpu': 0,
+                 'maxrss': 0, 'commands': [], 'jobs': {}}
+        self.stages.append(stage)
+        previous, self._current = self._current, stage
+
+        start, cpu = time.time(), _children_cpu()
+        try:
+            yield stage
+        finally:
+            stage['wall'] = time.time() - start
+            stage['cpu'] = _children_cpu() - cpu
+            if log_dir is not None:
+                # mtime resolution can be 1s on some file systems
+                stage['jobs'] = read_job_logs(log_dir, since=int(start))
+            self._current = previous
+
+    def skip(self, name):
+        """Record the stage `name` as skipped"""
+        self.stages.append(
+            {'name': name, 'skipped': True, 'wall': 0, 'cpu': 0,
+             'maxrss': 0, 'commands': [], 'jobs': {}})
+
+    def add_command(self, command, stats):
+        """Record a command executed in the current stage
+
+        `stats` is a dict with 'wall', 'cpu' and 'maxrss' entries, as
+        returned by abkhazia.utils.jobs.run(). Commands executed out
+        of any stage are ignored.
+
+        """
+        if self._current is not None and stats is not None:
+            self._current['commands'].append(
+                dict(stats, command=command))
+            self._current['maxrss'] = max(
+                self._current['maxrss'], stats['maxrss'])
+
+    def save(self, path):
+        """Write the profile to `path` in JSON format"""
+        with open(path, 'w') as fout:
+            json.dump({'stages': self.stages}, fout, indent=2)
+
+    def summary(self):
+        """Return the profile as a table (str), a line per stage"""
+        lines = ['{:<20} {:>10} {:>10} {:>10} {:>6} {:>11}'.format(
+            'stage', 'wall (s)', 'cpu (s)', 'rss (MB)', 'jobs',
+            'max job (s)')]
+
+        for stage in self.stages:
+            if stage['skipped']:
+                lines.append('{:<20} {:>10}'.format(
+                    stage['name'], 'skipped'))
+                continue
+
+            jobs = stage['jobs'].values()
+            lines.append(
+                '{:<20} {:>10.1f} {:>10.1f} {:>10.1f} {:>6} {:>11}'.format(
+                    stage['name'], stage['wall'], stage['cpu'],
+                    stage['maxrss'] / 1024.0,
+                    sum(j['njobs'] for j in jobs),
+                    max(j['max'] for j in jobs) if jobs else '-'))
+
+        done = [s for s in self.stages if not s['skipped']]
+        lines.append('{:<20} {:>10.1f} {:>10.1f}'.format(
+            'total', sum(s['wall'] for s in done),
+            sum(s['cpu'] for s in done)))
+        return '\n'.join(lines)
@@ -0,0 +1,310 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Provides the ProgressMonitor class reporting the progress of Kaldi jobs
+
+The monitor tails the Kaldi job logs (named '<name>.<job>.log' or
+'<name>.<iteration>.<job>.log') written while a command is running,
+and the output of the command itself. The logs are looked for only in
+the 'log' subdirectory of the directories named in the command and in
+the directories of the log files named in the command. It counts
+the utterances processed by the jobs, the training iterations, and
+periodically reports the throughput and an estimated time of arrival
+of the most recently active group of jobs. A warning is issued for
+the jobs whose log is not updated for a long time.
+
+Only the bytes appended to the logs since the last report are read,
+so the monitor is cheap enough to run alongside the jobs.
+
+"""
+
+import datetime
+import os
+import re
+import shlex
+import time
+
+from abkhazia.utils.logger import null_logger
+
+
+# the names of the logs written by each job of a Kaldi script or
+# abkhazia recipe, as 'align.JOB.log' or 'acc.<iteration>.JOB.log'.
+# The other logs, as 'update.<iteration>.log', are not per job.
+_JOB_NAMES = (
+    # training, alignment and decoding scripts
+    'acc', 'acc_tree', 'align', r'align_pass\d', 'decode', 'fmllr',
+    r'fmllr_pass\d', 'generate_lattices', 'get_egs', 'shuffle', 'train',
+    # abkhazia recipes
+    'ali-to-phones', 'best_path', 'frame-ali-to-phones', 'paste', 'pitch',
+    'post-on-ali')
+
+_JOB_LOG = re.compile(r'^({})(?:\.(\d+))?\.(\d+)\.log$'.format(
+    '|'.join(_JOB_NAMES)))
+
+# 'Log-like per frame for utterance <utt> is <like> over <n> frames'
+# is written by the Kaldi decoders and aligners for each utterance
+_UTTERANCE = re.compile(r'for utterance \S+ is \S+ over (\d+) frames')
+
+# summaries written by most Kaldi binaries at the end of a job
+_DONE = re.compile(r'\bDone (\d+)\b')
+
+# '--num-iters <n>' option of the training scripts and 'equalling <n>
+# iterations' written by the neural network training scripts
+_NUM_ITERS = re.compile(r'--num-iters[= ](\d+)|equalling (\d+) iterations')
+
+# 'Pass <n>' or 'training pass <n>' written by the training scripts
+_PASS = re.compile(r'[Pp]ass (\d+)')
+
+
+def _format_eta(seconds):
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+class _JobLog(object):
+    """The state of a job log, updated with the lines appended to it"""
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.mtime = 0
+        self.utterances = 0
+        self.done = 0
+        self.frames = 0
+        self.ended = False
+        self.stalled = False
+
+    def update(self, size, mtime):
+        """Parse the lines appended to the log since the last update"""
+        self.mtime = mtime
+        if size <= self.offset:
+            return
+
+        with open(self.path, 'r') as log:
+            log.seek(self.offset)
+            data = log.read(size - self.offset)
+
+        # parse only the complete lines
+        end = data.rfind('\n') + 1
+        self.offset += end
+        for line in data[:end].splitlines():
+            matched = _UTTERANCE.search(line)
+            if matched:
+                self.utterances += 1
+                self.frames += int(matched.group(1))
+                continue
+
+            matched = _DONE.search(line)
+            if matched:
+                self.done = max(self.done, int(matched.group(1)))
+            elif line.startswith('# Ended'):
+                self.ended = True
+
+    @property
+    def processed(self):
+        """Number of utterances processed by the job"""
+        return max(self.utterances, self.done if self.ended else 0)
+
+
+class ProgressMonitor(object):
+    """Report the progress of the Kaldi jobs running in `directory`
+
+    Parameters:
+    -----------
+
+    directory (str): the directory where the command is run, the
+      relative paths in `command` are relative to it
+
+    command (str): the monitored command, parsed for the directories
+      of the job logs and the number of training iterations
+
+    total_utterances (int): the number of utterances processed by a
+      group of jobs, used to estimate their time of arrival
+
+    log (logging.Logger): where to send the progress reports
+
+    """
+    interval = 30
+    """Seconds between two progress reports"""
+
+    stall_delay = 600
+    """Seconds without update before a job is reported as stalled"""
+
+    frame_shift = 0.01
+    """Duration of a frame in seconds, to compute the realtime factor"""
+
+    def __init__(self, directory, command='', total_utterances=None,
+                 log=null_logger()):
+        self.directory = directory
+        self.total_utterances = total_utterances
+        self.log = log
+
+        self.start = time.time()
+        self._last = self.start
+        self._logs = {}
+        self._groups = {}
+        self._started = {}
+        self._iteration = 0
+        self._first_iteration = None
+        self._num_iterations = None
+        self._log_dirs = self._parse_log_dirs(command)
+        self.output(command)
+
+    def _parse_log_dirs(self, command):
+        """Return the candidate directories of the job logs in `command`
+
+        For each path in the command, the 'log' subdirectory of a
+        directory, or the directory of a log file. The directories
+        are not required to exist yet.
+
+        """
+        try:
+            words = shlex.split(command)
+        except ValueError:
+            words = command.split()
+
+        dirs = []
+        for word in words:
+            # as 'JOB=1:4', '--nj' or a quoted --cmd option
+            if '=' in word or word.startswith('-') or ' ' in word:
+                continue
+
+            if word.endswith('.log'):
+                path = os.path.dirname(word)
+            else:
+                path = os.path.join(word, 'log')
+            path = os.path.normpath(os.path.join(self.directory, path))
+            if path not in dirs:
+                dirs.append(path)
+        return dirs
+
+    def output(self, data):
+        """Parse the output of the command for training iterations"""
+        for matched in _NUM_ITERS.finditer(data):
+            self._num_iterations = int(
+                matched.group(1) or matched.group(2))
+        for matched in _PASS.finditer(data):
+            self._set_iteration(int(matched.group(1)))
+
+    def _set_iteration(self, iteration):
+        if self._first_iteration is None:
+            self._first_iteration = (iteration, time.time())
+        self._iteration = max(self._iteration, iteration)
+
+    def poll(self):
+        """Report the progress if the last report is old enough"""
+        now = time.time()
+        if now - self._last < self.interval:
+            return
+        self._scan(since=self._last)
+        self._last = now
+
+        report = self.report(now)
+        if report:
+            self.log.info('progress: %s', report)
+
+        for job in self._logs.itervalues():
+            if (not job.ended and not job.stalled and
+                    now - job.mtime > self.stall_delay):
+                job.stalled = True
+                self.log.warning(
+                    'job log %s not updated for %d s, the job may be '
+                    'stalled', os.path.relpath(job.path, self.directory),
+                    now - job.mtime)
+
+    def _scan(self, since):
+        """Update the job logs modified since the monitor started
+
+        The groups of jobs discovered during that scan are considered
+        started at the previous scan `since`.
+
+        """
+        for root in self._log_dirs:
+            try:
+                files = os.listdir(root)
+            except OSError:  # not yet created
+                continue
+
+            for name in files:
+                matched = _JOB_LOG.match(name)
+                if not matched:
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if stat.st_mtime < self.start:
+                    continue
+
+                if path not in self._logs:
+                    self._logs[path] = _JobLog(path)
+                    group = os.path.join(
+                        os.path.relpath(root, self.directory),
+                        matched.group(1))
+                    if matched.group(2) is not None:
+                        group += '.' + matched.group(2)
+                    self._groups.setdefault(group, []).append(path)
+                    self._started.setdefault(group, since)
+                    if matched.group(2) is not None:
+                        self._set_iteration(int(matched.group(2)))
+
+                job = self._logs[path]
+                if stat.st_mtime != job.mtime or stat.st_size > job.offset:
+                    job.update(stat.st_size, stat.st_mtime)
+
+    def report(self, now=None):
+        """Return a one line report of the progress, or None"""
+        if not self._groups:
+            return None
+        now = now or time.time()
+
+        # report the most recently updated group of jobs
+        group = max(self._groups, key=lambda g: max(
+            self._logs[p].mtime for p in self._groups[g]))
+        jobs = [self._logs[p] for p in self._groups[group]]
+
+        elapsed = max(now - self._started[group], 1e-3)
+        report = ['{}: jobs {}/{} done'.format(
+            group, sum(j.ended for j in jobs), len(jobs))]
+
+        utterances = sum(j.processed for j in jobs)
+        if utterances:
+            report.append('{} utterances'.format(
+                utterances if not self.total_utterances
+                else '{}/{}'.format(utterances, self.total_utterances)))
+            report.append('{:.1f} utt/s'.format(utterances / elapsed))
+
+            frames = sum(j.frames for j in jobs)
+            if frames:
+                report.append('realtime factor {:.3f}'.format(
+                    elapsed / (frames * self.frame_shift)))
+
+            if self.total_utterances and utterances < self.total_utterances:
+                report.append('ETA {}'.format(_format_eta(
+                    (self.total_utterances - utterances)
+                    * elapsed / utterances)))
+
+        if self._iteration:
+            report.append('iteration {}{}'.format(
+                self._iteration, '' if not self._num_iterations
+                else '/{}'.format(self._num_iterations)))
+
+            first, start = self._first_iteration
+            if (self._num_iterations and self._iteration > first and
+                    self._iteration < self._num_iterations):
+                report.append('ETA {}'.format(_format_eta(
+                    (self._num_iterations - self._iteration)
+                    * (now - start) / (self._iteration - first))))
+
+        return ', '.join(report)
@@ -57,7 +57,8 @@ setup(
 
     # define the command-line script to use
     entry_points={'console_scripts': [
-        'abkhazia = abkhazia.commands.abkhazia_main:main']},
+        'abkhazia = abkhazia.commands.abkhazia_main:main',
+        'abkhazia-run = abkhazia.utils.jobs.scheduler:main']},
 
     # metadata for upload to PyPI
     author='Thomas Schatz, Mathieu Bernard, Roland Thiolliere, Xuan-Nga Cao',
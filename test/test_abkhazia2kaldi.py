@@ -0,0 +1,46 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.kaldi.abkhazia2kaldi module"""
+
+import pytest
+
+from abkhazia.kaldi.abkhazia2kaldi import balanced_bins
+
+
+def test_balanced_bins_skewed():
+    # two long speakers and many short ones
+    weights = {'a': 100, 'b': 90}
+    weights.update({'s{}'.format(i): 10 for i in range(19)})
+
+    bins = balanced_bins(weights, 2)
+    assert sorted(sum(bins, [])) == sorted(weights.keys())
+
+    totals = sorted(sum(weights[k] for k in b) for b in bins)
+    assert totals == [190, 190]
+
+
+@pytest.mark.parametrize('nbins', [1, 2, 3, 5])
+def test_balanced_bins_deterministic(nbins):
+    weights = {str(i): 1 + i % 3 for i in range(5)}
+    bins = balanced_bins(weights, nbins)
+    assert bins == balanced_bins(dict(weights), nbins)
+    assert len(bins) == nbins
+    assert all(bins)
+
+
+@pytest.mark.parametrize('nbins', [0, 3])
+def test_balanced_bins_bad(nbins):
+    with pytest.raises(RuntimeError):
+        balanced_bins({'a': 1, 'b': 2}, nbins)
@@ -15,12 +15,15 @@
 """Test of the abkhazia.kaldi.io module"""
 
 import os
+import struct
 
 import h5features as h5f
 import numpy as np
 import pytest
 
 import abkhazia.kaldi.ark as io
+from abkhazia.kaldi.binary_ark import ArkReader, ArkWriter
+from abkhazia.kaldi.scp import ScpReader
 
 
 @pytest.fixture(scope='session')
@@ -81,3 +84,305 @@ def test_h5f_twice(tmpdir, data):
     # test writing in an existing group
     with pytest.raises(AssertionError):
         io.ark_to_h5f([ark], h5file, 'test')
+
+
+def _binary_matrix(key, array, token='FM '):
+    """Return `array` as a binary Kaldi ark entry"""
+    dtype = '<f4' if token == 'FM ' else '<f8'
+    return '{} \0B{}\4{}\4{}{}'.format(
+        key, token, struct.pack('<i', array.shape[0]),
+        struct.pack('<i', array.shape[1]), array.astype(dtype).tostring())
+
+
+def _binary_vector(key, array, token='FV '):
+    dtype = '<f4' if token == 'FV ' else '<f8'
+    return '{} \0B{}\4{}{}'.format(
+        key, token, struct.pack('<i', array.shape[0]),
+        array.astype(dtype).tostring())
+
+
+def test_binary_reader(tmpdir, data):
+    vector = np.arange(7, dtype=np.float64)
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write(_binary_matrix('b', data['test']))
+        fark.write(_binary_matrix('a', data['test2'], token='DM '))
+        fark.write(_binary_vector('v', vector, token='DV '))
+        fark.write(_binary_matrix('empty', np.zeros((0, 0))))
+
+    with ArkReader(ark) as reader:
+        assert reader.keys() == ['b', 'a', 'v', 'empty']
+        assert 'v' in reader and len(reader) == 4
+        assert reader['b'].dtype == np.float32
+        assert np.allclose(reader['b'], data['test'], atol=1e-7)
+        assert np.array_equal(reader['a'], data['test2'])
+        assert np.array_equal(reader['v'], vector)
+        assert reader['empty'].shape == (0, 0)
+
+    assert np.array_equal(io.ark_to_dict(ark)['a'], data['test2'])
+
+
+@pytest.mark.parametrize('token', ['CM2 ', 'CM3 '])
+def test_binary_reader_linear_compression(tmpdir, token):
+    ark = os.path.join(str(tmpdir), 'ark')
+    values, dtype = (
+        ([0, 65535, 32768, 1], '<u2') if token == 'CM2 '
+        else ([0, 255, 128, 1], 'u1'))
+    with open(ark, 'wb') as fark:
+        fark.write('a \0B' + token + struct.pack('<ffii', -1, 2, 2, 2))
+        fark.write(np.array(values, dtype=dtype).tostring())
+
+    expected = -1 + 2 * np.array(values, dtype=float) / values[1]
+    with ArkReader(ark) as reader:
+        assert np.allclose(reader['a'].ravel(), expected, atol=1e-6)
+
+
+def test_binary_reader_cm(tmpdir):
+    # a single column 0 - 0.25 - 0.75 - 1 with values on each piece
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write('a \0BCM ' + struct.pack('<ffii', 0, 1, 4, 1))
+        fark.write(struct.pack('<4H', 0, 16384, 49151, 65535))
+        fark.write(np.array([0, 32, 128, 255], dtype=np.uint8).tostring())
+
+    with ArkReader(ark) as reader:
+        assert np.allclose(
+            reader['a'].ravel(), [0, 0.125, 0.5, 1], atol=1e-4)
+
+
+def test_binary_reader_bad_type(tmpdir):
+    ark = os.path.join(str(tmpdir), 'ark')
+    with open(ark, 'wb') as fark:
+        fark.write('a \0BXX \4' + struct.pack('<i', 1))
+
+    with pytest.raises(IOError):
+        ArkReader(ark)
+
+
+def test_scp_reader(tmpdir, data):
+    # two arks indexed by a single scp
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    with open(scp, 'w') as fscp:
+        for n, key in enumerate(sorted(data.keys()), 1):
+            ark = os.path.join(str(tmpdir), 'raw.{}.ark'.format(n))
+            with open(ark, 'wb') as fark:
+                fark.write(_binary_matrix('dummy', np.zeros((1, 1))))
+                offset = fark.tell() + len(key) + 1
+                fark.write(_binary_matrix(key, data[key]))
+            fscp.write('{} {}:{}\n'.format(key, ark, offset))
+
+    # a cache able to store a single array
+    with ScpReader(scp, max_open_files=1,
+                   cache_size=data['test'].size * 4) as reader:
+        assert reader.keys() == ['test', 'test2']
+        for _ in range(2):
+            for key in ('test', 'test2', 'test'):
+                assert np.allclose(reader[key], data[key], atol=1e-7)
+        assert len(reader._arks) == 1
+        assert reader._cache.keys() == ['test']
+        assert not reader['test'].flags.writeable
+
+
+def test_scp_reader_bad_line(tmpdir):
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    open(scp, 'w').write('utt raw.1.ark\n')
+    with pytest.raises(IOError):
+        ScpReader(scp)
+
+
+def test_binary_writer(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'ark')
+    scp = os.path.join(str(tmpdir), 'scp')
+    vector = np.arange(5, dtype=np.float32)
+    with ArkWriter(ark, scp) as writer:
+        writer.write('a', data['test'])
+        writer.write('v', vector)
+        writer.write('i', np.ones((2, 3), dtype=int))
+        with pytest.raises(IOError):
+            writer.write('a b', vector)
+
+    with ScpReader(scp) as reader:
+        assert reader.keys() == ['a', 'v', 'i']
+        assert reader.shape('a') == data['test'].shape
+        assert reader.shape('v') == (5,)
+        assert not reader._cache
+        assert reader['a'].dtype == np.float64
+        assert np.array_equal(reader['a'], data['test'])
+        assert np.array_equal(reader['v'], vector)
+        assert np.array_equal(reader['i'], np.ones((2, 3)))
+
+    # the ark is exactly the one built by hand
+    assert open(ark, 'rb').read().startswith(
+        _binary_matrix('a', data['test'], token='DM '))
+
+
+@pytest.mark.parametrize('shape', [(100, 13), (5, 3), (0, 0), (20, 1)])
+def test_binary_writer_compress(tmpdir, shape):
+    array = np.random.normal(size=shape) * 10
+    ark = os.path.join(str(tmpdir), 'ark')
+    with ArkWriter(ark, ark + '.scp', compress=True) as writer:
+        writer.write('a', array)
+        writer.write('c', np.ones(shape))
+
+    with ArkReader(ark) as reader:
+        assert reader['a'].shape == shape
+        assert reader['c'].shape == shape
+    with ScpReader(ark + '.scp') as reader:
+        assert reader.shape('a') == shape
+        if array.size:
+            # 8 bits quantization on each column piece
+            error = np.abs(reader['a'] - array).max()
+            assert error <= (array.max() - array.min()) / 64.0
+            assert np.allclose(reader['c'], 1, atol=1e-3)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 2**24])
+def test_text_parser(tmpdir, data, chunk_size):
+    ark = os.path.join(str(tmpdir), 'ark')
+    io.dict_to_ark(ark, data)
+    with open(ark, 'a') as fark:
+        fark.write('vector  [ 1 2.5 -3e-2 ]\n')
+
+    parsed = dict(io._yield_utt(ark, chunk_size=chunk_size))
+    assert sorted(parsed.keys()) == ['test', 'test2', 'vector']
+    assert np.array_equal(parsed['vector'], [1, 2.5, -0.03])
+    for key in data.keys():
+        assert np.allclose(parsed[key], data[key], rtol=0, atol=1e-7)
+
+
+@pytest.mark.parametrize('content', [
+    'a  [\n  1 2 \n  3 x ]\n', 'a  [\n  1 2 \n  3 4 \n'])
+def test_text_parser_bad(tmpdir, content):
+    ark = os.path.join(str(tmpdir), 'ark')
+    open(ark, 'w').write(content)
+    with pytest.raises((IOError, ValueError)):
+        io.ark_to_dict(ark)
+
+
+@pytest.mark.parametrize('njobs', [1, 2])
+def test_h5f_streaming(tmpdir, data, njobs):
+    arks = []
+    for n in range(3):
+        ark = os.path.join(str(tmpdir), 'raw.{}.ark'.format(n))
+        io.dict_to_ark(
+            ark, {'{}_{}'.format(k, n): v for k, v in data.iteritems()},
+            format='binary')
+        arks.append(ark)
+
+    # chunks of a single utterance, segments for a single utterance
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.ark_to_h5f(arks, h5file, 'test', buffer_size=1e-3, njobs=njobs,
+                  segments={'test_1': ('wav', 2.0, 3.0),
+                            'test2_1': ('wav', None, None)})
+
+    data2 = h5f.Reader(h5file, 'test').read()
+    assert len(data2.items()) == 6
+    for n in range(3):
+        for k, v in data.iteritems():
+            assert np.allclose(
+                data2.dict_features()['{}_{}'.format(k, n)], v)
+
+    times = data2.dict_labels()
+    assert times['test_0'][0] == pytest.approx(0.0125)
+    assert times['test2_1'][0] == pytest.approx(0.0125)
+    assert times['test_1'][0] == pytest.approx(2.0125)
+    assert times['test_1'][-1] == pytest.approx(2.0125 + 0.99)
+
+
+def test_scp_to_h5f_unreferenced(tmpdir, data):
+    # utterances in the ark but not in the scp are not converted
+    ark = os.path.join(str(tmpdir), 'raw.1.ark')
+    scp = os.path.join(str(tmpdir), 'raw.1.scp')
+    io.dict_to_ark(ark, data, format='binary')
+    with open(scp, 'w') as fscp:
+        fscp.write('test {}:5\n'.format(ark))
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.scp_to_h5f(scp, h5file, 'test')
+    assert h5f.Reader(h5file, 'test').read().items() == ['test']
+
+
+def test_scp_to_h5f_changed(tmpdir, data):
+    # 'test' has been recomputed in another ark, its stale copy in the
+    # original ark is not converted
+    raw = os.path.join(str(tmpdir), 'raw.1.ark')
+    inc = os.path.join(str(tmpdir), 'inc.1.ark')
+    scp = os.path.join(str(tmpdir), 'feats.scp')
+    io.dict_to_ark(raw, data, format='binary')
+    io.dict_to_ark(inc, {'test': data['test'] + 1}, format='binary')
+
+    offsets = ArkReader(raw).index
+    with open(scp, 'w') as fscp:
+        fscp.write('test {}:5\n'.format(inc))
+        fscp.write('test2 {}:{}\n'.format(raw, offsets['test2']))
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.scp_to_h5f(scp, h5file, 'test')
+    features = h5f.Reader(h5file, 'test').read().dict_features()
+    assert sorted(features.keys()) == ['test', 'test2']
+    assert np.allclose(features['test'], data['test'] + 1)
+    assert np.allclose(features['test2'], data['test2'])
+
+
+def test_h5f_vad(tmpdir, data):
+    ark = os.path.join(str(tmpdir), 'raw.1.ark')
+    data['test2'] = data['test2'][:3]
+    io.dict_to_ark(ark, data, format='binary')
+
+    # test is restricted to voiced frames, test2 is already restricted
+    vad = {'test': np.zeros(100), 'test2': np.zeros(10)}
+    vad['test'][[10, 20, 21]] = 1
+    vad['test2'][[0, 5, 9]] = 1
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.ark_to_h5f([ark], h5file, 'test', vad=vad)
+    data2 = h5f.Reader(h5file, 'test').read()
+    assert np.allclose(data2.dict_features()['test'],
+                       data['test'][[10, 20, 21]])
+    assert np.allclose(data2.dict_features()['test2'], data['test2'])
+    assert np.allclose(data2.dict_labels()['test'],
+                       0.0125 + np.array([0.1, 0.2, 0.21]))
+    assert np.allclose(data2.dict_labels()['test2'],
+                       0.0125 + np.array([0, 0.05, 0.09]))
+
+
+@pytest.mark.parametrize('dtype, compression', [
+    ('float16', None), ('float32', 'lzf'), (None, 'gzip'), (None, 9)])
+def test_h5f_storage(tmpdir, data, dtype, compression):
+    ark = os.path.join(str(tmpdir), 'raw.1.ark')
+    io.dict_to_ark(ark, data, format='binary')
+
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    io.ark_to_h5f([ark], h5file, 'test', dtype=dtype, compression=compression)
+    data2 = h5f.Reader(h5file, 'test').read().dict_features()
+    for utt in data:
+        assert data2[utt].dtype == (dtype or data[utt].dtype)
+        assert np.allclose(data2[utt], data[utt], atol=1e-3)
+
+
+@pytest.mark.parametrize('utt2job', [None, {'b': 1, 'c': 2, 'a': 2}])
+def test_h5f_to_ark(tmpdir, utt2job):
+    items = ['a', 'b', 'c', 'd']
+    feats = [np.random.random((n, 3)).astype(np.float32)
+             for n in (10, 5, 1, 20)]
+    times = [np.arange(f.shape[0], dtype=float) for f in feats]
+    h5file = os.path.join(str(tmpdir), 'h5f')
+    h5f.Writer(h5file).write(h5f.Data(items, times, feats), 'group')
+
+    output_dir = os.path.join(str(tmpdir), 'feats')
+    scp = io.h5f_to_ark(h5file, output_dir, utt2job=utt2job, njobs=2,
+                        buffer_size=1e-4)
+
+    expected = items if utt2job is None else sorted(utt2job.keys())
+    lines = open(scp, 'r').readlines()
+    assert [l.split()[0] for l in lines] == expected
+    with ScpReader(scp) as reader:
+        for item, feat in zip(items, feats):
+            if item in expected:
+                assert np.array_equal(reader[item], feat)
+
+    # the utterances are in the arks of their job
+    ark1 = os.path.join(output_dir, 'raw_features.1.ark')
+    with ArkReader(ark1) as reader:
+        assert reader.keys() == (
+            ['a', 'b', 'c'] if utt2job is None else ['b'])
@@ -0,0 +1,126 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.checkpoint module"""
+
+import os
+
+import abkhazia.utils as utils
+from abkhazia.abstract_recipe import AbstractRecipe
+from abkhazia.corpus import Corpus
+from abkhazia.utils import checkpoint
+
+
+def test_fingerprint(tmpdir):
+    directory = os.path.join(str(tmpdir), 'inputs')
+    os.makedirs(directory)
+    with open(os.path.join(directory, 'a.txt'), 'w') as fin:
+        fin.write('a\n')
+
+    fp = checkpoint.fingerprint(paths=[directory], params=[1, {'b': 2}])
+    assert fp == checkpoint.fingerprint(
+        paths=[directory, None], params=[1, {'b': 2}])
+    assert fp != checkpoint.fingerprint(
+        paths=[directory], params=[1, {'b': 3}])
+
+    # modify the content of the directory
+    with open(os.path.join(directory, 'a.txt'), 'a') as fin:
+        fin.write('b\n')
+    assert fp != checkpoint.fingerprint(
+        paths=[directory], params=[1, {'b': 2}])
+
+
+def test_stage_markers(tmpdir):
+    markers = checkpoint.StageMarkers(os.path.join(str(tmpdir), 'stages'))
+    assert markers.state('prepare data', 'abc') is None
+
+    markers.start('prepare data', 'abc')
+    assert markers.state('prepare data', 'abc') == 'started'
+    assert markers.state('prepare data', 'def') is None
+
+    markers.done('prepare data', 'abc')
+    assert markers.state('prepare data', 'abc') == 'done'
+    assert markers.state('prepare data', 'def') is None
+
+    # a started stage is no more done
+    markers.start('prepare data', 'def')
+    assert markers.state('prepare data', 'abc') is None
+    assert markers.state('prepare data', 'def') == 'started'
+
+
+def test_utt_fingerprints(tmpdir):
+    corpus = Corpus()
+    corpus.wav_folder = str(tmpdir)
+    corpus.segments = {'u1': ('a.wav', None, None),
+                       'u2': ('a.wav', 0.5, 1),
+                       'u3': ('b.wav', None, None)}
+    with open(os.path.join(corpus.wav_folder, 'a.wav'), 'w') as fwav:
+        fwav.write('a')
+
+    fps = checkpoint.utt_fingerprints(corpus)
+    assert sorted(fps.keys()) == ['u1', 'u2', 'u3']
+    assert len(set(fps.values())) == 3
+
+    # modify a segment and a wav
+    corpus.segments['u2'] = ('a.wav', 0.5, 1.5)
+    with open(os.path.join(corpus.wav_folder, 'b.wav'), 'w') as fwav:
+        fwav.write('b')
+    fps2 = checkpoint.utt_fingerprints(corpus)
+    assert fps2['u1'] == fps['u1']
+    assert fps2['u2'] != fps['u2']
+    assert fps2['u3'] != fps['u3']
+
+
+class _Recipe(AbstractRecipe):
+    name = 'test'
+
+    def __init__(self, output_dir, nspeakers):
+        super(_Recipe, self).__init__(Corpus(), output_dir)
+        self.a2k.corpus.utt2spk = {
+            'u{}'.format(n): 's{}'.format(n) for n in range(nspeakers)}
+        self.created = []
+
+    def create(self):
+        self.check_parameters()
+        self.created.append(self.njobs)
+
+    def run(self):
+        pass
+
+
+def test_resume_njobs(tmpdir, monkeypatch):
+    capacity = [4]
+    monkeypatch.setattr(
+        utils, 'default_njobs', lambda local=False: capacity[0])
+
+    recipe = _Recipe(str(tmpdir), 10)
+    recipe.njobs = 8
+    recipe.compute()
+    assert recipe.created == [4]
+
+    # the capacity changed, but the data is split for 4 jobs
+    capacity[0] = 2
+    recipe = _Recipe(str(tmpdir), 10)
+    recipe.njobs = 8
+    recipe.resume = True
+    recipe.compute()
+    assert recipe.created == []
+    assert recipe.njobs == 4
+
+    # njobs is computed again when asking for another njobs
+    recipe = _Recipe(str(tmpdir), 10)
+    recipe.njobs = 3
+    recipe.resume = True
+    recipe.compute()
+    assert recipe.created == [2]
@@ -0,0 +1,119 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.features.chunked_pitch module"""
+
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from abkhazia.features import chunked_pitch
+from abkhazia.kaldi import ArkReader, kaldi_path
+from abkhazia.utils import config, jobs
+
+
+def _has_kaldi_pitch():
+    return os.path.isfile(os.path.join(
+        config.get('kaldi', 'kaldi-directory'),
+        'src', 'featbin', 'compute-kaldi-pitch-feats'))
+
+
+def test_split_segments():
+    chunks = chunked_pitch.split_segments(
+        {'u1': ('a.wav', 1.0, 3.5), 'u2': ('b.wav', 0.0, 10.0)},
+        chunk_size=4.0, overlap=1.0)
+
+    assert [c[0] for c in chunks] == [
+        'u1-pitch0000', 'u2-pitch0000', 'u2-pitch0001', 'u2-pitch0002']
+    assert chunks[0][1:] == ('u1', 'a.wav', 1.0, 3.5, 0)
+
+    # the last chunk extends to the end of the utterance
+    assert [c[3:] for c in chunks[1:]] == [
+        (0.0, 5.0, 0), (4.0, 9.0, 400), (8.0, 10.0, 800)]
+
+
+@pytest.mark.parametrize('nframes', [None, 999, 1001])
+def test_stitch(nframes):
+    # pitch-like smooth features, the chunks differ at their edges
+    times = np.arange(1000) / 100.0
+    feats = np.vstack((np.sin(times), 100 + 10 * np.cos(times))).T
+
+    chunks = []
+    for offset, end in ((0, 500), (400, 900), (800, 1000)):
+        chunk = feats[offset:end].copy()
+        chunk[:5] += 0.01
+        chunk[-5:] -= 0.01
+        chunks.append((offset, chunk))
+
+    stitched = chunked_pitch.stitch(chunks, nframes=nframes)
+    assert stitched.dtype == np.float32
+    assert stitched.shape == (nframes or 1000, 2)
+
+    n = min(nframes or 1000, 1000)
+    assert np.allclose(stitched[:n], feats[:n], atol=0.01)
+    assert np.allclose(stitched[:n][10:-10], feats[:n][10:-10], atol=1e-3)
+    if nframes > 1000:
+        assert np.array_equal(stitched[-1], stitched[999])
+
+
+@pytest.mark.skipif(not _has_kaldi_pitch(), reason='kaldi not installed')
+def test_chunked_pitch_kaldi(tmpdir):
+    # a 60s harmonic signal with a pitch gliding between 100 and 200 Hz
+    rate, duration = 16000, 60.0
+    times = np.arange(int(rate * duration)) / float(rate)
+    f0 = 150 + 50 * np.sin(2 * np.pi * times / 20.0)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    signal = sum(np.sin(h * phase) / h for h in range(1, 6))
+    signal = (signal / np.abs(signal).max() * 2 ** 14).astype(np.int16)
+
+    tmpdir = str(tmpdir)
+    wav = os.path.join(tmpdir, 'w.wav')
+    out = wave.open(wav, 'wb')
+    out.setnchannels(1)
+    out.setsampwidth(2)
+    out.setframerate(rate)
+    out.writeframes(signal.tostring())
+    out.close()
+
+    with open(os.path.join(tmpdir, 'wav.scp'), 'w') as out:
+        out.write('w {}\n'.format(wav))
+
+    chunks = chunked_pitch.split_segments(
+        {'w': ('w', 0.0, duration)}, chunk_size=10.0, overlap=1.0)
+    with open(os.path.join(tmpdir, 'segments'), 'w') as out:
+        for chunk, _, wav_id, tbegin, tend, _ in chunks:
+            out.write('{} {} {:.3f} {:.3f}\n'.format(
+                chunk, wav_id, tbegin, tend))
+
+    for command in (
+            'compute-kaldi-pitch-feats scp:wav.scp ark:whole.ark',
+            'compute-kaldi-pitch-feats "ark:extract-segments scp:wav.scp '
+            'segments ark:- |" ark:chunks.ark'):
+        jobs.run(command, stdout=open(os.devnull, 'w').write,
+                       cwd=tmpdir, env=kaldi_path())
+
+    with ArkReader(os.path.join(tmpdir, 'whole.ark')) as reader:
+        whole = reader['w']
+    with ArkReader(os.path.join(tmpdir, 'chunks.ark')) as reader:
+        stitched = chunked_pitch.stitch(
+            [(c[5], reader[c[0]]) for c in chunks], nframes=whole.shape[0])
+
+    # tolerance: on 99% of the frames, the pitch differs by less
+    # than 2% and the NCCF by less than 0.05 from the unsplit result
+    nccf_error = np.abs(stitched[:, 0] - whole[:, 0])
+    pitch_error = np.abs(stitched[:, 1] - whole[:, 1]) / whole[:, 1]
+    assert np.percentile(nccf_error, 99) < 0.05
+    assert np.percentile(pitch_error, 99) < 0.02
@@ -0,0 +1,119 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.disk_budget module"""
+
+import os
+import pytest
+
+from abkhazia.abstract_recipe import AbstractRecipe
+from abkhazia.corpus import Corpus
+from abkhazia.utils import disk_budget
+
+
+def _write(path, size):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fout:
+        fout.write('a' * size)
+
+
+def test_clean(tmpdir):
+    directory = str(tmpdir)
+    exp = os.path.join(directory, 'exp', 'mono')
+    for name in ('1.mdl', '2.mdl', 'tree'):
+        _write(os.path.join(exp, name), 1000)
+    os.symlink('2.mdl', os.path.join(exp, 'final.mdl'))
+
+    budget = disk_budget.DiskBudget(directory, max_size=1500 / 2.0**30)
+    assert budget.measure() == 3000 + len('2.mdl')
+    with pytest.raises(RuntimeError):
+        budget.check()
+
+    # the last model is kept as targeted by final.mdl
+    assert budget.clean([os.path.join('exp', 'mono', '[0-9]*')]) == 1000
+    assert sorted(os.listdir(exp)) == ['2.mdl', 'final.mdl', 'tree']
+    assert budget.clean([os.path.join('exp', 'mono')]) > 0
+    assert not os.path.exists(exp)
+
+    assert budget.check() == 0
+    assert budget.peak == 3000 + len('2.mdl')
+
+
+class _Recipe(AbstractRecipe):
+    name = 'test'
+
+    def __init__(self, output_dir):
+        super(_Recipe, self).__init__(Corpus(), output_dir)
+        self.scale = 1
+        self.executed = []
+
+    def _stage(self, name, reads, writes):
+        def _function():
+            for read in reads:
+                assert os.path.isfile(os.path.join(self.recipe_dir, read))
+            _write(os.path.join(self.recipe_dir, writes), 1000)
+            self.executed.append(name)
+        return _function
+
+    def _intermediate_files(self):
+        return {'lattice': (['best', 'post'], ['lat.*']),
+                'best': (['phones'], ['best.*'])}
+
+    def run(self):
+        self._run_stage('lattice', self._stage('lattice', [], 'lat.1'))
+        self._run_stage(
+            'best', self._stage('best', ['lat.1'], 'best.1'),
+            params=[self.scale])
+        self._run_stage('post', self._stage('post', ['lat.1'], 'post.1'))
+        self._run_stage(
+            'phones', self._stage('phones', ['best.1'], 'phones.1'))
+
+
+def test_recipe(tmpdir):
+    recipe = _Recipe(str(tmpdir))
+    recipe.run()
+    assert recipe.executed == ['lattice', 'best', 'post', 'phones']
+    assert sorted(os.listdir(recipe.recipe_dir)) == [
+        'phones.1', 'post.1', 'stages']
+    assert recipe.disk_budget.peak >= 3000
+
+    # the peak is appended to the comment of meta.txt
+    recipe.meta.comment = 'a comment'
+    recipe.export()
+    assert 'comment: a comment. peak disk usage of the recipe' in open(
+        os.path.join(recipe.output_dir, 'meta.txt')).read()
+
+    # the lattices are regenerated when the best path is computed
+    # again, then deleted
+    recipe = _Recipe(str(tmpdir))
+    recipe.resume = True
+    recipe.scale = 2
+    recipe.run()
+    assert recipe.executed == ['lattice', 'best', 'post', 'phones']
+    assert sorted(os.listdir(recipe.recipe_dir)) == [
+        'phones.1', 'post.1', 'stages']
+
+    # nothing is deleted when the recipe directory is kept, unless a
+    # disk budget is defined
+    recipe = _Recipe(str(tmpdir))
+    recipe.delete_recipe = False
+    recipe.run()
+    assert 'lat.1' in os.listdir(recipe.recipe_dir)
+
+    recipe = _Recipe(str(tmpdir))
+    recipe.delete_recipe = False
+    recipe.disk_budget.max_size = 1
+    recipe.run()
+    assert 'lat.1' not in os.listdir(recipe.recipe_dir)
@@ -15,12 +15,16 @@
 """Test of the abkhazia.models.features module"""
 
 import h5features
+import numpy as np
 import os
 import pytest
+import time
 
 import abkhazia.features as features
 import abkhazia.utils as utils
 import abkhazia.kaldi.ark as ark
+from abkhazia.features import Features
+from abkhazia.kaldi import ArkWriter, ScpReader
 from .conftest import assert_no_expr_in_log
 
 params = [(pitch, ftype)
@@ -83,3 +87,97 @@ def test_features(pitch, ftype, corpus, tmpdir):
     assert len(times.keys()) == len(subcorpus.utts())
     for t, c in zip(times.keys(), subcorpus.utts()):
         assert t == c
+
+
+def test_import_h5features(corpus, features, tmpdir):
+    # export the features to h5features and import them back
+    h5 = os.path.join(str(tmpdir), 'feats.h5')
+    ark.scp_to_h5f(os.path.join(features, 'feats.scp'), h5)
+
+    output_dir = os.path.join(str(tmpdir), 'imported')
+    Features.import_h5features(h5, corpus, output_dir, njobs=2)
+    Features.check_features(output_dir)
+
+    data = h5features.Reader(h5, 'features').read().dict_features()
+    with ScpReader(os.path.join(output_dir, 'feats.scp')) as scp:
+        assert sorted(scp.keys()) == sorted(data.keys())
+        for utt in scp.keys():
+            assert (scp[utt] == data[utt]).all()
+
+
+def test_storage_tradeoff(features, tmpdir):
+    """Check the size and precision of the features storage options
+
+    The size, write and read throughput and maximal error of each
+    option are reported as a table (shown with pytest -s), only the
+    size and error are asserted.
+
+    """
+    with ScpReader(os.path.join(features, 'feats.scp')) as scp:
+        data = {utt: np.array(scp[utt]) for utt in scp.keys()}
+    megabytes = sum(d.astype(np.float32).nbytes for d in data.values()) / 1e6
+
+    def _write_ark(compress):
+        ark = os.path.join(str(tmpdir), 'feats{}.ark'.format(compress))
+        with ArkWriter(ark, ark + '.scp', compress=compress) as writer:
+            for utt in sorted(data):
+                writer.write(utt, data[utt])
+        return ark
+
+    def _read_ark(path):
+        with ScpReader(path + '.scp') as reader:
+            return {utt: reader[utt] for utt in reader.keys()}
+
+    def _write_h5f(dtype, compression):
+        arks = [os.path.join(str(tmpdir), 'featsFalse.ark')]
+        h5 = os.path.join(str(tmpdir), 'feats_{}_{}.h5'.format(
+            dtype, compression))
+        ark.ark_to_h5f(arks, h5, dtype=dtype, compression=compression)
+        return h5
+
+    def _read_h5f(path):
+        return h5features.Reader(path, 'features').read().dict_features()
+
+    sizes, errors, table = {}, {}, []
+    for name, write, read, args in (
+            ('ark float32', _write_ark, _read_ark, (False,)),
+            ('ark compressed', _write_ark, _read_ark, (True,)),
+            ('h5f float32', _write_h5f, _read_h5f, (None, None)),
+            ('h5f float32 lzf', _write_h5f, _read_h5f, (None, 'lzf')),
+            ('h5f float32 gzip', _write_h5f, _read_h5f, (None, 'gzip')),
+            ('h5f float16', _write_h5f, _read_h5f, ('float16', None)),
+            ('h5f float16 gzip', _write_h5f, _read_h5f,
+             ('float16', 'gzip'))):
+        tstart = time.time()
+        path = write(*args)
+        twrite = time.time() - tstart
+
+        tstart = time.time()
+        loaded = read(path)
+        tread = time.time() - tstart
+
+        sizes[name] = os.path.getsize(path)
+        errors[name] = max(
+            np.abs(loaded[utt] - data[utt]).max() for utt in data)
+        table.append('{:<17} {:>7} kB  write {:>7.1f} MB/s  '
+                     'read {:>7.1f} MB/s  error {:.2g}'.format(
+                         name, sizes[name] // 1000,
+                         megabytes / max(twrite, 1e-6),
+                         megabytes / max(tread, 1e-6), errors[name]))
+
+    print('\nfeatures storage on {:.1f} MB of float32 data:\n{}'.format(
+        megabytes, '\n'.join(table)))
+
+    # the float32 storages are lossless
+    assert errors['ark float32'] == 0
+    assert errors['h5f float32'] == 0
+    assert errors['h5f float32 gzip'] == 0
+
+    # the compressed storages are smaller
+    assert sizes['ark compressed'] < sizes['ark float32'] / 2
+    assert sizes['h5f float32 gzip'] < sizes['h5f float32']
+    assert sizes['h5f float16'] < sizes['h5f float32']
+
+    # float16 has a 11 bits mantissa, the error is at most half an ulp
+    bound = max(np.abs(d).max() for d in data.values()) * 2.0**-11
+    assert errors['h5f float16'] <= bound
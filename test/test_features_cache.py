@@ -0,0 +1,104 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.features.features_cache module"""
+
+import os
+
+import numpy as np
+
+from abkhazia.features.features_cache import FeaturesCache, unshare
+from abkhazia.kaldi import ArkWriter, ScpReader
+
+
+def _features(directory, value=0):
+    """Write a features directory with feats.scp and a sub-ark"""
+    os.makedirs(os.path.join(directory, 'increment.1'))
+    with ArkWriter(os.path.join(directory, 'raw.1.ark'),
+                   os.path.join(directory, 'feats.scp')) as ark:
+        ark.write('u1', np.full((2, 3), value, dtype=np.float32))
+    with ArkWriter(os.path.join(directory, 'increment.1', 'raw.1.ark'),
+                   os.path.join(directory, 'increment.1', 'feats.scp')) as ark:
+        ark.write('u2', np.full((4, 3), value, dtype=np.float32))
+
+    with open(os.path.join(directory, 'feats.scp'), 'a') as scp:
+        scp.write(open(
+            os.path.join(directory, 'increment.1', 'feats.scp')).read())
+
+
+def test_store_restore(tmpdir):
+    source = os.path.join(str(tmpdir), 'source')
+    dest = os.path.join(str(tmpdir), 'dest')
+    _features(source, value=1)
+
+    cache = FeaturesCache(os.path.join(str(tmpdir), 'cache'))
+    assert not cache.restore('key', dest, ['feats.scp'])
+    cache.store('key', source, ['feats.scp'])
+    assert 'key' in cache
+
+    # the source arks are hardlinked in cache
+    assert os.stat(os.path.join(source, 'raw.1.ark')).st_nlink == 2
+
+    assert cache.restore('key', dest, ['feats.scp'])
+    with ScpReader(os.path.join(dest, 'feats.scp')) as feats:
+        assert feats.keys() == ['u1', 'u2']
+        assert feats.index['u2'][0] == os.path.join(
+            dest, 'increment.1', 'raw.1.ark')
+        assert np.all(feats['u2'] == 1)
+
+    # recomputing the features in dest must not alter the cache
+    unshare(dest)
+    assert os.stat(os.path.join(source, 'raw.1.ark')).st_nlink == 2
+    assert os.stat(os.path.join(dest, 'raw.1.ark')).st_nlink == 1
+    with ArkWriter(os.path.join(dest, 'raw.1.ark')) as ark:
+        ark.write('u1', np.zeros((1, 1), dtype=np.float32))
+    with ScpReader(os.path.join(source, 'feats.scp')) as feats:
+        assert np.all(feats['u1'] == 1)
+
+
+def test_evict(tmpdir):
+    cache = FeaturesCache(
+        os.path.join(str(tmpdir), 'cache'), max_size=250 / float(2**30))
+
+    for key in ('a', 'b'):
+        source = os.path.join(str(tmpdir), key)
+        _features(source)
+        cache.store(key, source, ['feats.scp'])
+        os.utime(os.path.join(cache.directory, key), (0, 0))
+    assert 'a' not in cache
+    assert 'b' in cache
+
+
+def test_evict_after_restore(tmpdir, monkeypatch):
+    source = os.path.join(str(tmpdir), 'source')
+    dest = os.path.join(str(tmpdir), 'dest')
+    _features(source, value=1)
+
+    cache = FeaturesCache(os.path.join(str(tmpdir), 'cache'))
+    cache.store('key', source, ['feats.scp'])
+
+    # emulate a cache on another device than the restored features
+    def _cross_device(src, dest):
+        raise OSError('cross-device link')
+    monkeypatch.setattr(os, 'link', _cross_device)
+    assert cache.restore('key', dest, ['feats.scp'])
+    assert not os.path.islink(os.path.join(dest, 'raw.1.ark'))
+
+    # the restored features survive the eviction of the entry
+    cache.max_size = 0
+    cache.evict()
+    assert 'key' not in cache
+    with ScpReader(os.path.join(dest, 'feats.scp')) as feats:
+        assert np.all(feats['u1'] == 1)
+        assert np.all(feats['u2'] == 1)
@@ -0,0 +1,324 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.jobs package"""
+
+import os
+import time
+import pytest
+
+from abkhazia.utils import jobs
+from abkhazia.utils.jobs import scheduler, backends, pipeline, sizing
+
+
+def test_parse_job_range():
+    assert scheduler.parse_job_range('JOB=1:4') == ('JOB', 1, 4)
+    assert scheduler.parse_job_range('log/JOB.log') is None
+    with pytest.raises(ValueError):
+        scheduler.parse_job_range('JOB=3:1')
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('0', 0), ('512', 512), ('2k', 2048), ('1.5G', 3 * 2**29), ('2MB', 2**21)])
+def test_parse_memory(value, expected):
+    assert scheduler.parse_memory(value) == expected
+
+
+def test_quote_command():
+    assert scheduler.quote_command(
+        ['echo', 'a b', '|', 'grep', 'say "hi"']) == (
+            'echo "a b" | grep \'say "hi"\'')
+
+
+def test_run(tmpdir):
+    log = os.path.join(str(tmpdir), 'log', 'echo.JOB.log')
+    tasks = scheduler.Task.expand(
+        'echo JOB', log, scheduler.parse_job_range('JOB=1:5'))
+
+    results = scheduler.LocalScheduler(max_jobs=2).run(tasks)
+    assert [r.returncode for r in results] == [0] * 5
+
+    for n in range(1, 6):
+        lines = open(log.replace('JOB', str(n)), 'r').readlines()
+        assert lines[0] == '# echo {}\n'.format(n)
+        assert lines[2] == '{}\n'.format(n)
+        assert lines[-2].startswith('# Accounting: ')
+        assert lines[-1].startswith('# Ended (code 0)')
+
+
+def test_retry_failed_only(tmpdir):
+    # task 2 fails on first attempt, succeed on the second one
+    counter = os.path.join(str(tmpdir), 'counter.JOB')
+    command = ('echo >> {0}; [ JOB != 2 ] || [ $(wc -l < {0}) -ge 2 ]'
+               .format(counter))
+    tasks = scheduler.Task.expand(
+        command, os.path.join(str(tmpdir), 'JOB.log'),
+        scheduler.parse_job_range('JOB=1:3'))
+
+    results = scheduler.LocalScheduler().run(tasks, retries=1)
+    assert [r.returncode for r in results] == [0, 0, 0]
+    assert [r.attempts for r in results] == [1, 2, 1]
+
+    results = scheduler.LocalScheduler().run(
+        [scheduler.Task('exit 3', os.path.join(str(tmpdir), 'fail.log'))],
+        retries=2)
+    assert results[0].returncode == 3
+    assert results[0].attempts == 3
+
+
+def test_memory_limit(tmpdir):
+    # each task requires the whole memory budget, so they run in sequence
+    marker = os.path.join(str(tmpdir), 'running')
+    command = ('[ ! -e {0} ] && touch {0} && sleep 0.1 && rm {0}'
+               .format(marker))
+    tasks = scheduler.Task.expand(
+        command, os.path.join(str(tmpdir), 'JOB.log'),
+        scheduler.parse_job_range('JOB=1:3'), memory=2**30)
+
+    results = scheduler.LocalScheduler(
+        max_jobs=3, max_memory=2**30).run(tasks)
+    assert all(not r.failed for r in results)
+
+
+@pytest.mark.parametrize('name', ['local', 'multiworker'])
+def test_backend(tmpdir, name):
+    backend = backends.get_backend(name)
+    tasks = scheduler.Task.expand(
+        'exit $((JOB % 2))', os.path.join(str(tmpdir), 'JOB.log'),
+        scheduler.parse_job_range('JOB=1:4'))
+
+    ids = [backend.submit(task) for task in tasks]
+    codes = backend.wait(ids)
+    assert [codes[i] for i in ids] == [1, 0, 1, 0]
+    assert [backend.status(i) for i in ids] == [
+        backends.FAILED, backends.DONE, backends.FAILED, backends.DONE]
+    assert backend.capacity() >= 1
+
+
+def test_backend_multiworker_pending(tmpdir):
+    backend = backends.get_backend('multiworker', workers=1)
+    assert backend.capacity() == 1
+
+    ids = [backend.submit(scheduler.Task(
+        'sleep 0.2', os.path.join(str(tmpdir), '{}.log'.format(n))))
+           for n in range(2)]
+
+    # a single worker so the second task waits the first one
+    assert backend.status(ids[1]) == backends.PENDING
+    backend.wait(ids)
+    assert [backend.status(i) for i in ids] == [backends.DONE] * 2
+
+
+def test_backend_run_wall_time(tmpdir):
+    backend = backends.get_backend('local')
+    tasks = [scheduler.Task(
+        'sleep {}'.format(t), os.path.join(str(tmpdir), '{}.log'.format(t)))
+             for t in (0, 1)]
+
+    # each job is timed on its own, not on the whole batch
+    results = backend.run(tasks)
+    assert [r.returncode for r in results] == [0, 0]
+    assert results[0].wall < 0.5
+    assert 1 <= results[1].wall < 1.5
+
+
+def test_backend_gridengine(tmpdir, monkeypatch):
+    # fake qsub, qstat and qdel commands recording their arguments
+    bindir = os.path.join(str(tmpdir), 'bin')
+    os.makedirs(bindir)
+    for name, output in (
+            ('qsub', 'echo 42'),
+            ('qstat', 'printf "id prior name user state\\n'
+             '41 0.5 a b r\\n42 0.5 a b Eqw\\n43 0.5 a b qw\\n"'),
+            ('qdel', 'true')):
+        command = os.path.join(bindir, name)
+        with open(command, 'w') as fcommand:
+            fcommand.write('#!/bin/bash\necho {} "$@" >> {}\n{}\n'.format(
+                name, os.path.join(bindir, 'calls'), output))
+        os.chmod(command, 0o755)
+    monkeypatch.setenv('PATH', bindir + ':' + os.environ['PATH'])
+
+    backend = backends.GridEngineBackend()
+    log = os.path.join(str(tmpdir), 'log', 'a.log')
+    assert backend.submit(scheduler.Task('true', log)) == '42'
+    backend.submit(scheduler.Task('true', log, threads=4))
+    assert backend.status('42') == backends.FAILED
+    assert backend._status('41') == backends.RUNNING
+    assert backend._status('43') == backends.PENDING
+
+    calls = open(os.path.join(bindir, 'calls')).read().split('\n')
+    qsub = [c for c in calls if c.startswith('qsub')]
+    assert '-pe smp' not in qsub[0]
+    assert '-pe smp 4' in qsub[1]
+    assert 'qdel 42' in calls
+
+
+def test_backend_unknown():
+    with pytest.raises(RuntimeError):
+        backends.get_backend('unknown')
+
+
+def test_run_output():
+    output = []
+    stats = jobs.run(
+        'bash -c "for i in 1 2 3; do echo $i; done; exit 0"',
+        stdout=output.append)
+
+    # the output is forwarded by batches, not line by line
+    assert ''.join(output) == '1\n2\n3\n\n'
+    assert len(output) < 4
+    assert sorted(stats.keys()) == ['cpu', 'maxrss', 'wall']
+    assert stats['maxrss'] > 0
+
+    with pytest.raises(RuntimeError):
+        jobs.run('bash -c "exit 2"', stdout=output.append)
+    jobs.run('bash -c "exit 2"', stdout=output.append, returncode=2)
+
+
+def test_run_timeout():
+    start = time.time()
+    with pytest.raises(RuntimeError) as err:
+        jobs.run('sleep 10', stdout=lambda _: None, timeout=0.2)
+    assert 'timed out' in str(err.value)
+    assert time.time() - start < 5
+
+
+def test_run_many(tmpdir):
+    output = []
+    stats = jobs.run_many(
+        ['bash -c "sleep 0.2; echo {}"'.format(n) for n in range(4)],
+        stdout=output.append, max_jobs=2)
+
+    assert len(stats) == 4
+    assert all(s['wall'] >= 0.2 for s in stats)
+    assert sorted(''.join(output).split()) == ['0', '1', '2', '3']
+
+
+def test_run_many_cancel(tmpdir):
+    marker = os.path.join(str(tmpdir), 'marker')
+    start = time.time()
+    with pytest.raises(RuntimeError) as err:
+        jobs.run_many(
+            ['bash -c "sleep 0.1; exit 1"', 'sleep 10',
+             'touch {}'.format(marker)],
+            stdout=lambda _: None, max_jobs=2)
+
+    # the sleeping command is killed, the pending one never launched
+    assert 'exit 1' in str(err.value)
+    assert time.time() - start < 5
+    assert not os.path.exists(marker)
+
+
+def test_depends(tmpdir):
+    order = os.path.join(str(tmpdir), 'order')
+    first = scheduler.Task(
+        'sleep 0.1; echo 1 >> {}'.format(order),
+        os.path.join(str(tmpdir), '1.log'))
+    second = scheduler.Task(
+        'echo 2 >> {}'.format(order),
+        os.path.join(str(tmpdir), '2.log'), depends=[first])
+    failed = scheduler.Task('exit 1', os.path.join(str(tmpdir), '3.log'))
+    cancelled = scheduler.Task(
+        'true', os.path.join(str(tmpdir), '4.log'), depends=[failed])
+
+    results = scheduler.LocalScheduler(max_jobs=4).run(
+        [second, first, cancelled, failed])
+    assert [r.returncode for r in results] == [0, 0, None, 1]
+    assert open(order, 'r').read() == '1\n2\n'
+
+    second.depends.append(second)
+    with pytest.raises(RuntimeError):
+        scheduler.LocalScheduler().run([second])
+
+
+class _Pipeline(pipeline.Pipeline):
+    """Run the steps commands in bash instead of abkhazia"""
+    @staticmethod
+    def _command(step):
+        return step.command
+
+
+def test_pipeline(tmpdir):
+    spec = os.path.join(str(tmpdir), 'pipeline.conf')
+    with open(spec, 'w') as out:
+        out.write(
+            '[c]\ncommand: cat a b > c\ndepends: a b\noutputs: c\n\n'
+            '[a]\ncommand: echo a > a # -j 2\noutputs: a\n\n'
+            '[b]\ncommand: echo b > b\noutputs: b\nmemory: 1k\n')
+
+    steps = pipeline.read_spec(spec)
+    assert [s.name for s in pipeline.sort_steps(steps)] == ['a', 'b', 'c']
+    assert [(s.threads, s.memory) for s in steps] == [
+        (1, 0), (2, 0), (1, 1024)]
+
+    directory = os.path.join(str(tmpdir), 'pipeline')
+    states = _Pipeline(steps, directory, cwd=str(tmpdir)).run()
+    assert states == {'a': 'done', 'b': 'done', 'c': 'done'}
+    assert open(os.path.join(str(tmpdir), 'c')).read() == 'a\nb\n'
+
+    # completed steps are skipped, unless their outputs changed
+    states = _Pipeline(steps, directory, cwd=str(tmpdir)).run()
+    assert states == {'a': 'skipped', 'b': 'skipped', 'c': 'skipped'}
+
+    with open(os.path.join(str(tmpdir), 'b'), 'w') as out:
+        out.write('modified\n')
+    os.utime(os.path.join(str(tmpdir), 'b'), (0, 0))
+    states = _Pipeline(steps, directory, cwd=str(tmpdir)).run()
+    assert states == {'a': 'skipped', 'b': 'done', 'c': 'done'}
+
+    # a failed step cancels the ones depending on it
+    steps[1].command = 'exit 1'
+    with pytest.raises(RuntimeError):
+        _Pipeline(steps, directory, cwd=str(tmpdir)).run()
+
+
+def test_pipeline_invalid():
+    with pytest.raises(IOError):
+        pipeline.sort_steps([pipeline.Step('a', 'true', depends=['b'])])
+    with pytest.raises(IOError):
+        pipeline.sort_steps([
+            pipeline.Step('a', 'true', depends=['b']),
+            pipeline.Step('b', 'true', depends=['a'])])
+
+
+def test_memory_model(tmpdir):
+    calibration = os.path.join(str(tmpdir), 'memory.json')
+    model = sizing.MemoryModel(calibration)
+    durations = {'a': 100.0, 'b': 100.0, 'c': 50.0, 'd': 50.0}
+    assert sizing.job_frames(durations, 2) == 15000
+
+    # 4 jobs of 50 MB each, plus the base
+    model.calibrate('Align.align', 10000, 10, maxrss=(
+        model.base + 50 * 2**20) / 1024)
+    assert os.path.isfile(calibration)
+    assert model.estimate('Align.align', 10000, 10) == model.base + 50 * 2**20
+
+    memory = 4 * (model.base + 50 * 2**20)
+    assert model.njobs('Align.align', durations, 10, 8, memory=memory) == 4
+    assert model.njobs('Align.align', durations, 10, 8, memory=1) == 1
+
+    # a larger beam needs more memory, the calibration is conservative
+    assert model.njobs(
+        'Align.align', durations, 10, 8, beam=26, memory=memory) == 3
+    model = sizing.MemoryModel(calibration)
+    model.calibrate('Align.align', 10000, 10, maxrss=model.base / 1024)
+    assert model.njobs('Align.align', durations, 10, 8, memory=memory) == 4
+
+    # the stages are calibrated apart, the prior is used before that
+    assert model.coefficient('Monophone.train') == model.default_prior
+    assert model.coefficient('Monophone.train', prior=3.0) == 3.0
+    model.calibrate('NeuralNetwork.train', 10000, 10, maxrss=(
+        model.base + 500 * 2**20) / 1024)
+    assert model.coefficient('Monophone.train', prior=3.0) == 3.0
+    assert model.coefficient('NeuralNetwork.train', prior=3.0) > 3.0
@@ -69,3 +69,36 @@ def test_silence_probability(prob, corpus, tmpdir):
         lm.export()
         language_model.check_language_model(output_dir)
         assert_no_expr_in_log(flog, 'error')
+
+
+def test_scratch_staging(corpus, tmpdir):
+    scratch = os.path.join(str(tmpdir), 'scratch')
+    output_dir = os.path.join(str(tmpdir), 'lang')
+    utils.config.set('abkhazia', 'scratch-directory', scratch)
+    try:
+        lm = language_model.LanguageModel(corpus, output_dir)
+        assert lm.recipe_dir.startswith(scratch)
+        assert not os.path.exists(os.path.join(output_dir, 'recipe'))
+
+        lm.level = 'word'
+        lm.order = 2
+        lm.compute()
+        language_model.check_language_model(output_dir)
+
+        # the recipe is built in output_dir when the scratch is too small
+        language_model.LanguageModel.intermediate_ratio = 1e12
+        try:
+            lm = language_model.LanguageModel(corpus, output_dir)
+        finally:
+            del language_model.LanguageModel.intermediate_ratio
+        assert lm.recipe_dir == os.path.join(output_dir, 'recipe')
+
+        # the scratch is not visible from the nodes of a cluster
+        utils.config.set('kaldi', 'backend', 'slurm')
+        try:
+            lm = language_model.LanguageModel(corpus, output_dir)
+        finally:
+            utils.config.set('kaldi', 'backend', '')
+        assert lm.recipe_dir == os.path.join(output_dir, 'recipe')
+    finally:
+        utils.config.set('abkhazia', 'scratch-directory', '')
@@ -0,0 +1,285 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.features.numpy_features module"""
+
+import os
+import wave
+
+import numpy as np
+import pytest
+
+import abkhazia.features.numpy_features as npf
+from abkhazia.corpus import Corpus
+from abkhazia.kaldi import ArkWriter, ScpReader
+
+
+@pytest.fixture(scope='module')
+def signal():
+    """Return 0.5 second of a noisy sinusoid sampled at 16 kHz"""
+    time = np.arange(8000) / 16000.0
+    state = np.random.RandomState(0)
+    return np.round(8000 * np.sin(2 * np.pi * 440 * time) +
+                    100 * state.standard_normal(8000))
+
+
+def _kaldi_mfcc_frame(frame, num_ceps=13, num_bins=23, lifter=22):
+    """Reference MFCC of a single frame, step by step as in Kaldi"""
+    frame = frame - frame.mean()
+    energy = np.log(np.dot(frame, frame))
+    frame = np.concatenate(([frame[0] * 0.03], frame[1:] - 0.97 * frame[:-1]))
+    frame *= npf.window_function(frame.shape[0])
+    power = np.abs(np.fft.rfft(frame, n=512)) ** 2
+
+    mel = np.zeros(num_bins)
+    banks = npf.mel_banks(num_bins, 512, 16000)
+    for b in range(num_bins):
+        for i in range(256):
+            mel[b] += banks[b, i] * power[i]
+
+    ceps = npf.dct_matrix(num_ceps, num_bins).dot(np.log(mel))
+    for i in range(num_ceps):
+        ceps[i] *= 1 + 0.5 * lifter * np.sin(np.pi * i / lifter)
+    ceps[0] = energy
+    return ceps
+
+
+def test_mel_banks():
+    banks = npf.mel_banks(23, 512, 16000)
+    assert banks.shape == (23, 256)
+    assert banks.min() == 0 and banks.max() <= 1
+    # no weight below 20 Hz, the bins are non empty
+    assert not banks[:, 0].any()
+    assert all(banks.sum(axis=1) > 0)
+
+
+def test_dct_matrix():
+    dct = npf.dct_matrix(23, 23)
+    assert np.allclose(dct.dot(dct.T), np.eye(23))
+
+
+def test_frames(signal):
+    extractor = npf.Extractor('mfcc')
+    frames = extractor.frames(signal, 16000)
+    assert frames.shape == (1 + (8000 - 400) // 160, 400)
+    assert np.array_equal(frames[2], signal[320:720])
+    assert extractor.frames(signal[:399], 16000).shape[0] == 0
+
+
+def test_mfcc(signal):
+    extractor = npf.Extractor('mfcc', {'dither': 0})
+    mfcc = extractor.compute(signal)
+    assert mfcc.dtype == np.float32
+    assert mfcc.shape == (48, 13)
+
+    for n in (0, 10, 47):
+        expected = _kaldi_mfcc_frame(signal[n * 160:n * 160 + 400])
+        assert np.allclose(mfcc[n], expected, rtol=1e-4, atol=1e-3)
+
+
+def test_fbank(signal):
+    fbank = npf.Extractor(
+        'fbank', {'dither': '0', 'num-mel-bins': '40'}).compute(signal)
+    assert fbank.shape == (48, 40)
+
+    energy = npf.Extractor(
+        'fbank', {'dither': 0, 'num-mel-bins': 40, 'use-energy': 'true'})
+    assert np.allclose(energy.compute(signal)[:, 1:], fbank)
+
+
+def test_dither(signal):
+    extractor = npf.Extractor('mfcc')
+    assert not np.array_equal(
+        extractor.compute(signal), extractor.compute(signal))
+
+
+@pytest.mark.parametrize('type, options', [
+    ('plp', {}), ('mfcc', {'use-log-fbank': 'true'}),
+    ('fbank', {'num-ceps': 3})])
+def test_bad_options(type, options):
+    with pytest.raises(RuntimeError):
+        npf.Extractor(type, options)
+
+
+def test_compute_corpus(tmpdir, signal):
+    corpus = Corpus()
+    corpus.wav_folder = str(tmpdir)
+    wav = wave.open(os.path.join(corpus.wav_folder, 'a.wav'), 'wb')
+    wav.setparams((1, 2, 16000, 0, 'NONE', 'not compressed'))
+    wav.writeframes(signal.astype('<i2').tostring())
+    wav.close()
+
+    corpus.segments = {'u1': ('a.wav', None, None),
+                       'u2': ('a.wav', 0.25, None),
+                       'u3': ('a.wav', 0.1, 0.12)}
+    extractor = npf.Extractor('mfcc', {'dither': 0})
+    fbank = npf.Extractor.from_kaldi_options(
+        'fbank', [('dither', 0), ('num-ceps', 3)], strict=False)
+    scps = npf.compute_corpus(
+        corpus, [extractor, fbank], str(tmpdir),
+        {'u1': 1, 'u2': 2, 'u3': 2})
+    assert sorted(scps.keys()) == ['fbank', 'mfcc']
+    assert [os.path.basename(s) for s in scps['fbank']] == [
+        'raw_fbank_features.1.scp', 'raw_fbank_features.2.scp']
+
+    with ScpReader(scps['fbank'][0]) as scp:
+        assert np.array_equal(scp['u1'], fbank.compute(signal))
+
+    scps = scps['mfcc']
+
+    with ScpReader(scps[0]) as scp:
+        assert np.array_equal(scp['u1'], extractor.compute(signal))
+
+    # u3 is too short to have a frame
+    with ScpReader(scps[1]) as scp:
+        assert scp.keys() == ['u2']
+        assert np.array_equal(
+            scp['u2'], extractor.compute(signal[4000:]))
+
+
+def test_cmvn_stats():
+    state = np.random.RandomState(0)
+    feats = [state.standard_normal((n, 4)).astype(np.float32)
+             for n in (10, 5)]
+    stats = npf.cmvn_stats(feats)
+    assert stats.shape == (2, 5)
+
+    frames = np.concatenate(feats).astype(np.float64)
+    assert np.allclose(stats[0], np.append(frames.sum(axis=0), 15))
+    assert np.allclose(stats[1], np.append((frames ** 2).sum(axis=0), 0))
+
+
+def _kaldi_deltas(feats, order, window=2):
+    """Reference deltas computed frame by frame as in Kaldi"""
+    output = [feats]
+    for _ in range(order):
+        previous = output[-1]
+        delta = np.zeros(feats.shape)
+        for t in range(feats.shape[0]):
+            for j in range(1, window + 1):
+                delta[t] += j * (previous[min(t + j, feats.shape[0] - 1)] -
+                                 previous[max(t - j, 0)])
+        output.append(delta / (2.0 * sum(j * j for j in range(1, 3))))
+    return np.hstack(output)
+
+
+@pytest.mark.parametrize('nframes', [1, 3, 20])
+def test_add_deltas(nframes):
+    feats = np.random.RandomState(0).standard_normal(
+        (nframes, 3)).astype(np.float32)
+    assert np.allclose(npf.add_deltas(feats, 0), feats)
+
+    deltas = npf.add_deltas(feats, 2)
+    assert deltas.dtype == np.float32
+    assert deltas.shape == (nframes, 9)
+
+    # Kaldi applies a single filter per order on the replicated edge
+    # frames, so iterated deltas differ only near the edges
+    reference = _kaldi_deltas(feats, 2)
+    assert np.allclose(deltas[:, :6], reference[:, :6], atol=1e-5)
+    assert np.allclose(deltas[4:-4], reference[4:-4], atol=1e-5)
+
+
+def test_commit_scp(tmpdir):
+    scp = os.path.join(str(tmpdir), 'raw.1.scp')
+    with ArkWriter(os.path.join(str(tmpdir), 'raw.1.ark'), scp) as ark:
+        ark.write('u1', np.zeros((2, 3), dtype=np.float32))
+    assert npf.rewritten_ark(scp, 'deltas') == os.path.join(
+        str(tmpdir), 'raw.1.deltas.ark')
+    assert not npf.is_rewritten(scp, 'deltas')
+
+    # the scp is replaced and the previous ark deleted at commit
+    with ArkWriter(npf.rewritten_ark(scp, 'deltas'), scp + '.tmp') as ark:
+        ark.write('u1', np.zeros((2, 6), dtype=np.float32))
+    npf.commit_scp(scp, scp + '.tmp')
+    assert npf.is_rewritten(scp, 'deltas')
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'raw.1.deltas.ark', 'raw.1.scp']
+
+    # the arks left by an interrupted commit are deleted
+    open(os.path.join(str(tmpdir), 'raw.1.voiced.ark'), 'w').close()
+    open(os.path.join(str(tmpdir), 'raw.10.ark'), 'w').close()
+    npf.commit_scp(scp)
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'raw.1.deltas.ark', 'raw.1.scp', 'raw.10.ark']
+
+
+def test_postprocess_scps(tmpdir):
+    state = np.random.RandomState(0)
+    feats = {'u1': state.standard_normal((10, 3)).astype(np.float32),
+             'u2': state.standard_normal((5, 3)).astype(np.float32)}
+    scp = os.path.join(str(tmpdir), 'raw.1.scp')
+    with ArkWriter(os.path.join(str(tmpdir), 'raw.1.ark'), scp) as ark:
+        for utt in sorted(feats):
+            ark.write(utt, feats[utt])
+
+    stats = npf.postprocess_scps(
+        [scp], delta_order=1, utt2spk={'u1': 's1', 'u2': 's1'})
+    assert stats.keys() == ['s1']
+    assert np.allclose(stats['s1'], npf.cmvn_stats(feats.values()))
+
+    with ScpReader(scp) as reader:
+        assert reader.keys() == ['u1', 'u2']
+        for utt in reader:
+            assert np.allclose(reader[utt], npf.add_deltas(feats[utt], 1))
+    assert sorted(os.listdir(str(tmpdir))) == ['raw.1.deltas.ark', 'raw.1.scp']
+
+    # a repeated call does not compute deltas of deltas, the CMVN
+    # statistics are computed on the raw part of the features
+    stats = npf.postprocess_scps(
+        [scp], delta_order=1, utt2spk={'u1': 's1', 'u2': 's1'})
+    assert np.allclose(stats['s1'], npf.cmvn_stats(feats.values()))
+    with ScpReader(scp) as reader:
+        for utt in reader:
+            assert np.allclose(reader[utt], npf.add_deltas(feats[utt], 1))
+
+
+@pytest.mark.parametrize('context', [0, 2])
+def test_vad_energy(context):
+    feats = np.random.RandomState(0).standard_normal(
+        (50, 3)).astype(np.float32)
+    feats[:, 0] *= 10
+    vad = npf.vad_energy(feats, energy_threshold=1, frames_context=context)
+
+    # reference implementation, frame by frame as in Kaldi
+    threshold = 1 + 0.5 * feats[:, 0].mean()
+    for t in range(50):
+        window = feats[max(t - context, 0):t + context + 1, 0]
+        assert vad[t] == ((window > threshold).sum() >= 0.6 * len(window))
+
+
+def test_select_voiced_frames(tmpdir):
+    feats = {'u1': np.arange(12, dtype=np.float32).reshape(4, 3),
+             'u2': np.ones((2, 3), dtype=np.float32)}
+    vad = {'u1': np.array([0, 1, 1, 0], dtype=np.float32),
+           'u2': np.zeros(2, dtype=np.float32)}
+    for name, data in (('raw', feats), ('vad', vad)):
+        with ArkWriter(os.path.join(str(tmpdir), name + '.ark'),
+                       os.path.join(str(tmpdir), name + '.scp')) as ark:
+            for utt in sorted(data):
+                ark.write(utt, data[utt])
+
+    scp = os.path.join(str(tmpdir), 'raw.scp')
+    vad_scp = os.path.join(str(tmpdir), 'vad.scp')
+    assert npf.select_voiced_frames([scp], vad_scp) == 1
+    with ScpReader(scp) as reader:
+        assert reader.keys() == ['u1']
+        assert np.array_equal(reader['u1'], feats['u1'][1:3])
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'raw.scp', 'raw.voiced.ark', 'vad.ark', 'vad.scp']
+
+    # the frames are not dropped again when the stage is repeated
+    assert npf.select_voiced_frames([scp], vad_scp) == 0
+    with ScpReader(scp) as reader:
+        assert np.array_equal(reader['u1'], feats['u1'][1:3])
@@ -0,0 +1,49 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.profiler module"""
+
+import json
+import os
+
+from abkhazia.utils import jobs, profiler
+
+
+def test_profile_stage(tmpdir):
+    log_dir = os.path.join(str(tmpdir), 'exp', 'log')
+    prof = profiler.Profiler()
+
+    with prof.stage('compute', log_dir=str(tmpdir)):
+        stats = jobs.run(
+            'bash -c "echo a"', stdout=open(os.devnull, 'w').write)
+        prof.add_command('echo a', stats)
+
+        tasks = jobs.Task.expand(
+            'true', os.path.join(log_dir, 'align.JOB.log'),
+            jobs.parse_job_range('JOB=1:3'))
+        jobs.LocalScheduler().run(tasks)
+    prof.skip('export')
+
+    assert [s['name'] for s in prof.stages] == ['compute', 'export']
+    compute = prof.stages[0]
+    assert compute['commands'][0]['command'] == 'echo a'
+    assert compute['maxrss'] > 0
+    assert compute['jobs'][os.path.join('exp', 'log', 'align')][
+        'njobs'] == 3
+
+    # the profile is JSON serializable and summarized as a table
+    prof.save(os.path.join(str(tmpdir), 'profile.json'))
+    assert json.load(open(os.path.join(str(tmpdir), 'profile.json')))[
+        'stages'][1]['skipped'] is True
+    assert len(prof.summary().split('\n')) == 4
@@ -0,0 +1,121 @@
+# Copyright 2016 Thomas Schatz, Xuan-Nga Cao, Mathieu Bernard
+#
+# This file is part of abkhazia: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Abkhazia is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with abkhazia. If not, see <http://www.gnu.org/licenses/>.
+"""Test of the abkhazia.utils.progress module"""
+
+import os
+
+from abkhazia.utils import jobs, progress
+
+
+def _write_log(path, nutts, ended=False):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'a') as log:
+        log.write('# gmm-latgen-faster ...\n')
+        for n in range(nutts):
+            log.write(
+                'LOG (gmm-latgen-faster[5.1]:DecodeUtteranceLatticeFaster():'
+                'decoder-wrappers.cc:286) Log-like per frame for utterance '
+                'utt{} is -8.5 over 100 frames.\n'.format(n))
+        if ended:
+            log.write('# Accounting: time=1 threads=1\n')
+            log.write('# Ended (code 0) at Thu Jan 1 00:00:00 1970\n')
+
+
+def test_progress_utterances(tmpdir):
+    log_dir = os.path.join(str(tmpdir), 'exp', 'decode', 'log')
+    monitor = progress.ProgressMonitor(
+        str(tmpdir), command='steps/decode.sh exp/graph data exp/decode',
+        total_utterances=40)
+    monitor.start -= 10
+
+    _write_log(os.path.join(log_dir, 'decode.1.log'), 10, ended=True)
+    _write_log(os.path.join(log_dir, 'decode.2.log'), 5)
+    monitor._scan(since=monitor.start)
+
+    report = monitor.report(now=monitor.start + 10)
+    assert report.startswith(
+        os.path.join('exp', 'decode', 'log', 'decode') + ': jobs 1/2 done')
+    assert '15/40 utterances' in report
+    assert '1.5 utt/s' in report
+    assert 'realtime factor 0.667' in report
+    assert 'ETA 0:00:16' in report
+
+    # only the appended lines are parsed
+    _write_log(os.path.join(log_dir, 'decode.2.log'), 5, ended=True)
+    monitor._scan(since=monitor.start)
+    assert '20/40 utterances' in monitor.report(now=monitor.start + 10)
+
+
+def test_progress_iterations(tmpdir):
+    monitor = progress.ProgressMonitor(
+        str(tmpdir),
+        command='steps/train_mono.sh --num-iters 40 data lang exp/mono')
+    assert monitor.report() is None
+
+    monitor.output('train_mono.sh: Pass 1\ntrain_mono.sh: Pass 2\n')
+    monitor._first_iteration = (1, monitor.start - 10)
+    assert monitor._iteration == 2
+
+    _write_log(os.path.join(
+        str(tmpdir), 'exp', 'mono', 'log', 'acc.3.1.log'), 0)
+    monitor._scan(since=monitor.start)
+    report = monitor.report(now=monitor.start)
+    assert 'acc.3: jobs 0/1 done' in report
+    assert 'iteration 3/40' in report
+    assert 'ETA 0:03:05' in report
+
+
+def test_progress_log_names(tmpdir):
+    monitor = progress.ProgressMonitor(
+        str(tmpdir), command='steps/nnet2/train_pnorm_fast.sh '
+        '--cmd "run.pl --mem 2G" data lang exp/tri exp/nnet')
+    assert monitor._log_dirs == [
+        os.path.join(str(tmpdir), d, 'log') for d in (
+            'steps/nnet2/train_pnorm_fast.sh', 'data', 'lang', 'exp/tri',
+            'exp/nnet')]
+
+    # only the per-job logs in the directories of the command are read
+    log_dir = os.path.join(str(tmpdir), 'exp', 'nnet', 'log')
+    for name in ('compute_prob_valid.10.log', 'update.3.log'):
+        _write_log(os.path.join(log_dir, name), 1)
+    _write_log(os.path.join(str(tmpdir), 'exp', 'mono', 'log',
+                            'train.1.1.log'), 1)
+    monitor._scan(since=monitor.start)
+    assert monitor.report() is None
+
+    _write_log(os.path.join(log_dir, 'train.10.3.log'), 1)
+    monitor._scan(since=monitor.start)
+    assert monitor.report().startswith(os.path.join(
+        'exp', 'nnet', 'log', 'train.10') + ': jobs 0/1 done')
+    assert monitor._iteration == 10
+
+
+def test_progress_run(tmpdir):
+    reports = []
+
+    class Log(object):
+        def info(self, msg, *args):
+            reports.append(msg % args)
+
+    monitor = progress.ProgressMonitor(
+        str(tmpdir), command='run.pl JOB=1:1 log/align.JOB.log', log=Log())
+    monitor.interval = 0.1
+    jobs.run(
+        'bash -c "mkdir -p log; sleep 0.2; echo a >> log/align.1.log; '
+        'sleep 0.3"', cwd=str(tmpdir), stdout=lambda _: None,
+        monitor=monitor)
+    assert reports
+    assert reports[-1].startswith('progress: log/align: jobs 0/1 done')